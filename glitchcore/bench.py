@@ -0,0 +1,219 @@
+import datetime
+import json
+import os
+import subprocess
+import tempfile
+import time
+
+from amaranth import *
+from amaranth.sim import Simulator, Passive
+
+from delay import TriggerDelay
+from event_counter_sync import EventCounterSync
+from glitchcore_uart import GlitchCoreUart
+from glitchcore_wb import GlitchCoreWb
+from pulse import TriggerPulse
+from uart import UART
+from wishbone_bfm import WishboneBFM
+
+
+# Each workload builds a design and a stimulus process that keeps it busy
+# for as long as the simulation runs. The benchmark stops the simulation
+# after a fixed number of cycles, so every run does the same amount of work.
+
+def trigger_workload(cls):
+    def workload():
+        dut = cls()
+        def stimulus():
+            yield Passive()
+            yield dut.threshold.eq(8)
+            while True:
+                yield dut.arm.eq(1)
+                yield
+                yield dut.trigger_in.eq(1)
+                for _ in range(12):
+                    yield
+                yield dut.trigger_in.eq(0)
+                yield dut.arm.eq(0)
+                yield
+        return dut, stimulus
+    return workload
+
+
+def event_counter_sync_workload():
+    dut = EventCounterSync()
+    def stimulus():
+        yield Passive()
+        while True:
+            yield dut.arm_in.eq(1)
+            for i in range(16):
+                yield dut.count_in.eq(i)
+                yield
+            yield dut.trigger_in.eq(1)
+            yield
+            yield dut.trigger_in.eq(0)
+            yield dut.arm_in.eq(0)
+            yield
+    return dut, stimulus
+
+
+def uart_workload():
+    dut = UART(4)
+    def stimulus():
+        yield Passive()
+        byte = 0
+        while True:
+            yield dut.rx_i.eq(dut.tx_o)
+            yield dut.rx_ack.eq(dut.rx_rdy)
+            if (yield dut.tx_ack):
+                yield dut.tx_data.eq(byte)
+                yield dut.tx_rdy.eq(1)
+                byte = (byte + 1) & 0xff
+            else:
+                yield dut.tx_rdy.eq(0)
+            yield
+    return dut, stimulus
+
+
+def glitchcore_wb_workload(native_event_counter=False):
+    dut = GlitchCoreWb(native_event_counter=native_event_counter)
+    write = WishboneBFM(dut).write
+    def stimulus():
+        yield Passive()
+        if native_event_counter:
+            yield from write(0x14, 4)
+        else:
+            # The Verilog event counter is a black box in simulation, so
+            # trigger the delay straight from event_in.
+            yield from write(0x00, 1 << 1)
+        yield from write(0x24, 8)
+        yield from write(0x34, 4)
+        while True:
+            yield from write(0x30, 1)
+            yield from write(0x20, 1)
+            yield from write(0x10, 1)
+            for _ in range(4):
+                yield dut.event_in.eq(1)
+                yield
+                yield dut.event_in.eq(0)
+                yield
+            for _ in range(16):
+                yield
+            yield from write(0x10, 0)
+            yield from write(0x20, 0)
+            yield from write(0x30, 0)
+    return dut, stimulus
+
+
+def glitchcore_uart_workload():
+    divisor = 4
+    dut = GlitchCoreUart(baudrate=12e6 / divisor)
+    def stimulus():
+        yield Passive()
+        yield dut.uart_rx.eq(1)
+        while True:
+            for byte in b"R\x24W\x24\x08\x00\x00\x00":
+                for bit in [0] + [(byte >> i) & 1 for i in range(8)] + [1]:
+                    yield dut.uart_rx.eq(bit)
+                    for _ in range(divisor):
+                        yield
+    return dut, stimulus
+
+
+workloads = {
+    "delay": trigger_workload(TriggerDelay),
+    "pulse": trigger_workload(TriggerPulse),
+    "event_counter_sync": event_counter_sync_workload,
+    "uart": uart_workload,
+    "glitchcore_wb": glitchcore_wb_workload,
+    "glitchcore_wb_native": lambda: glitchcore_wb_workload(native_event_counter=True),
+    "glitchcore_uart": glitchcore_uart_workload,
+}
+
+
+def run(workload, cycles, trace):
+    '''Simulate `cycles` clock cycles of a workload.
+
+    Returns the wall-clock time the simulation took, in seconds.
+    '''
+    dut, stimulus = workload()
+    sim = Simulator(dut)
+    sim.add_clock(1/12e6) # 12 MHz
+    sim.add_sync_process(stimulus)
+
+    start = time.perf_counter()
+    if trace:
+        with tempfile.TemporaryDirectory() as tmp:
+            with sim.write_vcd(os.path.join(tmp, "bench.vcd")):
+                sim.run_until(cycles / 12e6, run_passive=True)
+    else:
+        sim.run_until(cycles / 12e6, run_passive=True)
+    return time.perf_counter() - start
+
+
+def git_commit():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+        dirty = subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit + ("-dirty" if dirty else "")
+
+
+def load_results(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--cycles", type=int, default=20000,
+        help="clock cycles to simulate per run (default: %(default)s)")
+    parser.add_argument("-w", "--workload", action="append", choices=list(workloads),
+        help="run only this workload (can be repeated)")
+    parser.add_argument("-r", "--results", default="bench.json",
+        help="file the results are kept in (default: %(default)s)")
+    parser.add_argument("--compare", metavar="COMMIT",
+        help="compare against this commit's results instead of the latest other commit's")
+    parser.add_argument("--no-store", action="store_true",
+        help="don't add this run to the results file")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    history = load_results(args.results)
+    baseline_commit = args.compare
+    if baseline_commit is None:
+        others = [r["commit"] for r in history if r["commit"] != commit]
+        baseline_commit = others[-1] if others else None
+    baseline = {(r["workload"], r["trace"]): r["cycles_per_second"]
+        for r in history if r["commit"] == baseline_commit}
+
+    print("{:20} {:>6} {:>14} {:>10}".format("workload", "trace", "cycles/s", "vs " + (baseline_commit or "-")))
+    records = []
+    for name in args.workload or workloads:
+        for trace in (False, True):
+            seconds = run(workloads[name], args.cycles, trace)
+            cps = args.cycles / seconds
+            records.append({
+                "commit": commit,
+                "date": datetime.datetime.now().isoformat(timespec="seconds"),
+                "workload": name,
+                "trace": trace,
+                "cycles": args.cycles,
+                "seconds": seconds,
+                "cycles_per_second": cps,
+            })
+            previous = baseline.get((name, trace))
+            change = "{:+.1%}".format(cps / previous - 1) if previous else "-"
+            print("{:20} {:>6} {:14.0f} {:>10}".format(name, "yes" if trace else "no", cps, change), flush=True)
+
+    if not args.no_store:
+        # Keep one set of results per commit; a rerun replaces the old one.
+        ran = {(r["workload"], r["trace"]) for r in records}
+        history = [r for r in history if r["commit"] != commit or (r["workload"], r["trace"]) not in ran]
+        with open(args.results, "w") as f:
+            json.dump(history + records, f, indent=1)
@@ -0,0 +1,169 @@
+import ast
+import concurrent.futures
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+
+from amaranth.back import verilog
+
+from glitchcore_uart import GlitchCoreUart
+
+
+here = os.path.dirname(os.path.abspath(__file__))
+sources = [os.path.join(here, "event_counter_async.v")]
+pcf = os.path.join(here, "glitchcore_uart.pcf")
+
+# The same flow as the Makefile, with {name} standing for the file stem.
+steps = [
+    ["yosys", "-q", "-p", "read_verilog {name}.v event_counter_async.v; synth_ice40; write_json {name}.json"],
+    ["nextpnr-ice40", "--hx1k", "--package", "tq144", "--asc", "{name}.asc", "--json", "{name}.json",
+        "--pcf", "glitchcore_uart.pcf", "--log", "{name}.rpt"],
+    ["icepack", "{name}.asc", "{name}.bin"],
+]
+artifacts = ["json", "asc", "bin", "rpt"]
+
+
+def parse_variant(spec):
+    '''Turn "baudrate=1000000,native_event_counter=True" into keyword arguments.'''
+    params = {}
+    for item in filter(None, spec.split(",")):
+        key, _, value = item.partition("=")
+        try:
+            params[key] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            params[key] = value
+    return params
+
+
+def variant_name(params):
+    return "-".join(["glitchcore_uart"] + ["{}={}".format(k, v) for k, v in sorted(params.items())])
+
+
+def elaborate(params):
+    top = GlitchCoreUart(**params)
+    return verilog.convert(top, name="glitchcore_uart", ports=[
+        # In, from external.
+        top.event_in,
+        top.uart_rx,
+
+        # Out, to external.
+        top.glitch_out,
+        top.uart_tx,
+        top.D1,
+        top.D2,
+        top.D3,
+        top.D4,
+        top.D5,
+    ])
+
+
+def tool_versions():
+    versions = []
+    for tool in ("yosys", "nextpnr-ice40", "icepack"):
+        try:
+            result = subprocess.run([tool, "-V" if tool == "yosys" else "--version"],
+                capture_output=True, text=True)
+            versions.append(result.stdout + result.stderr)
+        except OSError:
+            versions.append(tool + " not found")
+    return versions
+
+
+def cache_key(rtl, versions):
+    '''Hash everything the bitstream depends on.'''
+    h = hashlib.sha256()
+    def add(data):
+        if isinstance(data, str):
+            data = data.encode()
+        h.update(len(data).to_bytes(8, "little"))
+        h.update(data)
+    add(rtl)
+    for path in sources + [pcf]:
+        with open(path, "rb") as f:
+            add(f.read())
+    for step in steps:
+        add(" ".join(step))
+    for version in versions:
+        add(version)
+    return h.hexdigest()
+
+
+def build(params, cache_dir, versions):
+    '''Build one variant into the cache, unless it is already there.
+
+    Returns (cache entry directory, whether it was a cache hit).
+    '''
+    rtl = elaborate(params)
+    entry = os.path.join(cache_dir, cache_key(rtl, versions))
+    if os.path.isdir(entry):
+        return entry, True
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=cache_dir) as tmp:
+        with open(os.path.join(tmp, "glitchcore_uart.v"), "w") as f:
+            f.write(rtl)
+        for path in sources + [pcf]:
+            shutil.copy(path, tmp)
+        for step in steps:
+            subprocess.run([arg.format(name="glitchcore_uart") for arg in step], cwd=tmp, check=True,
+                stdout=subprocess.DEVNULL)
+
+        # Fill a scratch directory first, so a failed or interrupted build
+        # never leaves a half-written entry behind.
+        staging = os.path.join(tmp, "entry")
+        os.mkdir(staging)
+        for ext in artifacts + ["v"]:
+            shutil.copy(os.path.join(tmp, "glitchcore_uart." + ext), staging)
+        try:
+            os.rename(staging, entry)
+        except OSError:
+            # Built by someone else in the meantime; theirs is just as good.
+            if not os.path.isdir(entry):
+                raise
+    return entry, False
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Build GlitchCoreUart variants, reusing cached synthesis results.")
+    parser.add_argument("variants", nargs="*", default=[""], metavar="VARIANT",
+        help="GlitchCoreUart arguments, e.g. baudrate=1000000,native_event_counter=True "
+        "(default: one build with the default arguments)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+        help="variants to build in parallel (default: %(default)s)")
+    parser.add_argument("-c", "--cache", default=os.path.join(here, ".build-cache"),
+        help="cache directory (default: %(default)s)")
+    parser.add_argument("-o", "--output", default=os.path.join(here, "build"),
+        help="directory the bitstreams are copied to (default: %(default)s)")
+    args = parser.parse_args()
+
+    variants = [parse_variant(spec) for spec in args.variants]
+    versions = tool_versions()
+    os.makedirs(args.output, exist_ok=True)
+
+    failed = False
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = {pool.submit(build, params, args.cache, versions): params for params in variants}
+        for future in concurrent.futures.as_completed(futures):
+            name = variant_name(futures[future])
+            try:
+                entry, hit = future.result()
+            except (subprocess.CalledProcessError, OSError) as e:
+                print("{}: failed: {}".format(name, e))
+                failed = True
+                continue
+            for ext in ("bin", "rpt"):
+                shutil.copy(os.path.join(entry, "glitchcore_uart." + ext),
+                    os.path.join(args.output, name + "." + ext))
+            print("{}: {} ({})".format(name, "cached" if hit else "built", os.path.basename(entry)[:12]))
+
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,9 @@ class TriggerDelay(Elaboratable):
         # In, from host.
         self.arm = Signal()
         self.threshold = Signal(width)
+        # Pass the trigger straight through, in the same cycle, ignoring
+        # the threshold.
+        self.zero_delay = Signal()
 
         # Out, to host.
         self.value = Signal(width)
@@ -21,8 +24,12 @@ class TriggerDelay(Elaboratable):
             with m.State("START"):
                 m.d.comb += self.trigger_delayed.eq(0)
                 with m.If((self.arm).bool() & (self.trigger_in).bool()):
-                    m.next = "TRIGGERED"
-                    m.d.sync += self.value.eq(self.value + 1)
+                    with m.If(self.zero_delay):
+                        m.next = "STOP"
+                        m.d.comb += self.trigger_delayed.eq(1)
+                    with m.Else():
+                        m.next = "TRIGGERED"
+                        m.d.sync += self.value.eq(self.value + 1)
             with m.State("TRIGGERED"):
                 m.d.sync += self.value.eq(self.value + 1)
                 with m.If(self.value >= self.threshold):
@@ -41,7 +48,7 @@ class TriggerDelay(Elaboratable):
 
 
 if __name__ == "__main__":
-    from amaranth.sim import Simulator
+    from amaranth.sim import Simulator, Settle
 
     dut = TriggerDelay()
     def bench():
@@ -79,6 +86,21 @@ if __name__ == "__main__":
         assert not (yield dut.trigger_delayed)
         assert not (yield dut.value)
 
+        # Zero delay: out in the same cycle as the trigger, and held.
+        yield dut.trigger_in.eq(0)
+        yield dut.zero_delay.eq(1)
+        yield dut.arm.eq(1)
+        yield
+        yield dut.trigger_in.eq(1)
+        yield Settle()
+        assert (yield dut.trigger_delayed)
+        yield
+        yield dut.trigger_in.eq(0)
+        for _ in range(30):
+            yield
+            assert (yield dut.trigger_delayed)
+        assert not (yield dut.value)
+
     sim = Simulator(dut)
     sim.add_clock(1e-6) # 1 MHz
     sim.add_sync_process(bench)
@@ -0,0 +1,182 @@
+from amaranth import *
+
+
+class EventDDRInput(Elaboratable):
+    '''Sample a pin on both edges of a clock with an iCE40 SB_IO DDR input.
+
+    samples_o holds the sample taken at the rising edge in bit 0 and the
+    one from the falling edge after it in bit 1, so the oldest comes first.
+    Both are in step with the domain's clock.
+    '''
+    def __init__(self, domain="sync"):
+        self.domain = domain
+
+        # In, from external. Has to be a top-level port.
+        self.pin = Signal()
+
+        # Out, to event counter.
+        self.samples_o = Signal(2)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.submodules.io = Instance("SB_IO",
+            # PIN_INPUT_DDR, no output.
+            p_PIN_TYPE = C(0b000000, 6),
+            i_PACKAGE_PIN = self.pin,
+            i_INPUT_CLK = ClockSignal(self.domain),
+            i_CLOCK_ENABLE = 1,
+            o_D_IN_0 = self.samples_o[0],
+            o_D_IN_1 = self.samples_o[1],
+        )
+
+        return m
+
+
+class EventCounterDDR(Elaboratable):
+    '''Count event edges from a sampled event input in the sync domain.
+
+    A drop-in for event_counter_async with the same reset, enable and
+    threshold behaviour, but instead of being clocked by the event it gets
+    `samples` evenly spaced samples of the event per sync cycle, oldest
+    first: two from EventDDRInput, or more from a multi-phase sampler.
+    Every low to high step between successive samples is an event, so a
+    cycle can count up to samples / 2 events. Events come out reliably as
+    long as the event stays high and low for at least one sample period
+    each, and as nothing is clocked by the event, routing can't make it
+    miss or double-count one.
+
+    The trigger is combinational from the samples, so it rises in the
+    cycle the samples with the threshold event in them arrive. For that it
+    can't wait for enable_i, which EventCounterSync drops in response to
+    the trigger, so only reset holds it off. Out of reset, enable_i is only
+    low once the counter has triggered anyway.
+    '''
+    def __init__(self, width=32, samples=2):
+        self.width = width
+        self.samples = samples
+
+        # In, from external.
+        self.samples_i = Signal(samples)
+
+        # In, from sync counter.
+        self.rst_i = Signal()
+        self.enable_i = Signal()
+        self.threshold_i = Signal(width)
+
+        # Out, to sync counter.
+        self.count_o = Signal(width)
+        self.trigger_o = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        last = Signal()
+        m.d.sync += last.eq(self.samples_i[-1])
+
+        before = Cat(last, self.samples_i[:-1])
+        edges = Signal(range(self.samples + 1))
+        m.d.comb += edges.eq(sum(self.samples_i[i] & ~before[i] for i in range(self.samples)))
+
+        # The count before the last event of this cycle, as the Verilog
+        # compares it; it wraps the same way, so a threshold of 0 never
+        # triggers.
+        hit = Signal()
+        triggered = Signal()
+        m.d.comb += [
+            hit.eq(~self.rst_i & (edges != 0) &
+                ((self.count_o + edges - 1)[:self.width] >= (self.threshold_i - 1)[:self.width])),
+            self.trigger_o.eq(triggered | hit),
+        ]
+
+        with m.If(self.rst_i):
+            m.d.sync += [
+                self.count_o.eq(0),
+                triggered.eq(0),
+            ]
+        with m.Else():
+            with m.If(self.enable_i):
+                m.d.sync += self.count_o.eq(self.count_o + edges)
+            with m.If(hit):
+                m.d.sync += triggered.eq(1)
+
+        return m
+
+
+def sample(edges, cycles, samples=2):
+    '''Sample a waveform given by its edge times, in cycles, starting low.
+
+    Returns one int per cycle with `samples` bits, oldest sample in bit 0.
+    '''
+    words = []
+    edge = 0
+    for cycle in range(cycles):
+        word = 0
+        for i in range(samples):
+            t = cycle + i / samples
+            while edge < len(edges) and edges[edge] <= t:
+                edge += 1
+            word |= (edge % 2) << i
+        words.append(word)
+    return words
+
+
+if __name__ == "__main__":
+    import random
+
+    from amaranth.sim import Simulator
+
+    rng = random.Random(1)
+    for samples in (2, 4):
+        # Events as fast as the samples can resolve: every high and low
+        # lasts between one and four sample periods, at random offsets.
+        period = 1 / samples
+        edges = []
+        t = 2.3
+        while t < 150:
+            edges.append(t)
+            t += period * rng.uniform(1, 4)
+        cycles = 160
+        words = sample(edges, cycles, samples)
+        rising = [edges[i] for i in range(0, len(edges), 2)]
+        threshold = len(rising) // 2
+
+        dut = EventCounterDDR(samples=samples)
+        def bench():
+            yield dut.threshold_i.eq(threshold)
+            yield dut.rst_i.eq(1)
+            yield
+            yield dut.rst_i.eq(0)
+            yield dut.enable_i.eq(1)
+            trigger_cycle = None
+            for cycle, word in enumerate(words):
+                yield dut.samples_i.eq(word)
+                yield
+                if trigger_cycle is None and (yield dut.trigger_o):
+                    trigger_cycle = cycle
+            yield
+            assert (yield dut.count_o) == len(rising), ((yield dut.count_o), len(rising))
+            # The threshold event is seen in the cycle whose samples it
+            # shows up in.
+            expected = next(c for c in range(cycles)
+                if sum(1 for r in rising if r <= c + (samples - 1) / samples) >= threshold)
+            assert trigger_cycle == expected, (trigger_cycle, expected)
+
+            # Disabled, nothing counts; reset clears count and trigger.
+            yield dut.enable_i.eq(0)
+            for word in words[:20]:
+                yield dut.samples_i.eq(word)
+                yield
+            assert (yield dut.count_o) == len(rising)
+            yield dut.rst_i.eq(1)
+            yield
+            yield dut.rst_i.eq(0)
+            yield
+            assert (yield dut.count_o) == 0
+            assert not (yield dut.trigger_o)
+
+        sim = Simulator(dut)
+        sim.add_clock(1e-6) # 1 MHz
+        sim.add_sync_process(bench)
+        with sim.write_vcd("event_counter_ddr.vcd"):
+            sim.run()
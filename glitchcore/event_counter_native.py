@@ -0,0 +1,112 @@
+from amaranth import *
+from amaranth.lib.cdc import FFSynchronizer
+
+
+class EventCounterNative(Elaboratable):
+    '''Amaranth version of event_counter_async.v.
+
+    The counter runs in its own `event` domain, clocked by the event input
+    itself, so it sees edges shorter than a sync clock period just like the
+    Verilog module. Unlike the Verilog module, its outputs are brought into
+    the sync domain here: the count crosses as a Gray code, so a sample
+    taken mid-increment is off by at most one, and the trigger goes through
+    a two-stage synchronizer. That costs two sync cycles of trigger latency
+    over the raw Verilog output.
+
+    Reset, enable and threshold come from the sync domain and are used
+    as-is. They only change while the counter is disarmed, and events are
+    too sparse to clock them through a synchronizer first.
+    '''
+    def __init__(self, width=32):
+        self.width = width
+
+        # In, from external.
+        self.event_i = Signal()
+
+        # In, from sync counter.
+        self.rst_i = Signal()
+        self.enable_i = Signal()
+        self.threshold_i = Signal(width)
+
+        # Out, to sync counter.
+        self.count_o = Signal(width)
+        self.trigger_o = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.domains.event = ClockDomain("event", async_reset=True, local=True)
+        m.d.comb += [
+            ClockSignal("event").eq(self.event_i),
+            ResetSignal("event").eq(self.rst_i),
+        ]
+
+        count = Signal(self.width)
+        count_gray = Signal(self.width)
+        trigger = Signal()
+        with m.If(self.enable_i):
+            m.d.event += [
+                count.eq(count + 1),
+                count_gray.eq((count + 1) ^ ((count + 1) >> 1)),
+            ]
+            # Wraps like the Verilog, so a threshold of 0 never triggers.
+            with m.If(count >= (self.threshold_i - 1)[:self.width]):
+                m.d.event += trigger.eq(1)
+
+        count_gray_sync = Signal(self.width)
+        m.submodules += [
+            FFSynchronizer(count_gray, count_gray_sync),
+            FFSynchronizer(trigger, self.trigger_o),
+        ]
+        for i in range(self.width):
+            m.d.comb += self.count_o[i].eq(count_gray_sync[i:].xor())
+
+        return m
+
+
+if __name__ == "__main__":
+    from amaranth.sim import Simulator, Delay
+
+    dut = EventCounterNative()
+    def bench():
+        yield dut.rst_i.eq(1)
+        yield dut.threshold_i.eq(5)
+        for _ in range(4):
+            yield
+        yield dut.rst_i.eq(0)
+        yield dut.enable_i.eq(1)
+        yield
+
+        # Events much shorter than a clock period still count.
+        for i in range(1, 8):
+            yield Delay(100e-9)
+            yield dut.event_i.eq(1)
+            yield Delay(50e-9)
+            yield dut.event_i.eq(0)
+            yield
+            yield
+            yield
+            assert (yield dut.count_o) == i, ((yield dut.count_o), i)
+            assert (yield dut.trigger_o) == (i >= 5)
+
+        yield dut.enable_i.eq(0)
+        yield dut.event_i.eq(1)
+        yield
+        yield dut.event_i.eq(0)
+        yield
+        yield
+        yield
+        assert (yield dut.count_o) == 7
+
+        yield dut.rst_i.eq(1)
+        yield
+        yield
+        yield
+        assert (yield dut.count_o) == 0
+        assert not (yield dut.trigger_o)
+
+    sim = Simulator(dut)
+    sim.add_clock(1e-6) # 1 MHz
+    sim.add_sync_process(bench)
+    with sim.write_vcd("event_counter_native.vcd"):
+        sim.run()
@@ -2,16 +2,50 @@ from amaranth import *
 from amaranth.back import verilog
 
 from delay import TriggerDelay
+from event_counter_ddr import EventCounterDDR
+from event_counter_native import EventCounterNative
 from event_counter_sync import EventCounterSync
+from pattern_trigger import PatternTrigger
 from pulse import TriggerPulse
+from pulse_sequence import PulseSequence
+from sequencer import SweepSequencer
 
 
 class GlitchCore(Elaboratable):
-    def __init__(self, width=32):
+    sequence_depth = 64
+    pattern_depth = 8
+
+    def __init__(self, width=32, native_event_counter=False, ddr_event_counter=False, timestamps=False,
+            pattern_trigger=False, sequence=False, sweep=False):
         self.width = width
+        # Use the Amaranth event counter instead of the Verilog one, e.g.
+        # to simulate the whole design without an external simulator.
+        self.native_event_counter = native_event_counter
+        # Count events from event_ddr_in instead of clocking a counter with
+        # event_in, for event rates close to the clock frequency.
+        self.ddr_event_counter = ddr_event_counter
+        # Count cycles in 64 bits and latch the cycle of each pipeline
+        # edge. Costs about 420 flip-flops, so it's left out unless asked
+        # for; the counter and the latches then read 0.
+        self.timestamps = timestamps
+        # Build in the byte pattern trigger (trigger_sel 2). It takes about
+        # 290 flip-flops, so without it trigger_sel 2 never triggers.
+        self.pattern_trigger = pattern_trigger
+        # Build in the pulse sequence table. Its 64 entries take four block
+        # RAMs and its read register 64 flip-flops, so without it every
+        # trigger plays a single pulse and the sequence length is ignored.
+        self.sequence = sequence
+        # Build in the sweep sequencer. Its counters and bounds take close
+        # to 400 flip-flops, so without it the sweep inputs are ignored and
+        # the host arms every attempt itself.
+        self.sweep = sweep
 
         # In, from external.
         self.event_in = Signal()
+        # In, from external. With ddr_event_counter, the event input sampled
+        # on both clock edges, oldest first (see EventDDRInput). It then
+        # stands in for event_in everywhere, a cycle later.
+        self.event_ddr_in = Signal(2)
 
         # Out, to external.
         self.glitch_out = Signal()
@@ -31,6 +65,7 @@ class GlitchCore(Elaboratable):
         # Out, to host.
         self.delay_count = Signal(width)
         self.delay_trigger_delayed = Signal()
+        self.delay_threshold_used = Signal(width)
 
         # In, from host.
         self.pulse_arm = Signal()
@@ -40,12 +75,57 @@ class GlitchCore(Elaboratable):
         self.pulse_count = Signal(width)
         self.pulse_pulse = Signal()
         self.pulse_fired = Signal()
+        self.pulse_threshold_used = Signal(width)
 
         # In, from host.
         self.event_polarity_in = Signal()
-        self.trigger_sel_in = Signal()
+        # 0: event counter, 1: event input, 2: byte pattern on the event
+        # input, read as a UART line.
+        self.trigger_sel_in = Signal(2)
         self.delay_sel_in = Signal(2)
         self.pulse_sel_in = Signal()
+        self.zero_delay_in = Signal()
+
+        # In, from host.
+        self.sweep_run = Signal()
+        self.sweep_attempts = Signal(width)
+        self.sweep_holdoff = Signal(width)
+        self.sweep_delay_start = Signal(width)
+        self.sweep_delay_stop = Signal(width)
+        self.sweep_delay_step = Signal(width)
+        self.sweep_pulse_start = Signal(width)
+        self.sweep_pulse_stop = Signal(width)
+        self.sweep_pulse_step = Signal(width)
+
+        # Out, to host.
+        self.sweep_busy = Signal()
+        self.sweep_done = Signal(width)
+
+        # In, from host. A table of (delay, width) entries played one after
+        # another from a single trigger; see PulseSequence.
+        self.sequence_length = Signal(range(self.sequence_depth + 1))
+        self.sequence_w_addr = Signal(range(self.sequence_depth))
+        self.sequence_w_delay = Signal(width)
+        self.sequence_w_pulse = Signal(width)
+        self.sequence_w_en = Signal()
+
+        # In, from host. The byte pattern to trigger on and the divisor of
+        # the UART it is received with; see PatternTrigger.
+        self.pattern_divisor = Signal(16, reset=104)
+        self.pattern = Signal(8 * self.pattern_depth)
+        self.pattern_mask = Signal(8 * self.pattern_depth)
+
+        # Out, to host.
+        self.pattern_last_byte = Signal(8)
+
+        # Out, to host. A free-running cycle counter, and its value at the
+        # first edge of each pipeline stage since the pulse was last armed.
+        self.cycle_count = Signal(64)
+        self.event_in_time = Signal(64)
+        self.event_trigger_time = Signal(64)
+        self.delay_trigger_time = Signal(64)
+        self.glitch_rise_time = Signal(64)
+        self.glitch_fall_time = Signal(64)
 
     def elaborate(self, platform):
         m = Module()
@@ -57,15 +137,36 @@ class GlitchCore(Elaboratable):
         trigger_pulse = TriggerPulse(self.width)
 
         event_counter_async_trigger = Signal()
-        event_counter_async = Instance("event_counter_async",
-            p_WIDTH = self.width,
-            i_rst_i = event_counter_sync.rst_out,
-            i_event_i = event_internal,
-            i_enable_i = event_counter_sync.enable_out,
-            i_threshold_i = event_counter_sync.threshold_out,
-            o_count_o = event_counter_sync.count_in,
-            o_trigger_o = event_counter_async_trigger,
-        )
+        if self.ddr_event_counter:
+            event_counter_async = EventCounterDDR(self.width)
+            m.d.comb += [
+                event_counter_async.rst_i.eq(event_counter_sync.rst_out),
+                event_counter_async.samples_i.eq(self.event_ddr_in ^ self.event_polarity_in.replicate(2)),
+                event_counter_async.enable_i.eq(event_counter_sync.enable_out),
+                event_counter_async.threshold_i.eq(event_counter_sync.threshold_out),
+                event_counter_sync.count_in.eq(event_counter_async.count_o),
+                event_counter_async_trigger.eq(event_counter_async.trigger_o),
+            ]
+        elif self.native_event_counter:
+            event_counter_async = EventCounterNative(self.width)
+            m.d.comb += [
+                event_counter_async.rst_i.eq(event_counter_sync.rst_out),
+                event_counter_async.event_i.eq(event_internal),
+                event_counter_async.enable_i.eq(event_counter_sync.enable_out),
+                event_counter_async.threshold_i.eq(event_counter_sync.threshold_out),
+                event_counter_sync.count_in.eq(event_counter_async.count_o),
+                event_counter_async_trigger.eq(event_counter_async.trigger_o),
+            ]
+        else:
+            event_counter_async = Instance("event_counter_async",
+                p_WIDTH = self.width,
+                i_rst_i = event_counter_sync.rst_out,
+                i_event_i = event_internal,
+                i_enable_i = event_counter_sync.enable_out,
+                i_threshold_i = event_counter_sync.threshold_out,
+                o_count_o = event_counter_sync.count_in,
+                o_trigger_o = event_counter_async_trigger,
+            )
 
         m.submodules += [
             event_counter_async,
@@ -75,34 +176,144 @@ class GlitchCore(Elaboratable):
         ]
 
         m.d.comb += [
-            event_counter_sync.arm_in.eq(self.event_counter_arm_in),
             event_counter_sync.threshold_in.eq(self.event_counter_threshold_in),
             self.event_count_out.eq(event_counter_sync.count_out),
             self.event_trigger_out.eq(event_counter_sync.trigger_out),
             event_counter_sync.trigger_in.eq(event_counter_async_trigger),
 
-            trigger_delay.arm.eq(self.delay_arm),
-            trigger_delay.threshold.eq(self.delay_threshold),
+            trigger_delay.zero_delay.eq(self.zero_delay_in),
             self.delay_count.eq(trigger_delay.value),
             self.delay_trigger_delayed.eq(trigger_delay.trigger_delayed),
+            self.delay_threshold_used.eq(trigger_delay.threshold),
 
-            trigger_pulse.arm.eq(self.pulse_arm),
-            trigger_pulse.threshold.eq(self.pulse_threshold),
             self.pulse_count.eq(trigger_pulse.value),
             self.pulse_pulse.eq(trigger_pulse.pulse),
-            self.pulse_fired.eq(trigger_pulse.fired),
+            self.pulse_threshold_used.eq(trigger_pulse.threshold),
         ]
 
-
+        if self.pattern_trigger:
+            pattern_trigger = PatternTrigger(self.pattern_depth)
+            m.submodules += pattern_trigger
+            m.d.comb += [
+                # The pattern trigger takes the event counter's place, so it
+                # is armed along with it.
+                pattern_trigger.rx_i.eq(event_internal),
+                pattern_trigger.arm.eq(event_counter_sync.arm_in),
+                pattern_trigger.divisor_i.eq(self.pattern_divisor),
+                pattern_trigger.pattern.eq(self.pattern),
+                pattern_trigger.mask.eq(self.pattern_mask),
+                self.pattern_last_byte.eq(pattern_trigger.last_byte),
+            ]
+
+        delay_arm = Signal()
+        delay_threshold = Signal(self.width)
+        pulse_arm = Signal()
+        pulse_threshold = Signal(self.width)
+
+        # The arms and thresholds as the host sets them.
+        host = [
+            event_counter_sync.arm_in.eq(self.event_counter_arm_in),
+            delay_arm.eq(self.delay_arm),
+            delay_threshold.eq(self.delay_threshold),
+            pulse_arm.eq(self.pulse_arm),
+            pulse_threshold.eq(self.pulse_threshold),
+        ]
+        if self.sweep:
+            sequencer = SweepSequencer(self.width)
+            m.submodules += sequencer
+            m.d.comb += [
+                sequencer.run.eq(self.sweep_run),
+                sequencer.attempts.eq(self.sweep_attempts),
+                sequencer.holdoff.eq(self.sweep_holdoff),
+                sequencer.delay_start.eq(self.sweep_delay_start),
+                sequencer.delay_stop.eq(self.sweep_delay_stop),
+                sequencer.delay_step.eq(self.sweep_delay_step),
+                sequencer.pulse_start.eq(self.sweep_pulse_start),
+                sequencer.pulse_stop.eq(self.sweep_pulse_stop),
+                sequencer.pulse_step.eq(self.sweep_pulse_step),
+                self.sweep_busy.eq(sequencer.busy),
+                self.sweep_done.eq(sequencer.done),
+                sequencer.pulse.eq(trigger_pulse.pulse),
+                sequencer.fired.eq(self.pulse_fired),
+            ]
+
+            # While a sweep runs, the sequencer re-arms every stage after
+            # each attempt and sets the delay and pulse width.
+            with m.If(sequencer.busy):
+                m.d.comb += [
+                    event_counter_sync.arm_in.eq(sequencer.arm),
+                    delay_arm.eq(sequencer.arm),
+                    delay_threshold.eq(sequencer.delay_threshold),
+                    pulse_arm.eq(sequencer.arm),
+                    pulse_threshold.eq(sequencer.pulse_threshold),
+                ]
+            with m.Else():
+                m.d.comb += host
+        else:
+            m.d.comb += host
+
+        sequence_chain = Signal()
+        if self.sequence:
+            sequence = PulseSequence(self.width, self.sequence_depth)
+            m.submodules += sequence
+            m.d.comb += [
+                sequence.length.eq(self.sequence_length),
+                sequence.w_addr.eq(self.sequence_w_addr),
+                sequence.w_delay.eq(self.sequence_w_delay),
+                sequence.w_pulse.eq(self.sequence_w_pulse),
+                sequence.w_en.eq(self.sequence_w_en),
+                sequence.pulse.eq(trigger_pulse.pulse),
+                sequence.fired.eq(trigger_pulse.fired),
+                sequence_chain.eq(sequence.chain),
+                # Only the last pulse of a sequence counts as the glitch
+                # having fired.
+                self.pulse_fired.eq(trigger_pulse.fired & sequence.last),
+            ]
+
+            # A sequence runs while the pulse generator is armed, by the
+            # host or by a sweep, and briefly disarms the delay and pulse
+            # generator between entries. The event counter stays triggered
+            # throughout.
+            m.d.comb += [
+                sequence.arm.eq(pulse_arm),
+                trigger_delay.arm.eq(delay_arm & ~sequence.rearm),
+                trigger_pulse.arm.eq(pulse_arm & ~sequence.rearm),
+            ]
+            with m.If(sequence.active):
+                m.d.comb += [
+                    trigger_delay.threshold.eq(sequence.delay_threshold),
+                    trigger_pulse.threshold.eq(sequence.pulse_threshold),
+                ]
+            with m.Else():
+                m.d.comb += [
+                    trigger_delay.threshold.eq(delay_threshold),
+                    trigger_pulse.threshold.eq(pulse_threshold),
+                ]
+        else:
+            m.d.comb += [
+                self.pulse_fired.eq(trigger_pulse.fired),
+                trigger_delay.arm.eq(delay_arm),
+                trigger_pulse.arm.eq(pulse_arm),
+                trigger_delay.threshold.eq(delay_threshold),
+                trigger_pulse.threshold.eq(pulse_threshold),
+            ]
+
+        event_input = self.event_ddr_in[-1] if self.ddr_event_counter else self.event_in
         with m.If(self.event_polarity_in == 0):
-            m.d.comb += event_internal.eq(self.event_in)
+            m.d.comb += event_internal.eq(event_input)
         with m.Else():
-            m.d.comb += event_internal.eq(~self.event_in)
+            m.d.comb += event_internal.eq(~event_input)
 
-        with m.If(self.trigger_sel_in == 0):
-            m.d.comb += trigger_delay.trigger_in.eq(event_counter_async_trigger)
-        with m.Else():
-            m.d.comb += trigger_delay.trigger_in.eq(event_internal)
+        delay_trigger = Signal()
+        with m.Switch(self.trigger_sel_in):
+            with m.Case(0):
+                m.d.comb += delay_trigger.eq(event_counter_async_trigger)
+            with m.Case(1):
+                m.d.comb += delay_trigger.eq(event_internal)
+            if self.pattern_trigger:
+                with m.Default():
+                    m.d.comb += delay_trigger.eq(pattern_trigger.trigger)
+        m.d.comb += trigger_delay.trigger_in.eq(delay_trigger | sequence_chain)
 
         with m.Switch(self.delay_sel_in):
             with m.Case(0):
@@ -117,15 +328,165 @@ class GlitchCore(Elaboratable):
         with m.Else():
             m.d.comb += self.glitch_out.eq(trigger_pulse.trigger_in)
 
+        if self.timestamps:
+            m.d.sync += self.cycle_count.eq(self.cycle_count + 1)
+
+            # Clear on the arm from the host or sweep, not on the re-arms
+            # within a sequence, so the latches span the whole sequence.
+            pulse_arm_prev = Signal()
+            m.d.sync += pulse_arm_prev.eq(pulse_arm)
+            rearm = pulse_arm & ~pulse_arm_prev
+
+            # The event latch follows every event edge until the trigger
+            # reaches the delay stage, so it holds the edge that caused the
+            # trigger rather than the first one since arming. Through the
+            # event counter that is only off if another edge comes in the
+            # cycles its trigger takes to get through.
+            event_prev = Signal()
+            trigger_seen = Signal()
+            m.d.sync += event_prev.eq(event_internal)
+            with m.If(rearm):
+                m.d.sync += trigger_seen.eq(0)
+            with m.Else():
+                with m.If(event_internal & ~event_prev & pulse_arm & ~trigger_seen):
+                    m.d.sync += self.event_in_time.eq(self.cycle_count)
+                with m.If(delay_trigger & pulse_arm):
+                    m.d.sync += trigger_seen.eq(1)
+
+            # The others keep the first edge since arming.
+            for signal, rising, latch in (
+                    (event_counter_sync.trigger_out, True, self.event_trigger_time),
+                    (trigger_delay.trigger_delayed, True, self.delay_trigger_time),
+                    (self.glitch_out, True, self.glitch_rise_time),
+                    (self.glitch_out, False, self.glitch_fall_time)):
+                prev = Signal(name=latch.name + "_prev")
+                captured = Signal(name=latch.name + "_captured")
+                edge = (signal & ~prev) if rising else (~signal & prev)
+                m.d.sync += prev.eq(signal)
+                with m.If(rearm):
+                    m.d.sync += captured.eq(0)
+                with m.Elif(edge & pulse_arm & ~captured):
+                    m.d.sync += captured.eq(1)
+                    m.d.sync += latch.eq(self.cycle_count)
+
         return m
 
 
 if __name__ == "__main__":
     from amaranth.sim import Simulator
 
-    dut = GlitchCore()
+    dut = GlitchCore(native_event_counter=True, timestamps=True, sweep=True)
     def bench():
+        # Sweep with the delay triggered straight from a held event input,
+        # so every re-arm starts the next attempt right away.
+        yield dut.trigger_sel_in.eq(1)
+        yield dut.event_in.eq(1)
+        yield dut.sweep_attempts.eq(6)
+        yield dut.sweep_holdoff.eq(2)
+        yield dut.sweep_delay_start.eq(4)
+        yield dut.sweep_delay_stop.eq(8)
+        yield dut.sweep_delay_step.eq(4)
+        yield dut.sweep_pulse_start.eq(1)
+        yield dut.sweep_pulse_stop.eq(3)
+        yield dut.sweep_pulse_step.eq(1)
+        yield dut.sweep_run.eq(1)
+
+        widths = []
+        width = 0
+        for _ in range(200):
+            yield
+            if (yield dut.glitch_out):
+                width += 1
+            elif width:
+                widths.append(width)
+                width = 0
+        assert (yield dut.sweep_done) == 6
+        assert not (yield dut.sweep_busy)
+        assert widths == [1, 2, 3, 1, 2, 3], widths
+
+        # Re-arming by hand clears the latches for the next attempt, which
+        # then shows the delay and pulse width in cycles.
+        yield dut.sweep_run.eq(0)
+        yield dut.event_in.eq(0)
+        yield dut.delay_threshold.eq(5)
+        yield dut.pulse_threshold.eq(2)
+        yield dut.delay_arm.eq(1)
+        yield dut.pulse_arm.eq(1)
+        for _ in range(10):
+            yield
+        yield dut.event_in.eq(1)
+        for _ in range(20):
+            yield
+        event = yield dut.event_in_time
+        delayed = yield dut.delay_trigger_time
+        rise = yield dut.glitch_rise_time
+        fall = yield dut.glitch_fall_time
+        assert event < (yield dut.cycle_count)
+        assert (delayed - event, rise - delayed, fall - rise) == (5, 0, 2), (delayed - event, rise - delayed, fall - rise)
+
+        # Full chain through the event counter: the delay starts once the
+        # third event has been counted.
+        yield dut.delay_arm.eq(0)
+        yield dut.pulse_arm.eq(0)
+        yield dut.event_in.eq(0)
+        yield
+        yield dut.trigger_sel_in.eq(0)
+        yield dut.event_counter_threshold_in.eq(3)
+        yield dut.event_counter_arm_in.eq(1)
+        yield dut.delay_arm.eq(1)
+        yield dut.pulse_arm.eq(1)
+        for _ in range(4):
+            yield
+        for _ in range(2):
+            yield dut.event_in.eq(1)
+            yield
+            yield dut.event_in.eq(0)
+            for _ in range(4):
+                yield
+        assert (yield dut.event_count_out) == 2
+        assert not (yield dut.event_trigger_out)
+        assert not (yield dut.pulse_fired)
+        yield dut.event_in.eq(1)
         yield
+        yield dut.event_in.eq(0)
+        for _ in range(20):
+            yield
+        assert (yield dut.event_count_out) == 3
+        assert (yield dut.event_trigger_out)
+        assert (yield dut.pulse_fired)
+        event = yield dut.event_in_time
+        triggered = yield dut.event_trigger_time
+        rise = yield dut.glitch_rise_time
+        fall = yield dut.glitch_fall_time
+        # The event latch holds the third event, which the count takes
+        # three cycles to cross over from.
+        assert (triggered - event, fall - rise) == (3, 2), (triggered - event, fall - rise)
+
+        # A sweep through the event counter: one burst of three events is
+        # one attempt, and the re-arm after it waits for the counter's
+        # trigger to clear instead of starting another right away.
+        yield dut.event_counter_arm_in.eq(0)
+        yield dut.delay_arm.eq(0)
+        yield dut.pulse_arm.eq(0)
+        for _ in range(4):
+            yield
+        yield dut.sweep_attempts.eq(5)
+        yield dut.sweep_delay_start.eq(4)
+        yield dut.sweep_delay_step.eq(0)
+        yield dut.sweep_pulse_start.eq(1)
+        yield dut.sweep_pulse_step.eq(0)
+        yield dut.sweep_run.eq(1)
+        for _ in range(4):
+            yield
+        for _ in range(3):
+            yield dut.event_in.eq(1)
+            yield
+            yield dut.event_in.eq(0)
+            yield
+        for _ in range(60):
+            yield
+        assert (yield dut.sweep_done) == 1, (yield dut.sweep_done)
+        assert (yield dut.sweep_busy)
 
     sim = Simulator(dut)
     sim.add_clock(1e-6) # 1 MHz
@@ -156,6 +517,7 @@ if __name__ == "__main__":
             # Out, to host.
             top.delay_count,
             top.delay_trigger_delayed,
+            top.delay_threshold_used,
 
             # In, from host.
             top.pulse_arm,
@@ -165,10 +527,50 @@ if __name__ == "__main__":
             top.pulse_count,
             top.pulse_pulse,
             top.pulse_fired,
+            top.pulse_threshold_used,
 
             # In, from host.
             top.event_polarity_in,
             top.trigger_sel_in,
             top.delay_sel_in,
             top.pulse_sel_in,
+            top.zero_delay_in,
+
+            # In, from host.
+            top.sweep_run,
+            top.sweep_attempts,
+            top.sweep_holdoff,
+            top.sweep_delay_start,
+            top.sweep_delay_stop,
+            top.sweep_delay_step,
+            top.sweep_pulse_start,
+            top.sweep_pulse_stop,
+            top.sweep_pulse_step,
+
+            # Out, to host.
+            top.sweep_busy,
+            top.sweep_done,
+
+            # In, from host.
+            top.sequence_length,
+            top.sequence_w_addr,
+            top.sequence_w_delay,
+            top.sequence_w_pulse,
+            top.sequence_w_en,
+
+            # In, from host.
+            top.pattern_divisor,
+            top.pattern,
+            top.pattern_mask,
+
+            # Out, to host.
+            top.pattern_last_byte,
+
+            # Out, to host.
+            top.cycle_count,
+            top.event_in_time,
+            top.event_trigger_time,
+            top.delay_trigger_time,
+            top.glitch_rise_time,
+            top.glitch_fall_time,
         ]))
@@ -1,14 +1,95 @@
+import functools
+import operator
 import struct
 
 from amaranth import *
 from amaranth.back import verilog
+from amaranth.lib.cdc import FFSynchronizer
+from amaranth.lib.fifo import SyncFIFOBuffered
 
-from uart import UART
+from event_counter_ddr import EventDDRInput
 from glitchcore_wb import GlitchCoreWb
+from pll import PLL, pll_config
+from uart import UART
+from wishbone_cdc import WishboneCDC
+
+
+def crc8(crc, byte, poly=0x07):
+    '''Return the CRC-8 of `byte` continued from `crc`, MSB first.'''
+    value = Value.cast(crc ^ byte)
+    # Each result bit is the XOR of a fixed set of bits of `value`; work out
+    # which ones instead of chaining eight shift steps.
+    taps = [{i} for i in range(8)]
+    for _ in range(8):
+        msb = taps[7]
+        taps = [set()] + taps[:7]
+        for i in range(8):
+            if poly >> i & 1:
+                taps[i] = taps[i] ^ msb
+    return Cat(*(functools.reduce(operator.xor, (value[i] for i in sorted(t)), C(0, 1)) for t in taps))
 
 
 class GlitchCoreUart(Elaboratable):
-    def __init__(self):
+    rx_fifo_depth = 512
+
+    # Framed mode: requests and responses are wrapped as
+    #   SOF, seq, len, payload[len], crc          (request)
+    #   SOF, seq, command, words, data[4*words], crc  (response)
+    # with the CRC-8 taken over every byte before it. The request payload is
+    # one command in the unframed format, e.g. "R" addr.
+    frame_sof = 0x7e
+    frame_nak = 0x15
+    frame_payload_max = 8
+
+    def __init__(self, clk_freq=12e6, baudrate=115200, switch_timeout=0.25, frame_timeout=0.01, native_event_counter=False,
+            core_clk_freq=None, pll=True, ddr_event_counter=False, result_fifo=False, result_fifo_depth=256,
+            result_fields=GlitchCoreWb.default_result_fields, timestamps=False, pattern_trigger=False, framing=False,
+            sequence=False, staging=False, sweep=False, baud_switching=False, rx_fifo=False):
+        self.clk_freq = clk_freq
+        self.baudrate = baudrate
+        # Build in changing the baud rate at 0xf0, over two hundred logic
+        # cells for the divisor registers and the switch timeout. Without it
+        # the UART runs at `baudrate` only.
+        self.baud_switching = baud_switching
+        # Seconds a new baud rate divisor has to be confirmed in before the
+        # UART falls back to the previous one.
+        self.switch_timeout = switch_timeout
+        # Buffer received bytes in a block RAM FIFO, so the host can send
+        # the next commands while a response is still going out. Without it
+        # a byte that arrives during a response is lost, and the host has
+        # to wait for each response; bit 3 of 0xf8 tells it which.
+        self.rx_fifo = rx_fifo
+        # Build in framed mode, which the host can then switch to at 0xf8.
+        # Without it the bridge only speaks the plain protocol.
+        self.framing = framing
+        # Seconds of silence after which a partly received frame is dropped.
+        self.frame_timeout = frame_timeout
+        self.native_event_counter = native_event_counter
+        # Sample event_in with a DDR input register on the core clock and
+        # count edges from the samples; see EventCounterDDR.
+        self.ddr_event_counter = ddr_event_counter
+        # The result FIFO, its size and contents; see GlitchCoreWb. Without
+        # it the bridge leaves out the drain command too.
+        self.result_fifo = result_fifo
+        self.result_fifo_depth = result_fifo_depth
+        self.result_fields = result_fields
+        self.timestamps = timestamps
+        self.pattern_trigger = pattern_trigger
+        self.sequence = sequence
+        self.staging = staging
+        self.sweep = sweep
+        # With core_clk_freq set, GlitchCoreWb runs in a `core` domain of
+        # its own, clocked by the PLL (or by a simulator, with pll=False),
+        # while the UART side stays on the input clock.
+        self.core_domain = core_clk_freq is not None
+        self.pll = pll
+        if not self.core_domain:
+            self.core_clk_freq = clk_freq
+        elif pll:
+            self.core_clk_freq = pll_config(clk_freq, core_clk_freq)[0]
+        else:
+            self.core_clk_freq = core_clk_freq
+
         # In, from external.
         self.event_in = Signal()
         self.uart_rx = Signal()
@@ -26,17 +107,60 @@ class GlitchCoreUart(Elaboratable):
     def elaborate(self, platform):
         m = Module()
 
-        gc = GlitchCoreWb()
-        m.submodules += gc
+        gc = GlitchCoreWb(clk_freq=self.core_clk_freq, native_event_counter=self.native_event_counter,
+            ddr_event_counter=self.ddr_event_counter, result_fifo=self.result_fifo,
+            result_fifo_depth=self.result_fifo_depth, result_fields=self.result_fields, timestamps=self.timestamps, pattern_trigger=self.pattern_trigger,
+            sequence=self.sequence, staging=self.staging, sweep=self.sweep)
+        fired = Signal()
+        if self.core_domain:
+            m.domains.core = ClockDomain("core")
+            if self.pll:
+                m.submodules += PLL(self.clk_freq, self.core_clk_freq, domain="core")
+            bus = WishboneCDC(o_domain="core")
+            m.submodules += [bus, DomainRenamer("core")(gc)]
+            m.submodules += FFSynchronizer(gc.fired_out, fired)
+            m.d.comb += [
+                gc.wb_adr_i.eq(bus.wbm_adr_o),
+                gc.wb_dat_i.eq(bus.wbm_dat_o),
+                gc.wb_we_i.eq(bus.wbm_we_o),
+                gc.wb_sel_i.eq(bus.wbm_sel_o),
+                gc.wb_stb_i.eq(bus.wbm_stb_o),
+                gc.wb_cyc_i.eq(bus.wbm_cyc_o),
+                bus.wbm_dat_i.eq(gc.wb_dat_o),
+                bus.wbm_ack_i.eq(gc.wb_ack_o),
+            ]
+        else:
+            bus = gc
+            m.submodules += gc
+            m.d.comb += fired.eq(gc.fired_out)
+
+        # The pin can only feed the DDR register once it's used.
+        if self.ddr_event_counter:
+            event_ddr = EventDDRInput(domain="core" if self.core_domain else "sync")
+            m.submodules += event_ddr
+            m.d.comb += [
+                event_ddr.pin.eq(self.event_in),
+                gc.event_ddr_in.eq(event_ddr.samples_o),
+            ]
+        else:
+            m.d.comb += gc.event_in.eq(self.event_in)
 
-        uart = UART(int(12e6/115200))
+        divisor = int(round(self.clk_freq/self.baudrate))
+        uart = UART(divisor, divisor_bits=16 if self.baud_switching else None)
         m.submodules += uart
 
-        wbm_adr_o = Signal(32)
+        # Buffer received bytes so the host can pipeline commands while a
+        # response is still being transmitted.
+        if self.rx_fifo:
+            rx_fifo = SyncFIFOBuffered(width=8, depth=self.rx_fifo_depth)
+            m.submodules += rx_fifo
+
+        # The core decodes only the low byte of the address, so keep just
+        # that and the block read increment stays an 8-bit adder.
+        wbm_adr_o = Signal(8)
         wbm_dat_o = Signal(32)
         wbm_dat_i = Signal(32)
         wbm_we_o = Signal()
-        wbm_sel_o = Signal(4)
         wbm_stb_o = Signal()
         wbm_ack_i = Signal()
         wbm_cyc_o = Signal()
@@ -51,9 +175,40 @@ class GlitchCoreUart(Elaboratable):
         rx_rdy  = Signal()
         rx_ack  = Signal()
 
+        # Registers from 0xf0 up belong to this bridge rather than to
+        # GlitchCoreWb:
+        #   0xf0: UART baud rate divisor, read-only unless baud switching
+        #         is built in.
+        #   0xf4: UART clock frequency in Hz (read-only).
+        #   0xf8: Bit 0 enables framed mode. Bits 1, 2 and 3 (read-only)
+        #         are set if framed mode, baud switching and the RX FIFO
+        #         are built in.
+        local_sel = wbm_adr_o[4:8] == 0xf
+        local_dat = Signal(32)
+        local_ack = Signal()
+
+        divisor_confirm = Signal()
+
+        framed = Signal()
+        frame_buf = Array(Signal(8, name="frame_buf{}".format(i)) for i in range(self.frame_payload_max))
+        frame_seq = Signal(8)
+        frame_len = Signal(8)
+        frame_ptr = Signal(range(self.frame_payload_max + 1))
+        frame_timer = Signal(range(int(self.clk_freq * self.frame_timeout) + 1))
+        frame_expired = Signal()
+        rx_crc = Signal(8)
+        tx_crc = Signal(8)
+        # Commands are taken from frame_buf instead of the RX FIFO.
+        replay = Signal()
+        # A response frame is being sent, so it needs a CRC at the end.
+        in_frame = Signal()
+        # The response header is in `data`, and what to do once it's sent.
+        tx_header = Signal()
+        header_next = Signal(2)
+        notify_seq = Signal(8)
+
         m.d.comb += [
             # In, from external.
-            gc.event_in.eq(self.event_in),
             uart.rx_i.eq(self.uart_rx),
 
             # Out, to external.
@@ -65,67 +220,271 @@ class GlitchCoreUart(Elaboratable):
             self.D4.eq(0),
             self.D5.eq(1),
 
-            gc.wb_adr_i.eq(wbm_adr_o),
-            gc.wb_dat_i.eq(wbm_dat_o),
-            wbm_dat_i.eq(gc.wb_dat_o),
-            gc.wb_we_i.eq(wbm_we_o),
-            gc.wb_sel_i.eq(wbm_sel_o),
-            gc.wb_stb_i.eq(wbm_stb_o),
-            wbm_ack_i.eq(gc.wb_ack_o),
-            gc.wb_cyc_i.eq(wbm_cyc_o),
+            bus.wb_adr_i.eq(wbm_adr_o),
+            bus.wb_dat_i.eq(wbm_dat_o),
+            bus.wb_we_i.eq(wbm_we_o),
+            # Every transfer is a whole word, which lets the core drop
+            # its byte lane merging.
+            bus.wb_sel_i.eq(0b1111),
+            bus.wb_stb_i.eq(wbm_stb_o & ~local_sel),
+            bus.wb_cyc_i.eq(wbm_cyc_o & ~local_sel),
+            wbm_dat_i.eq(Mux(local_sel, local_dat, bus.wb_dat_o)),
+            wbm_ack_i.eq(Mux(local_sel, local_ack, bus.wb_ack_o)),
 
             uart.tx_data.eq(tx_data),
             uart.tx_rdy.eq(tx_rdy),
             tx_ack.eq(uart.tx_ack),
 
-            rx_data.eq(uart.rx_data),
             rx_err.eq(uart.rx_err),
             rx_ovf.eq(uart.rx_ovf),
-            rx_rdy.eq(uart.rx_rdy),
-            uart.rx_ack.eq(rx_ack),
         ]
 
+        # The bytes the bridge takes commands from, while not replaying a
+        # frame.
+        if self.rx_fifo:
+            m.d.comb += [
+                rx_fifo.w_data.eq(uart.rx_data),
+                rx_fifo.w_en.eq(uart.rx_rdy),
+                uart.rx_ack.eq(rx_fifo.w_rdy),
+
+                rx_fifo.r_en.eq(rx_ack & ~replay),
+            ]
+            in_data, in_rdy = rx_fifo.r_data, rx_fifo.r_rdy
+        else:
+            m.d.comb += uart.rx_ack.eq(rx_ack & ~replay)
+            in_data, in_rdy = uart.rx_data, uart.rx_rdy
+
+        if self.framing:
+            m.d.comb += [
+                rx_data.eq(Mux(replay, frame_buf[frame_ptr], in_data)),
+                rx_rdy.eq(Mux(replay, frame_ptr != frame_len, in_rdy)),
+                frame_expired.eq(frame_timer == int(self.clk_freq * self.frame_timeout)),
+            ]
+
+            with m.If(rx_ack & replay):
+                m.d.sync += frame_ptr.eq(frame_ptr + 1)
+
+            with m.If(rx_ack):
+                m.d.sync += frame_timer.eq(0)
+            with m.Elif(~frame_expired):
+                m.d.sync += frame_timer.eq(frame_timer + 1)
+        else:
+            m.d.comb += [
+                rx_data.eq(in_data),
+                rx_rdy.eq(in_rdy),
+            ]
+
+        with m.Switch(wbm_adr_o[:8]):
+            with m.Case(0xf0):
+                m.d.sync += local_dat.eq(uart.divisor_i if self.baud_switching else divisor)
+            with m.Case(0xf4):
+                m.d.sync += local_dat.eq(int(self.clk_freq))
+            with m.Case(0xf8):
+                m.d.sync += local_dat.eq(Cat(framed, Const(self.framing), Const(self.baud_switching), Const(self.rx_fifo)))
+            with m.Default():
+                m.d.sync += local_dat.eq(0)
+        m.d.sync += local_ack.eq(wbm_stb_o & local_sel)
+
         command = Signal(8)
         data = Signal(32)
         dword_byte_idx = Signal(range(4))
+        block_remaining = Signal(8)
+        block_stride = Signal(8)
+        drain_remaining = Signal(16)
+        notify = Signal()
+
+        # Check that a received frame holds exactly one whole command, and
+        # work out how many words its response carries.
+        frame_ok = Signal()
+        frame_words = Signal(8)
+        with m.Switch(frame_buf[0]):
+            with m.Case(ord('\r')):
+                m.d.comb += frame_ok.eq(frame_len == 1)
+                m.d.comb += frame_words.eq(1)
+            with m.Case(ord('N')):
+                m.d.comb += frame_ok.eq(frame_len == 1)
+                m.d.comb += frame_words.eq(4)
+            with m.Case(ord('R')):
+                m.d.comb += frame_ok.eq(frame_len == 2)
+                m.d.comb += frame_words.eq(1)
+            with m.Case(ord('W')):
+                m.d.comb += frame_ok.eq(frame_len == 6)
+            with m.Case(ord('B')):
+                m.d.comb += frame_ok.eq(frame_len == 3)
+                m.d.comb += frame_words.eq(frame_buf[2])
+            if self.result_fifo:
+                with m.Case(ord('D')):
+                    # The word count has to fit the response header.
+                    m.d.comb += frame_ok.eq((frame_len == 3) & (frame_buf[2] == 0) & (frame_buf[1] <= 255 // 5))
+                    m.d.comb += frame_words.eq(frame_buf[1] * 5)
+
+        def header(seq, command, words):
+            fields = (self.frame_sof, seq, command, words)
+            return data.eq(Cat(*(C(f, 8) if isinstance(f, int) else f for f in fields)))
+
+        def finish():
+            '''Go on to the trailer of a response frame, or back to IDLE.'''
+            if self.framing:
+                with m.If(in_frame):
+                    m.next = "FRAME_TRAILER"
+                with m.Else():
+                    m.next = "IDLE"
+            else:
+                m.next = "IDLE"
 
         with m.FSM() as fsm:
             with m.State("IDLE"):
-                m.d.sync += rx_ack.eq(0)
                 m.d.sync += wbm_we_o.eq(0)
-                m.d.sync += wbm_sel_o.eq(0)
                 m.d.sync += wbm_stb_o.eq(0)
                 m.d.sync += wbm_cyc_o.eq(0)
                 m.d.sync += dword_byte_idx.eq(0)
-                with m.If(rx_rdy):
-                    m.d.sync += rx_ack.eq(1)
+                with m.If(notify & fired):
+                    m.d.sync += notify.eq(0)
+                    if self.framing:
+                        with m.If(framed):
+                            m.d.sync += header(notify_seq, ord('N'), 4)
+                            m.d.sync += tx_crc.eq(0)
+                            m.d.sync += tx_header.eq(1)
+                            m.d.sync += header_next.eq(1)
+                            m.d.sync += in_frame.eq(1)
+                            m.next = "TX_DWORD"
+                        with m.Else():
+                            m.next = "NOTIFY"
+                    else:
+                        m.next = "NOTIFY"
+                with m.Elif(rx_rdy):
+                    m.d.comb += rx_ack.eq(1)
+                    if self.framing:
+                        with m.If(framed):
+                            # Anything outside a frame is dropped.
+                            with m.If(rx_data == self.frame_sof):
+                                m.d.sync += rx_crc.eq(crc8(0, rx_data))
+                                m.next = "FRAME_SEQ"
+                        with m.Else():
+                            m.d.sync += command.eq(rx_data)
+                            m.next = "COMMAND"
+                    else:
+                        m.d.sync += command.eq(rx_data)
+                        m.next = "COMMAND"
+
+            if self.framing:
+                with m.State("FRAME_SEQ"):
+                    with m.If(rx_rdy):
+                        m.d.comb += rx_ack.eq(1)
+                        m.d.sync += frame_seq.eq(rx_data)
+                        m.d.sync += rx_crc.eq(crc8(rx_crc, rx_data))
+                        m.next = "FRAME_LEN"
+                    with m.Elif(frame_expired):
+                        m.next = "IDLE"
+                with m.State("FRAME_LEN"):
+                    with m.If(rx_rdy):
+                        m.d.comb += rx_ack.eq(1)
+                        m.d.sync += frame_len.eq(rx_data)
+                        m.d.sync += frame_ptr.eq(0)
+                        m.d.sync += rx_crc.eq(crc8(rx_crc, rx_data))
+                        with m.If((rx_data == 0) | (rx_data > self.frame_payload_max)):
+                            m.next = "IDLE"
+                        with m.Else():
+                            m.next = "FRAME_PAYLOAD"
+                    with m.Elif(frame_expired):
+                        m.next = "IDLE"
+                with m.State("FRAME_PAYLOAD"):
+                    with m.If(rx_rdy):
+                        m.d.comb += rx_ack.eq(1)
+                        m.d.sync += frame_buf[frame_ptr].eq(rx_data)
+                        m.d.sync += frame_ptr.eq(frame_ptr + 1)
+                        m.d.sync += rx_crc.eq(crc8(rx_crc, rx_data))
+                        with m.If(frame_ptr == frame_len - 1):
+                            m.next = "FRAME_CRC"
+                    with m.Elif(frame_expired):
+                        m.next = "IDLE"
+                with m.State("FRAME_CRC"):
+                    with m.If(rx_rdy):
+                        m.d.comb += rx_ack.eq(1)
+                        m.d.sync += frame_ptr.eq(0)
+                        m.d.sync += tx_crc.eq(0)
+                        with m.If((rx_data == rx_crc) & frame_ok):
+                            m.d.sync += replay.eq(1)
+                            with m.If(frame_buf[0] == ord('N')):
+                                # Answered by the event frame, or by nothing if
+                                # the notification is cancelled.
+                                m.d.sync += notify_seq.eq(frame_seq)
+                                m.next = "FRAME_RUN"
+                            with m.Else():
+                                m.d.sync += header(frame_seq, frame_buf[0], frame_words)
+                                m.d.sync += tx_header.eq(1)
+                                m.d.sync += header_next.eq(0)
+                                m.d.sync += in_frame.eq(1)
+                                m.next = "TX_DWORD"
+                        with m.Else():
+                            m.d.sync += header(frame_seq, self.frame_nak, 0)
+                            m.d.sync += tx_header.eq(1)
+                            m.d.sync += header_next.eq(2)
+                            m.d.sync += in_frame.eq(1)
+                            m.next = "TX_DWORD"
+                    with m.Elif(frame_expired):
+                        m.next = "IDLE"
+                with m.State("FRAME_RUN"):
+                    m.d.comb += rx_ack.eq(1)
                     m.d.sync += command.eq(rx_data)
                     m.next = "COMMAND"
+                with m.State("FRAME_TRAILER"):
+                    m.d.sync += wbm_we_o.eq(0)
+                    m.d.sync += wbm_stb_o.eq(0)
+                    m.d.sync += wbm_cyc_o.eq(0)
+                    m.d.sync += tx_data.eq(tx_crc)
+                    m.d.sync += tx_rdy.eq(1)
+                    m.next = "FRAME_TRAILER_BYTE"
+                with m.State("FRAME_TRAILER_BYTE"):
+                    m.d.sync += tx_rdy.eq(0)
+                    with m.If((tx_rdy == 0) & (tx_ack == 1)):
+                        m.d.sync += in_frame.eq(0)
+                        m.d.sync += replay.eq(0)
+                        m.next = "IDLE"
+
+            # Event frame: "FIRE" followed by the event, delay and pulse
+            # counts (0x18, 0x28 and 0x38), sent through the block read path.
+            with m.State("NOTIFY"):
+                m.d.sync += data.eq(struct.unpack('<I', b"FIRE")[0])
+                m.d.sync += wbm_adr_o.eq(0x18 - 0x10)
+                m.d.sync += block_stride.eq(0x10)
+                m.d.sync += block_remaining.eq(3)
+                m.next = "TX_DWORD"
 
             with m.State("COMMAND"):
                 with m.Switch(command):
                     with m.Case(ord('\r')):
+                        m.d.sync += notify.eq(0)
+                        m.d.sync += divisor_confirm.eq(0)
                         m.d.sync += data.eq(struct.unpack('<I', b"OK\r\n")[0])
                         m.next = "TX_DWORD"
                     with m.Case(ord('R')):
                         m.next = "READ_ADDR"
                     with m.Case(ord('W')):
                         m.next = "WRITE_ADDR"
+                    with m.Case(ord('B')):
+                        m.next = "BLOCK_ADDR"
+                    if self.result_fifo:
+                        with m.Case(ord('D')):
+                            m.next = "DRAIN_COUNT_LO"
+                    with m.Case(ord('N')):
+                        m.d.sync += notify.eq(1)
+                        if self.framing:
+                            m.d.sync += replay.eq(0)
+                        m.next = "IDLE"
                     with m.Default():
                         m.next = "IDLE"
 
             with m.State("READ_ADDR"):
                 with m.If(rx_rdy):
-                    m.d.sync += rx_ack.eq(1)
+                    m.d.comb += rx_ack.eq(1)
                     m.d.sync += wbm_adr_o.eq(rx_data)
-                    m.d.sync += wbm_sel_o.eq(0xf)
                     m.d.sync += wbm_stb_o.eq(1)
                     m.d.sync += wbm_cyc_o.eq(1)
                     m.next = "READ_DATA"
             with m.State("READ_DATA"):
                 with m.If(wbm_ack_i):
                     m.d.sync += data.eq(wbm_dat_i)
-                    m.d.sync += wbm_sel_o.eq(0)
                     m.d.sync += wbm_stb_o.eq(0)
                     m.d.sync += wbm_cyc_o.eq(0)
                     m.next = "TX_DWORD"
@@ -134,6 +493,8 @@ class GlitchCoreUart(Elaboratable):
                     for i in range(4):
                         with m.Case(i):
                             m.d.sync += tx_data.eq(data[8*i:8*i+8])
+                            if self.framing:
+                                m.d.sync += tx_crc.eq(crc8(tx_crc, data[8*i:8*i+8]))
                 m.d.sync += tx_rdy.eq(1)
                 m.next = "TX_DWORD_BYTE"
             with m.State("TX_DWORD_BYTE"):
@@ -141,19 +502,80 @@ class GlitchCoreUart(Elaboratable):
                 with m.If((tx_rdy == 0) & (tx_ack == 1)):
                     m.d.sync += dword_byte_idx.eq(dword_byte_idx + 1)
                     with m.If(dword_byte_idx == 3):
-                        m.next = "IDLE"
+                        with m.If(block_remaining != 0):
+                            m.d.sync += wbm_adr_o.eq(wbm_adr_o + block_stride)
+                            m.next = "BLOCK_READ"
+                        if self.result_fifo:
+                            with m.Elif(drain_remaining != 0):
+                                m.next = "DRAIN_ENTRY"
+                        with m.Else():
+                            finish()
+                        if self.framing:
+                            # After a response header, which comes before
+                            # any block or drain, this takes over.
+                            with m.If(tx_header):
+                                m.d.sync += tx_header.eq(0)
+                                with m.Switch(header_next):
+                                    with m.Case(0):
+                                        m.next = "FRAME_RUN"
+                                    with m.Case(1):
+                                        m.next = "NOTIFY"
+                                    with m.Default():
+                                        m.next = "FRAME_TRAILER"
                     with m.Else():
                         m.next = "TX_DWORD"
 
+            with m.State("BLOCK_ADDR"):
+                with m.If(rx_rdy):
+                    m.d.comb += rx_ack.eq(1)
+                    m.d.sync += wbm_adr_o.eq(rx_data)
+                    m.d.sync += block_stride.eq(4)
+                    m.next = "BLOCK_COUNT"
+            with m.State("BLOCK_COUNT"):
+                with m.If(rx_rdy):
+                    m.d.comb += rx_ack.eq(1)
+                    m.d.sync += block_remaining.eq(rx_data)
+                    with m.If(rx_data == 0):
+                        finish()
+                    with m.Else():
+                        m.next = "BLOCK_READ"
+            with m.State("BLOCK_READ"):
+                m.d.sync += block_remaining.eq(block_remaining - 1)
+                m.d.sync += wbm_stb_o.eq(1)
+                m.d.sync += wbm_cyc_o.eq(1)
+                m.next = "READ_DATA"
+
+            if self.result_fifo:
+                # Drain: a 16-bit entry count, then that many entries of the
+                # result FIFO are sent, each as a block read of 0x80 to 0x90.
+                with m.State("DRAIN_COUNT_LO"):
+                    with m.If(rx_rdy):
+                        m.d.comb += rx_ack.eq(1)
+                        m.d.sync += drain_remaining[:8].eq(rx_data)
+                        m.next = "DRAIN_COUNT_HI"
+                with m.State("DRAIN_COUNT_HI"):
+                    with m.If(rx_rdy):
+                        m.d.comb += rx_ack.eq(1)
+                        m.d.sync += drain_remaining[8:].eq(rx_data)
+                        m.next = "DRAIN_ENTRY"
+                with m.State("DRAIN_ENTRY"):
+                    with m.If(drain_remaining == 0):
+                        finish()
+                    with m.Else():
+                        m.d.sync += drain_remaining.eq(drain_remaining - 1)
+                        m.d.sync += wbm_adr_o.eq(0x80)
+                        m.d.sync += block_stride.eq(4)
+                        m.d.sync += block_remaining.eq(5)
+                        m.next = "BLOCK_READ"
+
             with m.State("WRITE_ADDR"):
                 with m.If(rx_rdy):
-                    m.d.sync += rx_ack.eq(1)
+                    m.d.comb += rx_ack.eq(1)
                     m.d.sync += wbm_adr_o.eq(rx_data)
-                    m.d.sync += wbm_sel_o.eq(0xf)
                     m.next = "RX_DWORD"
             with m.State("RX_DWORD"):
                 with m.If(rx_rdy):
-                    m.d.sync += rx_ack.eq(1)
+                    m.d.comb += rx_ack.eq(1)
                     with m.Switch(dword_byte_idx):
                         for i in range(4):
                             with m.Case(i):
@@ -166,25 +588,332 @@ class GlitchCoreUart(Elaboratable):
                 m.d.sync += wbm_we_o.eq(1)
                 m.d.sync += wbm_stb_o.eq(1)
                 m.d.sync += wbm_cyc_o.eq(1)
-                m.next = "IDLE"
+                m.next = "WRITE_ACK"
+            with m.State("WRITE_ACK"):
+                # Writes wait for ack too, so the next transaction can't
+                # overtake one still crossing into the core clock domain.
+                with m.If(wbm_ack_i):
+                    m.d.sync += wbm_we_o.eq(0)
+                    m.d.sync += wbm_stb_o.eq(0)
+                    m.d.sync += wbm_cyc_o.eq(0)
+                    finish()
+
+        if self.framing:
+            with m.If(wbm_stb_o & wbm_we_o & local_sel & (wbm_adr_o[:8] == 0xf8)):
+                m.d.sync += framed.eq(wbm_dat_o[0])
+
+        if self.baud_switching:
+            # A new divisor is applied once the bridge is idle and the last
+            # response has been sent, and is kept only if a TEST command is
+            # received at the new rate before the switch timeout runs out.
+            # Otherwise the previous divisor is restored, so a rate the host
+            # can't use doesn't leave the board unreachable.
+            divisor_new = Signal.like(uart.divisor_i)
+            divisor_old = Signal.like(uart.divisor_i)
+            divisor_pending = Signal()
+            divisor_timer = Signal(range(int(self.clk_freq * self.switch_timeout) + 1))
+            with m.If(wbm_stb_o & wbm_we_o & local_sel & (wbm_adr_o[:8] == 0xf0)):
+                with m.If(wbm_dat_o >= 4):
+                    m.d.sync += divisor_new.eq(wbm_dat_o)
+                    m.d.sync += divisor_pending.eq(1)
+            with m.Elif(divisor_pending & fsm.ongoing("IDLE") & tx_ack):
+                m.d.sync += divisor_pending.eq(0)
+                m.d.sync += divisor_old.eq(uart.divisor_i)
+                m.d.sync += uart.divisor_i.eq(divisor_new)
+                m.d.sync += divisor_confirm.eq(1)
+                m.d.sync += divisor_timer.eq(int(self.clk_freq * self.switch_timeout))
+            with m.Elif(divisor_confirm):
+                m.d.sync += divisor_timer.eq(divisor_timer - 1)
+                with m.If(divisor_timer == 0):
+                    m.d.sync += uart.divisor_i.eq(divisor_old)
+                    m.d.sync += divisor_confirm.eq(0)
 
         return m
 
 
 if __name__ == "__main__":
-    with open("glitchcore_uart.v", "w") as f:
-        top = GlitchCoreUart()
-        f.write(verilog.convert(top, name="glitchcore_uart", ports=[
-            # In, from external.
-            top.event_in,
-            top.uart_rx,
+    import argparse
 
-            # Out, to external.
-            top.glitch_out,
-            top.uart_tx,
-            top.D1,
-            top.D2,
-            top.D3,
-            top.D4,
-            top.D5,
-        ]))
+    parser = argparse.ArgumentParser()
+    p_action = parser.add_subparsers(dest="action")
+    p_simulate = p_action.add_parser("simulate")
+    p_simulate.add_argument("-c", "--core-clock", type=float, metavar="MHZ",
+        help="run GlitchCoreWb on a separate core clock of this frequency")
+    p_generate = p_action.add_parser("generate")
+    p_generate.add_argument("-b", "--baudrate", type=int, default=115200,
+        help="initial UART baud rate (default: %(default)s)")
+    p_generate.add_argument("--native-event-counter", action="store_true",
+        help="build the event counter from Amaranth instead of event_counter_async.v")
+    p_generate.add_argument("--ddr-event-counter", action="store_true",
+        help="count events from a DDR input register instead of clocking a counter with them")
+    p_generate.add_argument("-c", "--core-clock", type=float, metavar="MHZ",
+        help="run GlitchCoreWb on a PLL clock as close to this frequency as possible")
+    p_generate.add_argument("--result-fifo", action="store_true",
+        help="build in the result FIFO at 0x70, which the drain command reads")
+    p_generate.add_argument("--result-fifo-depth", type=int, default=256, metavar="N",
+        help="number of fires the result FIFO holds (default: %(default)s)")
+    p_generate.add_argument("--result-fields", default=",".join(GlitchCoreWb.default_result_fields), metavar="FIELDS",
+        help="comma-separated words kept per result (default: %(default)s)")
+    p_generate.add_argument("--timestamps", action="store_true",
+        help="latch the cycle of each pipeline edge, readable from 0xc8")
+    p_generate.add_argument("--pattern-trigger", action="store_true",
+        help="build in the byte pattern trigger (trigger_sel 2)")
+    p_generate.add_argument("--sequence", action="store_true",
+        help="build in the pulse sequence table at 0x98")
+    p_generate.add_argument("--staging", action="store_true",
+        help="build in staging of register writes until a commit (0x08)")
+    p_generate.add_argument("--sweep", action="store_true",
+        help="build in the sweep sequencer at 0x40")
+    p_generate.add_argument("--framing", action="store_true",
+        help="build in the framed protocol with sequence numbers and CRC")
+    p_generate.add_argument("--baud-switching", action="store_true",
+        help="build in changing the baud rate at run time (0xf0)")
+    p_generate.add_argument("--rx-fifo", action="store_true",
+        help="build in a receive FIFO so the host can pipeline commands")
+
+    args = parser.parse_args()
+    if args.action == "simulate":
+        from amaranth.sim import Simulator, Passive
+
+        core_clk_freq = args.core_clock * 1e6 if args.core_clock else None
+        dut = GlitchCoreUart(switch_timeout=0.002, frame_timeout=0.0005,
+            core_clk_freq=core_clk_freq, pll=False, timestamps=True, framing=True, sweep=True,
+            result_fifo=True, baud_switching=True, rx_fifo=True, result_fields=GlitchCoreWb.result_field_names)
+        # Current bit period in clock cycles, shared by the processes below.
+        divisor = [int(12e6/115200)]
+
+        rx_bytes = bytearray()
+
+        def send(data):
+            for byte in data:
+                for bit in [0] + [(byte >> i) & 1 for i in range(8)] + [1]:
+                    yield dut.uart_rx.eq(bit)
+                    for _ in range(divisor[0]):
+                        yield
+
+        def recv(count):
+            while len(rx_bytes) < count:
+                yield
+            data = bytes(rx_bytes[:count])
+            del rx_bytes[:count]
+            return data
+
+        def receive_proc():
+            yield Passive()
+            while True:
+                while (yield dut.uart_tx):
+                    yield
+                for _ in range(divisor[0] // 2):
+                    yield
+                byte = 0
+                for i in range(8):
+                    for _ in range(divisor[0]):
+                        yield
+                    byte |= (yield dut.uart_tx) << i
+                for _ in range(divisor[0]):
+                    yield
+                rx_bytes.append(byte)
+
+        def bench():
+            yield dut.uart_rx.eq(1)
+            for _ in range(10):
+                yield
+
+            yield from send(b"\r")
+            assert (yield from recv(4)) == b"OK\r\n"
+
+            thresholds = {0x14: 0x08, 0x24: 0x10, 0x34: 0x02}
+            for addr, value in thresholds.items():
+                yield from send(b"W" + bytes([addr]) + struct.pack("<I", value))
+
+            yield from send(b"R\x24")
+            assert (yield from recv(4)) == struct.pack("<I", 0x10)
+
+            # Block read of 0x10 through 0x38, sent back to back with a
+            # trailing single read to check the FSM returns to IDLE.
+            yield from send(b"B\x10\x0bR\x34")
+            words = struct.unpack("<11I", (yield from recv(4 * 11)))
+            for i, word in enumerate(words):
+                assert word == thresholds.get(0x10 + 4 * i, 0)
+            assert (yield from recv(4)) == struct.pack("<I", 0x02)
+
+            yield from send(b"B\x00\x00\r")
+            assert (yield from recv(4)) == b"OK\r\n"
+
+            # Feed the delay trigger straight from event_in, since the async
+            # event counter is a black box in simulation.
+            yield from send(b"W\x00" + struct.pack("<I", 1 << 1))
+            yield from send(b"W\x30" + struct.pack("<I", 1))
+            yield from send(b"W\x20" + struct.pack("<I", 1))
+
+            # An armed notification is sent once the pulse has fired...
+            yield from send(b"N")
+            for _ in range(divisor[0] * 20):
+                yield
+            assert not rx_bytes
+            yield dut.event_in.eq(1)
+            frame = yield from recv(16)
+            assert frame == b"FIRE" + struct.pack("<III", 0, 0x11, 0x03), frame
+            yield dut.event_in.eq(0)
+
+            # ...and cancelled by TEST.
+            yield from send(b"W\x30" + struct.pack("<I", 0))
+            yield from send(b"N\r")
+            assert (yield from recv(4)) == b"OK\r\n"
+            for _ in range(divisor[0] * 20):
+                yield
+            assert not rx_bytes
+
+            # The fire was recorded in the result FIFO.
+            yield from send(b"R\x70")
+            assert (yield from recv(4)) == struct.pack("<I", 1)
+            yield from send(b"D\x01\x00R\x70")
+            index, delay, width, events, timestamp = struct.unpack("<5I", (yield from recv(20)))
+            assert (index, delay, width, events) == (0, 0x10, 0x02, 0), (index, delay, width, events)
+            assert timestamp > 0
+            assert (yield from recv(4)) == struct.pack("<I", 0)
+
+            yield from send(b"R\xf4")
+            assert (yield from recv(4)) == struct.pack("<I", 12000000)
+            yield from send(b"R\x04")
+            assert (yield from recv(4)) == struct.pack("<I", int(dut.core_clk_freq))
+
+            # Divisors below 4 are ignored.
+            yield from send(b"W\xf0" + struct.pack("<I", 3) + b"R\xf0")
+            assert (yield from recv(4)) == struct.pack("<I", 104)
+
+            # A new divisor that is confirmed with TEST sticks...
+            yield from send(b"W\xf0" + struct.pack("<I", 8))
+            divisor[0] = 8
+            yield from send(b"\r")
+            assert (yield from recv(4)) == b"OK\r\n"
+            for _ in range(int(12e6 * dut.switch_timeout) + 100):
+                yield
+            yield from send(b"R\xf0")
+            assert (yield from recv(4)) == struct.pack("<I", 8)
+
+            # ...and one that isn't falls back to the previous rate.
+            yield from send(b"W\xf0" + struct.pack("<I", 5))
+            for _ in range(int(12e6 * dut.switch_timeout) + 100):
+                yield
+            yield from send(b"\r")
+            assert (yield from recv(4)) == b"OK\r\n"
+
+            def crc(data):
+                value = 0
+                for byte in data:
+                    value ^= byte
+                    for _ in range(8):
+                        value = ((value << 1) ^ (0x07 if value & 0x80 else 0)) & 0xff
+                return value
+
+            def frame(seq, payload):
+                data = bytes([dut.frame_sof, seq, len(payload)]) + payload
+                return data + bytes([crc(data)])
+
+            def recv_frame(seq, command, words):
+                data = yield from recv(4 + 4 * words + 1)
+                assert data[:4] == bytes([dut.frame_sof, seq, command, words]), data
+                assert data[-1] == crc(data[:-1]), data
+                return data[4:-1]
+
+            # Framed mode, built in (as are baud switching and the RX FIFO)
+            # but off until switched on: every request then gets a response
+            # frame, including writes.
+            yield from send(b"R\xf8")
+            assert (yield from recv(4)) == struct.pack("<I", 0b1110)
+            yield from send(b"W\xf8" + struct.pack("<I", 1))
+            yield from send(frame(1, b"\r"))
+            assert (yield from recv_frame(1, ord("\r"), 1)) == b"OK\r\n"
+            yield from send(frame(2, b"W\x14" + struct.pack("<I", 0x55)) + frame(3, b"B\x14\x02"))
+            assert (yield from recv_frame(2, ord("W"), 0)) == b""
+            assert (yield from recv_frame(3, ord("B"), 2)) == struct.pack("<II", 0x55, 0)
+
+            # Bytes between frames are skipped, and a frame with a bad CRC
+            # or the wrong length for its command is refused and not run.
+            bad = bytearray(frame(4, b"W\x14" + struct.pack("<I", 0x66)))
+            bad[-1] ^= 0x01
+            yield from send(b"\x00R" + bytes(bad) + frame(5, b"R\x14\x00") + frame(6, b"R\x14"))
+            assert (yield from recv_frame(4, dut.frame_nak, 0)) == b""
+            assert (yield from recv_frame(5, dut.frame_nak, 0)) == b""
+            assert (yield from recv_frame(6, ord("R"), 1)) == struct.pack("<I", 0x55)
+
+            # A frame cut short is dropped after the frame timeout.
+            yield from send(frame(7, b"W\x14" + struct.pack("<I", 0x66))[:5])
+            for _ in range(int(12e6 * dut.frame_timeout) + 100):
+                yield
+            yield from send(frame(8, b"R\x14"))
+            assert (yield from recv_frame(8, ord("R"), 1)) == struct.pack("<I", 0x55)
+
+            yield from send(frame(10, b"D\x00\x00") + frame(11, b"D\x34\x00"))
+            assert (yield from recv_frame(10, ord("D"), 0)) == b""
+            assert (yield from recv_frame(11, dut.frame_nak, 0)) == b""
+
+            # A short sweep leaves one result per attempt.
+            sweep = {0x74: 1, 0x44: 3, 0x50: 1, 0x54: 3, 0x58: 1, 0x60: 1, 0x64: 1, 0x40: 1}
+            yield from send(b"".join(frame(0x20 + i, b"W" + bytes([addr]) + struct.pack("<I", value))
+                for i, (addr, value) in enumerate(sweep.items())))
+            for i in range(len(sweep)):
+                assert (yield from recv_frame(0x20 + i, ord("W"), 0)) == b""
+            yield dut.event_in.eq(1)
+            for _ in range(100):
+                yield
+            yield dut.event_in.eq(0)
+            yield from send(frame(12, b"R\x70") + frame(13, b"D\x03\x00"))
+            assert (yield from recv_frame(12, ord("R"), 1)) == struct.pack("<I", 3)
+            entries = list(struct.iter_unpack("<5I", (yield from recv_frame(13, ord("D"), 15))))
+            assert [entry[:3] for entry in entries] == [(0, 1, 1), (1, 2, 1), (2, 3, 1)], entries
+            assert entries[0][4] < entries[1][4] < entries[2][4]
+
+            # Timestamps of the last attempt's pipeline edges.
+            yield from send(frame(14, b"B\xc0\x0c"))
+            now, event, trigger, delayed, rise, fall = struct.unpack("<6Q", (yield from recv_frame(14, ord("B"), 12)))
+            assert entries[2][4] <= rise < fall < now
+            assert (rise - delayed, fall - rise) == (0, 1), (delayed, rise, fall)
+
+            yield from send(frame(9, b"W\xf8" + struct.pack("<I", 0)))
+            assert (yield from recv_frame(9, ord("W"), 0)) == b""
+            yield from send(b"\r")
+            assert (yield from recv(4)) == b"OK\r\n"
+
+        sim = Simulator(dut)
+        sim.add_clock(1/12e6) # 12 MHz
+        if core_clk_freq:
+            sim.add_clock(1/core_clk_freq, domain="core")
+        sim.add_sync_process(receive_proc)
+        sim.add_sync_process(bench)
+        with sim.write_vcd("glitchcore_uart.vcd"):
+            sim.run()
+
+    if args.action in (None, "generate"):
+        with open("glitchcore_uart.v", "w") as f:
+            core_clock = getattr(args, "core_clock", None)
+            top = GlitchCoreUart(baudrate=getattr(args, "baudrate", 115200),
+                native_event_counter=getattr(args, "native_event_counter", False),
+                ddr_event_counter=getattr(args, "ddr_event_counter", False),
+                result_fifo=getattr(args, "result_fifo", False),
+                result_fifo_depth=getattr(args, "result_fifo_depth", 256),
+                result_fields=getattr(args, "result_fields", ",".join(GlitchCoreWb.default_result_fields)).split(","),
+                timestamps=getattr(args, "timestamps", False),
+                pattern_trigger=getattr(args, "pattern_trigger", False),
+                sequence=getattr(args, "sequence", False),
+                staging=getattr(args, "staging", False),
+                sweep=getattr(args, "sweep", False),
+                framing=getattr(args, "framing", False),
+                baud_switching=getattr(args, "baud_switching", False),
+                rx_fifo=getattr(args, "rx_fifo", False),
+                core_clk_freq=core_clock * 1e6 if core_clock else None)
+            f.write(verilog.convert(top, name="glitchcore_uart", ports=[
+                # In, from external.
+                top.event_in,
+                top.uart_rx,
+
+                # Out, to external.
+                top.glitch_out,
+                top.uart_tx,
+                top.D1,
+                top.D2,
+                top.D3,
+                top.D4,
+                top.D5,
+            ]))
@@ -5,12 +5,67 @@ from glitchcore import GlitchCore
 
 
 class GlitchCoreWb(Elaboratable):
-    def __init__(self):
+    # Words of a result FIFO entry, in the order of the window at 0x80.
+    result_field_names = ("attempt", "delay", "pulse", "events", "timestamp")
+    # Four words an entry keep the addressing down to wiring.
+    default_result_fields = ("attempt", "delay", "pulse", "events")
+    # Order the words of an entry are written in, one a cycle from the
+    # fire. The thresholds only hold still for two cycles before a sweep
+    # moves on.
+    result_write_order = ("delay", "pulse", "events", "attempt", "timestamp")
+    # Cycles a re-arming commit holds every stage disarmed. The event
+    # counter's trigger takes two cycles to clear through its synchronizer.
+    rearm_cycles = 4
+    # Optional parts, one bit each of the feature register at 0x78 in this
+    # order, so the host can tell what the bitstream was built with.
+    feature_names = ("pattern_trigger", "timestamps", "sequence", "staging", "sweep", "result_fifo")
+
+    def __init__(self, clk_freq=12e6, native_event_counter=False, pipelined=False, ddr_event_counter=False,
+            result_fifo=False, result_fifo_depth=256, result_fields=default_result_fields, timestamps=False,
+            pattern_trigger=False, sequence=False, staging=False, sweep=False):
+        # Frequency of the clock this runs on, which every delay, width and
+        # timestamp counts in. Readable at 0x04.
+        self.clk_freq = clk_freq
+        self.native_event_counter = native_event_counter
+        self.ddr_event_counter = ddr_event_counter
+        # Speak Wishbone B4 pipelined mode instead of classic cycles.
+        self.pipelined = pipelined
+        # Build in the result FIFO at 0x70-0x90, which takes over a fifth of
+        # an iCE40HX1K's logic cells. It records `result_fifo_depth` fires
+        # before the host has to drain it, keeping the words in
+        # `result_fields`. Entries are stored a word at a time, so every 256
+        # words take two block RAMs and the depth costs no flip-flops; the
+        # fields left out read as 0 in the window. A number of words other
+        # than a power of two costs adders for the addresses, a couple of
+        # hundred LUTs with all five.
+        for field in result_fields:
+            if field not in self.result_field_names:
+                raise ValueError("Unknown result field {!r}".format(field))
+        if "timestamp" in result_fields and not timestamps:
+            raise ValueError("The timestamp result field needs timestamps")
+        self.result_fifo = result_fifo
+        self.result_fifo_depth = result_fifo_depth
+        self.result_fields = [field for field in self.result_field_names if field in result_fields]
+        # Latch the pipeline edges for 0xc8 on; see GlitchCore.
+        self.timestamps = timestamps
+        # Build in the byte pattern trigger at 0xa8-0xbc; see GlitchCore.
+        self.pattern_trigger = pattern_trigger
+        # Build in the pulse sequence table at 0x98-0xa4; see GlitchCore.
+        self.sequence = sequence
+        # Build in staging (0x08) and the copies of the registers it needs,
+        # over a hundred flip-flops. Without it writes always go straight
+        # through, and a commit (0x0c) only re-arms.
+        self.staging = staging
+        # Build in the sweep sequencer at 0x40-0x68; see GlitchCore.
+        self.sweep = sweep
+
         # In, from external.
         self.event_in = Signal()
+        self.event_ddr_in = Signal(2)
 
         # Out, to external.
         self.glitch_out = Signal()
+        self.fired_out = Signal()
 
         # Wishbone I/O
         self.wb_adr_i = Signal(32)
@@ -21,14 +76,217 @@ class GlitchCoreWb(Elaboratable):
         self.wb_stb_i = Signal()
         self.wb_ack_o = Signal()
         self.wb_cyc_i = Signal()
+        self.wb_stall_o = Signal()
+        self.wb_cti_i = Signal(3)
+        self.wb_bte_i = Signal(2)
 
     def elaborate(self, platform):
         m = Module()
 
-        gc = GlitchCore()
+        gc = GlitchCore(native_event_counter=self.native_event_counter, ddr_event_counter=self.ddr_event_counter,
+            timestamps=self.timestamps, pattern_trigger=self.pattern_trigger, sequence=self.sequence,
+            sweep=self.sweep)
         m.submodules += gc
 
+        # Registers of the result FIFO, which read 0 if it isn't built.
+        result_level = Signal(range(self.result_fifo_depth + 1))
+        result_overflow = Signal()
+        result_clear = Signal()
+        result_pop = Signal()
+        if self.result_fifo:
+            # One entry per fire: attempt index, delay and pulse
+            # thresholds, event count and timestamp, 32 bits each, as far as
+            # they are kept. Entries are stored a word at a time in block
+            # RAM, in `order`, and written one word per cycle starting with
+            # the fire. Entries are only counted once all their words are in.
+            fired_prev = Signal()
+            fire = Signal()
+            attempt = Signal(32)
+            words = len(self.result_fields)
+            order = [field for field in self.result_write_order if field in self.result_fields]
+            fields = {
+                "attempt": attempt,
+                "delay": gc.delay_threshold_used,
+                "pulse": gc.pulse_threshold_used,
+                "events": gc.event_count_out,
+            }
+            if "timestamp" in order:
+                # Taken back to the cycle of the fire.
+                fields["timestamp"] = gc.cycle_count[:32] - order.index("timestamp")
+
+            results = Memory(width=32, depth=self.result_fifo_depth * words)
+            m.submodules.results_w = results_w = results.write_port()
+            m.submodules.results_r = results_r = results.read_port(transparent=False)
+            # The oldest entry and the one being written.
+            result_head = Signal(range(self.result_fifo_depth))
+            result_tail = Signal(range(self.result_fifo_depth))
+            # The word of the entry being written, or `words` between entries.
+            result_word = Signal(range(words + 1), reset=words)
+            result_start = Signal()
+            result_index = Signal(range(words + 1))
+
+            def result_next(entry):
+                # With the defaults of four words and 256 entries, addresses
+                # are just bits of the entry and word, and the pointers wrap
+                # by themselves.
+                if self.result_fifo_depth & (self.result_fifo_depth - 1) == 0:
+                    return entry + 1
+                return Mux(entry == self.result_fifo_depth - 1, 0, entry + 1)
+
+            m.d.sync += fired_prev.eq(gc.pulse_fired)
+            m.d.comb += [
+                fire.eq(gc.pulse_fired & ~fired_prev),
+                # Fires only come a re-arm apart, which takes longer than
+                # an entry, so one never arrives mid-entry.
+                result_start.eq(fire & (result_word == words) & (result_level != self.result_fifo_depth)),
+                result_index.eq(Mux(result_start, 0, result_word)),
+            ]
+            with m.Switch(result_index):
+                for i, field in enumerate(order):
+                    with m.Case(i):
+                        m.d.comb += [
+                            results_w.addr.eq(result_tail * words + i),
+                            results_w.data.eq(fields[field]),
+                            results_w.en.eq(1),
+                        ]
+
+            with m.If(result_clear):
+                m.d.sync += [
+                    attempt.eq(0),
+                    result_overflow.eq(0),
+                    result_head.eq(0),
+                    result_tail.eq(0),
+                    result_level.eq(0),
+                    result_word.eq(words),
+                ]
+            with m.Else():
+                with m.If(fire & ~result_start):
+                    # Fires that don't fit are dropped, but still counted,
+                    # so the host sees a gap in the attempt indices.
+                    m.d.sync += attempt.eq(attempt + 1)
+                    m.d.sync += result_overflow.eq(1)
+                with m.If(result_index == words - 1):
+                    m.d.sync += [
+                        attempt.eq(attempt + 1),
+                        result_tail.eq(result_next(result_tail)),
+                        result_word.eq(words),
+                    ]
+                with m.Elif(result_index != words):
+                    m.d.sync += result_word.eq(result_index + 1)
+                with m.If(result_pop):
+                    m.d.sync += result_head.eq(result_next(result_head))
+                m.d.sync += result_level.eq(result_level + (result_index == words - 1) - result_pop)
+
+        # `access` is high in the cycle a transfer takes effect, with its
+        # address and write data on the bus. `respond` is high in the cycle
+        # before an ack, when the word at `read_adr` is loaded into wb_dat_o.
+        access = Signal()
+        respond = Signal()
+        read_adr = Signal(8)
+        read_data = Signal(32)
+        write_data = Signal(32)
+        if self.pipelined:
+            # Every cycle with stb accepts a transfer, acked in the next one.
+            m.d.comb += [
+                self.wb_stall_o.eq(0),
+                access.eq(self.wb_cyc_i & self.wb_stb_i & ~self.wb_stall_o),
+                respond.eq(access),
+                read_adr.eq(self.wb_adr_i[:8]),
+            ]
+        else:
+            # Classic cycles complete in the cycle ack is high, one after
+            # stb. During an incrementing burst (CTI 0b010) the next address
+            # is known ahead, so ack stays high and a transfer completes
+            # every cycle. Other burst types run as single cycles.
+            burst = Signal()
+            wrap_mask = Signal(8)
+            with m.Switch(self.wb_bte_i):
+                with m.Case(0b00):
+                    m.d.comb += wrap_mask.eq(0xff)
+                with m.Case(0b01):
+                    m.d.comb += wrap_mask.eq(4 * 4 - 1)
+                with m.Case(0b10):
+                    m.d.comb += wrap_mask.eq(8 * 4 - 1)
+                with m.Case(0b11):
+                    m.d.comb += wrap_mask.eq(16 * 4 - 1)
+            next_adr = (self.wb_adr_i[:8] & ~wrap_mask) | ((self.wb_adr_i[:8] + 4) & wrap_mask)
+            m.d.comb += [
+                access.eq(self.wb_cyc_i & self.wb_stb_i & self.wb_ack_o),
+                burst.eq(access & (self.wb_cti_i == 0b010)),
+                respond.eq(self.wb_cyc_i & self.wb_stb_i & (~self.wb_ack_o | burst)),
+                read_adr.eq(Mux(burst & ~self.wb_we_i, next_adr, self.wb_adr_i[:8])),
+            ]
+        m.d.sync += self.wb_ack_o.eq(respond)
+
+        # Byte lanes not selected keep the register's value.
+        m.d.comb += write_data.eq(Cat(
+            Mux(self.wb_sel_i[i], self.wb_dat_i[8*i:8*i+8], read_data[8*i:8*i+8]) for i in range(4)))
+
+        # The mux selects, thresholds and arm bits are written to staging
+        # registers. Normally each write also goes straight through to
+        # GlitchCore. With staging on (0x08 bit 0) it doesn't, and writing
+        # 0x0c applies everything staged on the same cycle. Setting bit 0 of
+        # that write also drops every arm bit for a few cycles, so the commit
+        # starts a fresh attempt with the new settings. Reads of these
+        # registers show the staged values. Built without staging, only the
+        # arm bits keep a copy, for the re-arm to restore.
+        # The byte pattern trigger, if built in, selected with trigger_sel 2
+        # (0x00 bit 6): its UART divisor at 0xa8, clamped to at least 4, the
+        # last byte it received at 0xac, then the pattern at 0xb0 and its
+        # mask at 0xb8, newest byte first, two words each. Its divisor resets
+        # to 115200 baud. These are staged too, so a commit switches to a
+        # whole new pattern at once. Without the trigger they read 0.
+        if self.pattern_trigger:
+            pattern_divisor = Signal(16, reset=round(self.clk_freq / 115200))
+            pattern_lo = Signal(32)
+            pattern_hi = Signal(32)
+            pattern_mask_lo = Signal(32)
+            pattern_mask_hi = Signal(32)
+            m.d.comb += [
+                gc.pattern_divisor.eq(pattern_divisor),
+                gc.pattern.eq(Cat(pattern_lo, pattern_hi)),
+                gc.pattern_mask.eq(Cat(pattern_mask_lo, pattern_mask_hi)),
+            ]
+
+        staging = Signal()
+        commit = Signal()
+        commit_rearm = Signal()
+        rearm = Signal(range(self.rearm_cycles + 1))
+        arms = [gc.event_counter_arm_in, gc.delay_arm, gc.pulse_arm]
+        config = arms + [
+            gc.event_polarity_in,
+            gc.trigger_sel_in,
+            gc.delay_sel_in,
+            gc.pulse_sel_in,
+            gc.zero_delay_in,
+            gc.event_counter_threshold_in,
+            gc.delay_threshold,
+            gc.pulse_threshold,
+        ]
+        if self.pattern_trigger:
+            config += [pattern_divisor, pattern_lo, pattern_hi, pattern_mask_lo, pattern_mask_hi]
+        copied = config if self.staging else arms
+        staged = {signal.name: signal for signal in config}
+        staged.update({signal.name: Signal.like(signal, name="staged_" + signal.name) for signal in copied})
+
+        def write_config(signal, value):
+            m.d.sync += staged[signal.name].eq(value)
+            if staged[signal.name] is not signal:
+                with m.If(~staging):
+                    m.d.sync += signal.eq(value)
+
+        with m.If(commit):
+            m.d.sync += [signal.eq(staged[signal.name]) for signal in copied]
+            with m.If(commit_rearm):
+                m.d.sync += [signal.eq(0) for signal in arms]
+                m.d.sync += rearm.eq(self.rearm_cycles)
+        with m.Elif(rearm != 0):
+            m.d.sync += rearm.eq(rearm - 1)
+            with m.If(rearm == 1):
+                m.d.sync += [signal.eq(staged[signal.name]) for signal in arms]
+
         reg00 = Signal(32)
+        reg08 = Signal(32)
 
         reg10 = Signal(32)
         reg14 = Signal(32)
@@ -42,84 +300,297 @@ class GlitchCoreWb(Elaboratable):
         reg34 = Signal(32)
         reg38 = Signal(32)
 
+        reg40 = Signal(32)
+        reg44 = Signal(32)
+        reg48 = Signal(32)
+        reg4c = Signal(32)
+
+        reg50 = Signal(32)
+        reg54 = Signal(32)
+        reg58 = Signal(32)
+
+        reg60 = Signal(32)
+        reg64 = Signal(32)
+        reg68 = Signal(32)
+
+        reg70 = Signal(32)
+        reg74 = Signal(32)
+
+
+        # The pulse sequence table is written through a data port: 0x9c
+        # selects an entry and 0xa0 holds its delay. Writing the entry's
+        # width to 0xa4 stores both and moves on to the next entry, so a
+        # whole table is loaded with one run of writes.
+        sequence_index = Signal(range(gc.sequence_depth))
+        sequence_delay = Signal(32)
+        m.d.comb += [
+            gc.sequence_w_addr.eq(sequence_index),
+            gc.sequence_w_delay.eq(sequence_delay),
+            gc.sequence_w_pulse.eq(write_data),
+        ]
+
+        # 64-bit timestamps, low word first: the live cycle counter at 0xc0
+        # and the edge latches from 0xc8 on. Reading the low word of the
+        # cycle counter holds its high word for the next read. Built without
+        # timestamps, they all read 0.
+        cycle_count_hi = Signal(32)
+        timestamps = [
+            gc.event_in_time,
+            gc.event_trigger_time,
+            gc.delay_trigger_time,
+            gc.glitch_rise_time,
+            gc.glitch_fall_time,
+        ]
+
         m.d.comb += [
             # In, from external.
             gc.event_in.eq(self.event_in),
+            gc.event_ddr_in.eq(self.event_ddr_in),
 
             # Out, to external.
             self.glitch_out.eq(gc.glitch_out),
+            self.fired_out.eq(gc.pulse_fired),
+
+            reg00[0].eq(staged[gc.event_polarity_in.name]),
+            reg00[1].eq(staged[gc.trigger_sel_in.name][0]),
+            reg00[2:2+2].eq(staged[gc.delay_sel_in.name]),
+            reg00[4].eq(staged[gc.pulse_sel_in.name]),
+            reg00[5].eq(staged[gc.zero_delay_in.name]),
+            reg00[6].eq(staged[gc.trigger_sel_in.name][1]),
+            reg00[7:].eq(0),
 
-            reg00[0].eq(gc.event_polarity_in),
-            reg00[1].eq(gc.trigger_sel_in),
-            reg00[2:2+2].eq(gc.delay_sel_in),
-            reg00[4].eq(gc.pulse_sel_in),
-            reg00[5:].eq(0),
+            reg08[0].eq(staging),
+            reg08[1:].eq(0),
 
-            reg10[0].eq(gc.event_counter_arm_in),
+            reg10[0].eq(staged[gc.event_counter_arm_in.name]),
             reg10[1].eq(gc.event_trigger_out),
             reg10[2:].eq(0),
-            reg14.eq(gc.event_counter_threshold_in),
+            reg14.eq(staged[gc.event_counter_threshold_in.name]),
             reg18.eq(gc.event_count_out),
 
-            reg20[0].eq(gc.delay_arm),
+            reg20[0].eq(staged[gc.delay_arm.name]),
             reg20[1].eq(gc.delay_trigger_delayed),
             reg20[2:].eq(0),
-            reg24.eq(gc.delay_threshold),
+            reg24.eq(staged[gc.delay_threshold.name]),
             reg28.eq(gc.delay_count),
 
-            reg30[0].eq(gc.pulse_arm),
+            reg30[0].eq(staged[gc.pulse_arm.name]),
             reg30[1].eq(gc.pulse_pulse),
             reg30[2].eq(gc.pulse_fired),
             reg30[3:].eq(0),
-            reg34.eq(gc.pulse_threshold),
+            reg34.eq(staged[gc.pulse_threshold.name]),
             reg38.eq(gc.pulse_count),
+
+            reg40[0].eq(gc.sweep_run),
+            reg40[1].eq(gc.sweep_busy),
+            reg40[2:].eq(0),
+            reg44.eq(gc.sweep_attempts),
+            reg48.eq(gc.sweep_done),
+            reg4c.eq(gc.sweep_holdoff),
+
+            reg50.eq(gc.sweep_delay_start),
+            reg54.eq(gc.sweep_delay_stop),
+            reg58.eq(gc.sweep_delay_step),
+
+            reg60.eq(gc.sweep_pulse_start),
+            reg64.eq(gc.sweep_pulse_stop),
+            reg68.eq(gc.sweep_pulse_step),
+
+            reg70.eq(result_level),
+            reg74[0].eq(0),
+            reg74[1].eq(result_overflow),
+            reg74[2:].eq(0),
+
         ]
 
-        with m.If(self.wb_stb_i & self.wb_we_i):
+        with m.If(access & self.wb_we_i):
             with m.Switch(self.wb_adr_i[:8]):
                 with m.Case(0x00):
-                    m.d.sync += gc.event_polarity_in.eq(self.wb_dat_i[0])
-                    m.d.sync += gc.trigger_sel_in.eq(self.wb_dat_i[1])
-                    m.d.sync += gc.delay_sel_in.eq(self.wb_dat_i[2:2+2])
-                    m.d.sync += gc.pulse_sel_in.eq(self.wb_dat_i[4])
+                    write_config(gc.event_polarity_in, write_data[0])
+                    # Without the pattern trigger, trigger_sel 2 can't be
+                    # selected, and bit 6 reads back as 0.
+                    write_config(gc.trigger_sel_in, Cat(write_data[1], write_data[6] if self.pattern_trigger else Const(0)))
+                    write_config(gc.delay_sel_in, write_data[2:2+2])
+                    write_config(gc.pulse_sel_in, write_data[4])
+                    write_config(gc.zero_delay_in, write_data[5])
+                if self.staging:
+                    with m.Case(0x08):
+                        m.d.sync += staging.eq(write_data[0])
+                with m.Case(0x0c):
+                    m.d.comb += commit.eq(1)
+                    m.d.comb += commit_rearm.eq(write_data[0])
                 with m.Case(0x10):
-                    m.d.sync += gc.event_counter_arm_in.eq(self.wb_dat_i[0])
+                    write_config(gc.event_counter_arm_in, write_data[0])
                 with m.Case(0x14):
-                    m.d.sync += gc.event_counter_threshold_in.eq(self.wb_dat_i)
+                    write_config(gc.event_counter_threshold_in, write_data)
                 with m.Case(0x20):
-                    m.d.sync += gc.delay_arm.eq(self.wb_dat_i[0])
+                    write_config(gc.delay_arm, write_data[0])
                 with m.Case(0x24):
-                    m.d.sync += gc.delay_threshold.eq(self.wb_dat_i)
+                    write_config(gc.delay_threshold, write_data)
                 with m.Case(0x30):
-                    m.d.sync += gc.pulse_arm.eq(self.wb_dat_i[0])
+                    write_config(gc.pulse_arm, write_data[0])
                 with m.Case(0x34):
-                    m.d.sync += gc.pulse_threshold.eq(self.wb_dat_i)
-
-        with m.Switch(self.wb_adr_i[:8]):
+                    write_config(gc.pulse_threshold, write_data)
+                if self.sweep:
+                    with m.Case(0x40):
+                        m.d.sync += gc.sweep_run.eq(write_data[0])
+                    with m.Case(0x44):
+                        m.d.sync += gc.sweep_attempts.eq(write_data)
+                    with m.Case(0x4c):
+                        m.d.sync += gc.sweep_holdoff.eq(write_data)
+                    with m.Case(0x50):
+                        m.d.sync += gc.sweep_delay_start.eq(write_data)
+                    with m.Case(0x54):
+                        m.d.sync += gc.sweep_delay_stop.eq(write_data)
+                    with m.Case(0x58):
+                        m.d.sync += gc.sweep_delay_step.eq(write_data)
+                    with m.Case(0x60):
+                        m.d.sync += gc.sweep_pulse_start.eq(write_data)
+                    with m.Case(0x64):
+                        m.d.sync += gc.sweep_pulse_stop.eq(write_data)
+                    with m.Case(0x68):
+                        m.d.sync += gc.sweep_pulse_step.eq(write_data)
+                if self.result_fifo:
+                    with m.Case(0x74):
+                        m.d.comb += result_clear.eq(write_data[0])
+                if self.sequence:
+                    with m.Case(0x98):
+                        m.d.sync += gc.sequence_length.eq(
+                            Mux(write_data > gc.sequence_depth, gc.sequence_depth, write_data))
+                    with m.Case(0x9c):
+                        m.d.sync += sequence_index.eq(write_data)
+                    with m.Case(0xa0):
+                        m.d.sync += sequence_delay.eq(write_data)
+                    with m.Case(0xa4):
+                        m.d.comb += gc.sequence_w_en.eq(1)
+                        m.d.sync += sequence_index.eq(sequence_index + 1)
+                if self.pattern_trigger:
+                    with m.Case(0xa8):
+                        write_config(pattern_divisor, Mux(write_data[:16] < 4, 4, write_data[:16]))
+                    with m.Case(0xb0):
+                        write_config(pattern_lo, write_data)
+                    with m.Case(0xb4):
+                        write_config(pattern_hi, write_data)
+                    with m.Case(0xb8):
+                        write_config(pattern_mask_lo, write_data)
+                    with m.Case(0xbc):
+                        write_config(pattern_mask_hi, write_data)
+
+        dat = Signal(32)
+        with m.If(respond):
+            m.d.sync += dat.eq(read_data)
+        if self.result_fifo:
+            # Reading the last word of the result window pops the entry.
+            with m.If(access & ~self.wb_we_i & (self.wb_adr_i[:8] == 0x90) & (result_level != 0)):
+                m.d.comb += result_pop.eq(1)
+
+            # The result window is read straight out of block RAM: its
+            # address goes in with `respond` and the word comes out with
+            # the ack.
+            from_results = Signal()
+            with m.If(respond):
+                m.d.sync += from_results.eq(0)
+            m.d.comb += [
+                results_r.en.eq(respond),
+                self.wb_dat_o.eq(Mux(from_results, results_r.data, dat)),
+            ]
+        else:
+            m.d.comb += self.wb_dat_o.eq(dat)
+
+        with m.Switch(read_adr):
             with m.Case(0x00):
-                m.d.sync += self.wb_dat_o.eq(reg00)
+                m.d.comb += read_data.eq(reg00)
+            with m.Case(0x04):
+                m.d.comb += read_data.eq(int(self.clk_freq))
+            with m.Case(0x08):
+                m.d.comb += read_data.eq(reg08)
             with m.Case(0x10):
-                m.d.sync += self.wb_dat_o.eq(reg10)
+                m.d.comb += read_data.eq(reg10)
             with m.Case(0x14):
-                m.d.sync += self.wb_dat_o.eq(reg14)
+                m.d.comb += read_data.eq(reg14)
             with m.Case(0x18):
-                m.d.sync += self.wb_dat_o.eq(reg18)
+                m.d.comb += read_data.eq(reg18)
             with m.Case(0x20):
-                m.d.sync += self.wb_dat_o.eq(reg20)
+                m.d.comb += read_data.eq(reg20)
             with m.Case(0x24):
-                m.d.sync += self.wb_dat_o.eq(reg24)
+                m.d.comb += read_data.eq(reg24)
             with m.Case(0x28):
-                m.d.sync += self.wb_dat_o.eq(reg28)
+                m.d.comb += read_data.eq(reg28)
             with m.Case(0x30):
-                m.d.sync += self.wb_dat_o.eq(reg30)
+                m.d.comb += read_data.eq(reg30)
             with m.Case(0x34):
-                m.d.sync += self.wb_dat_o.eq(reg34)
+                m.d.comb += read_data.eq(reg34)
             with m.Case(0x38):
-                m.d.sync += self.wb_dat_o.eq(reg38)
+                m.d.comb += read_data.eq(reg38)
+            if self.sweep:
+                with m.Case(0x40):
+                    m.d.comb += read_data.eq(reg40)
+                with m.Case(0x44):
+                    m.d.comb += read_data.eq(reg44)
+                with m.Case(0x48):
+                    m.d.comb += read_data.eq(reg48)
+                with m.Case(0x4c):
+                    m.d.comb += read_data.eq(reg4c)
+                with m.Case(0x50):
+                    m.d.comb += read_data.eq(reg50)
+                with m.Case(0x54):
+                    m.d.comb += read_data.eq(reg54)
+                with m.Case(0x58):
+                    m.d.comb += read_data.eq(reg58)
+                with m.Case(0x60):
+                    m.d.comb += read_data.eq(reg60)
+                with m.Case(0x64):
+                    m.d.comb += read_data.eq(reg64)
+                with m.Case(0x68):
+                    m.d.comb += read_data.eq(reg68)
+            with m.Case(0x70):
+                m.d.comb += read_data.eq(reg70)
+            with m.Case(0x74):
+                m.d.comb += read_data.eq(reg74)
+            with m.Case(0x78):
+                m.d.comb += read_data.eq(sum(bool(getattr(self, name)) << i for i, name in enumerate(self.feature_names)))
+            if self.result_fifo:
+                for i, field in enumerate(self.result_field_names):
+                    with m.Case(0x80 + 4 * i):
+                        m.d.comb += read_data.eq(0)
+                        if field in self.result_fields:
+                            m.d.comb += results_r.addr.eq(result_head * words + order.index(field))
+                            with m.If(respond):
+                                m.d.sync += from_results.eq(result_level != 0)
+            if self.sequence:
+                with m.Case(0x98):
+                    m.d.comb += read_data.eq(gc.sequence_length)
+                with m.Case(0x9c):
+                    m.d.comb += read_data.eq(sequence_index)
+                with m.Case(0xa0):
+                    m.d.comb += read_data.eq(sequence_delay)
+            if self.pattern_trigger:
+                with m.Case(0xa8):
+                    m.d.comb += read_data.eq(staged[pattern_divisor.name])
+                with m.Case(0xac):
+                    m.d.comb += read_data.eq(gc.pattern_last_byte)
+                with m.Case(0xb0):
+                    m.d.comb += read_data.eq(staged[pattern_lo.name])
+                with m.Case(0xb4):
+                    m.d.comb += read_data.eq(staged[pattern_hi.name])
+                with m.Case(0xb8):
+                    m.d.comb += read_data.eq(staged[pattern_mask_lo.name])
+                with m.Case(0xbc):
+                    m.d.comb += read_data.eq(staged[pattern_mask_hi.name])
+            if self.timestamps:
+                with m.Case(0xc0):
+                    m.d.comb += read_data.eq(gc.cycle_count[:32])
+                    with m.If(respond):
+                        m.d.sync += cycle_count_hi.eq(gc.cycle_count[32:])
+                with m.Case(0xc4):
+                    m.d.comb += read_data.eq(cycle_count_hi)
+                for i, timestamp in enumerate(timestamps):
+                    with m.Case(0xc8 + 8 * i):
+                        m.d.comb += read_data.eq(timestamp[:32])
+                    with m.Case(0xcc + 8 * i):
+                        m.d.comb += read_data.eq(timestamp[32:])
             with m.Default():
-                m.d.sync += self.wb_dat_o.eq(0)
-
-        m.d.sync += self.wb_ack_o.eq(self.wb_stb_i)
+                m.d.comb += read_data.eq(0)
 
         return m
 
@@ -127,62 +598,47 @@ class GlitchCoreWb(Elaboratable):
 if __name__ == "__main__":
     from amaranth.sim import Simulator
 
-    dut = GlitchCoreWb()
-    def bench():
-        yield dut.wb_adr_i.eq(0x14)
-        yield dut.wb_dat_i.eq(0x08)
-        yield dut.wb_stb_i.eq(1)
-        yield dut.wb_we_i.eq(1)
-        yield
-        yield dut.wb_we_i.eq(0)
-        yield dut.wb_stb_i.eq(0)
-        yield
-
-        yield dut.wb_adr_i.eq(0x24)
-        yield dut.wb_dat_i.eq(0x10)
-        yield dut.wb_stb_i.eq(1)
-        yield dut.wb_we_i.eq(1)
-        yield
-        yield dut.wb_we_i.eq(0)
-        yield dut.wb_stb_i.eq(0)
-        yield
-
-        yield dut.wb_adr_i.eq(0x34)
-        yield dut.wb_dat_i.eq(0x02)
-        yield dut.wb_stb_i.eq(1)
-        yield dut.wb_we_i.eq(1)
-        yield
-        yield dut.wb_we_i.eq(0)
-        yield dut.wb_stb_i.eq(0)
-        yield
-
-        yield dut.wb_adr_i.eq(0x30)
-        yield dut.wb_dat_i.eq(0x01)
-        yield dut.wb_stb_i.eq(1)
-        yield dut.wb_we_i.eq(1)
-        yield
-        yield dut.wb_we_i.eq(0)
-        yield dut.wb_stb_i.eq(0)
-        yield
-
-        yield dut.wb_adr_i.eq(0x20)
-        yield dut.wb_dat_i.eq(0x01)
-        yield dut.wb_stb_i.eq(1)
-        yield dut.wb_we_i.eq(1)
-        yield
-        yield dut.wb_we_i.eq(0)
-        yield dut.wb_stb_i.eq(0)
-        yield
-
-        yield dut.wb_adr_i.eq(0x10)
-        yield dut.wb_dat_i.eq(0x01)
-        yield dut.wb_stb_i.eq(1)
-        yield dut.wb_we_i.eq(1)
-        yield
-        yield dut.wb_we_i.eq(0)
-        yield dut.wb_stb_i.eq(0)
-        yield
+    from wishbone_bfm import WishboneBFM
+
+    def bench(dut, bus):
+        def glitch_cycles():
+            for _ in range(8):
+                yield dut.event_in.eq(1)
+                yield
+                yield dut.event_in.eq(0)
+                yield
+            glitch = 0
+            for _ in range(0x100):
+                yield
+                glitch += yield dut.glitch_out
+            return glitch
+
+        yield from bus.write(0x14, 0x08)
+        yield from bus.write(0x24, 0x10)
+        yield from bus.write(0x34, 0x02)
+        yield from bus.write(0x30, 0x01)
+        yield from bus.write(0x20, 0x01)
+        yield from bus.write(0x10, 0x01)
+        for _ in range(4):
+            yield
 
+        # Eight events reach the count threshold, then the delay of 0x10
+        # and the 2 cycle pulse follow.
+        assert (yield from glitch_cycles()) == 2
+        assert (yield dut.fired_out)
+
+        # The same trigger again, now playing a three entry sequence.
+        yield from bus.write(0x10, 0)
+        yield from bus.write(0x20, 0)
+        yield from bus.write(0x30, 0)
+        yield from bus.write(0x9c, 0)
+        yield from bus.write_block(0xa0, [0x10, 2], burst=False)
+        yield from bus.write_block(0xa0, [4, 3], burst=False)
+        yield from bus.write_block(0xa0, [0, 1], burst=False)
+        yield from bus.write(0x98, 3)
+        yield from bus.write(0x30, 1)
+        yield from bus.write(0x20, 1)
+        yield from bus.write(0x10, 1)
         for _ in range(4):
             yield
 
@@ -191,15 +647,146 @@ if __name__ == "__main__":
             yield
             yield dut.event_in.eq(0)
             yield
-
+        levels = []
         for _ in range(0x100):
             yield
-
-    sim = Simulator(dut)
-    sim.add_clock(1e-6) # 1 MHz
-    sim.add_sync_process(bench)
-    with sim.write_vcd("glitchcore_wb.vcd"):
-        sim.run()
+            levels.append((yield dut.glitch_out))
+        trace = "".join(map(str, levels)).strip("0")
+        assert (yield from bus.read(0x78)) >> 2 & 1 == dut.sequence
+        if dut.sequence:
+            # Each pulse after the first follows the previous one by its
+            # delay plus two cycles.
+            assert trace == "11" + "0" * 6 + "111" + "0" * 3 + "1", trace
+        else:
+            # Built without the sequence table, the trigger plays the single
+            # pulse as before and the table's registers read 0.
+            assert trace == "11", trace
+            assert (yield from bus.read(0x98)) == 0
+        assert (yield dut.fired_out)
+
+        # Staged settings do nothing until they are committed, and a commit
+        # with bit 0 set re-arms for the next attempt. Built without
+        # staging, the write applies at once and the commit still re-arms.
+        yield from bus.write(0x98, 0)
+        yield from bus.write(0x08, 1)
+        assert (yield from bus.read(0x08)) == dut.staging
+        assert (yield from bus.read(0x78)) >> 3 & 1 == dut.staging
+        assert (yield from bus.read(0x78)) >> 4 & 1 == dut.sweep
+        yield from bus.write(0x34, 5)
+        assert (yield from bus.read(0x34)) == 5
+        assert (yield from glitch_cycles()) == 0
+        yield from bus.write(0x0c, 1)
+        for _ in range(0x20):
+            yield
+        # Nothing left over from the last attempt triggers the new one.
+        assert not (yield dut.fired_out)
+        assert (yield from glitch_cycles()) == 5
+        yield from bus.write(0x08, 0)
+
+        # Byte lanes not selected are left alone.
+        yield from bus.write(0x44, 0x11223344)
+        yield from bus.write(0x44, 0xaabbccdd, sel=0b0101)
+        assert (yield from bus.read(0x44)) == 0x11bb33dd
+
+        # A burst or back to back reads return the same words as single
+        # reads, one per cycle.
+        singles = []
+        for addr in range(0x40, 0x6c, 4):
+            singles.append((yield from bus.read(addr)))
+        words = yield from bus.read_block(0x40, len(singles))
+        assert words == singles, (words, singles)
+        assert bus.cycles == len(singles) + 1, bus.cycles
+        yield from bus.write_block(0x50, [1, 2, 3])
+        assert bus.cycles == 3 + 1, bus.cycles
+        assert (yield from bus.read_block(0x50, 3)) == [1, 2, 3]
+        if not bus.pipelined:
+            # Wrapping burst of four beats, starting mid-way.
+            assert (yield from bus.read_block(0x58, 4, bte=0b01)) == [3, 0, 1, 2]
+
+        assert (yield from bus.read(0x78)) >> 5 & 1 == dut.result_fifo
+        if dut.result_fifo:
+            # Each block read of the result window pops one entry: the
+            # three fires so far.
+            assert (yield from bus.read(0x70)) == 3
+            entries = []
+            for _ in range(3):
+                entries.append((yield from bus.read_block(0x80, 5)))
+            assert (yield from bus.read(0x70)) == 0
+            # A sequence reports the thresholds of its last pulse.
+            second = [1, 0, 1, 8] if dut.sequence else [1, 0x10, 2, 8]
+            assert [entry[:4] for entry in entries] == [[0, 0x10, 2, 8], second, [2, 0x10, 5, 8]], entries
+            # Fields left out of the FIFO read as 0.
+            timestamps = [entry[4] for entry in entries]
+            if "timestamp" in dut.result_fields:
+                assert all(timestamps), timestamps
+            else:
+                assert not any(timestamps), timestamps
+        else:
+            # Built without the FIFO, its registers read 0.
+            assert (yield from bus.read(0x70)) == 0
+            assert (yield from bus.read_block(0x80, 5)) == [0] * 5
+
+        # Trigger on the bytes "GO" sent to event_in as a UART line at 6
+        # cycles per bit, and nothing before them. The divisor is changed
+        # with the line idle for longer than a byte at the old one. The
+        # pattern is staged and committed along with the arm bits.
+        yield dut.event_in.eq(1)
+        for _ in range(12 * 104):
+            yield
+        yield from bus.write(0x10, 0)
+        yield from bus.write(0x20, 0)
+        yield from bus.write(0x30, 0)
+        yield from bus.write(0x08, 1)
+        yield from bus.write(0xa8, 6)
+        yield from bus.write_block(0xb0, [0x474f, 0])
+        yield from bus.write_block(0xb8, [0xffff, 0])
+        yield from bus.write(0x00, 1 << 6)
+        yield from bus.write(0x30, 1)
+        yield from bus.write(0x20, 1)
+        yield from bus.write(0x10, 1)
+        yield from bus.write(0x0c, 0)
+        yield from bus.write(0x08, 0)
+        for byte in b"NOGO":
+            assert not (yield dut.fired_out)
+            for bit in [0] + [(byte >> i) & 1 for i in range(8)] + [1]:
+                yield dut.event_in.eq(bit)
+                for _ in range(6):
+                    yield
+        # The last byte comes in a few cycles after its stop bit starts,
+        # for the synchronizer, and the glitch follows it as usual.
+        glitch = 0
+        for _ in range(0x40):
+            yield
+            glitch += yield dut.glitch_out
+        assert (yield from bus.read(0x78)) & 1 == dut.pattern_trigger
+        if dut.pattern_trigger:
+            assert glitch == 5
+            assert (yield dut.fired_out)
+            assert (yield from bus.read(0xac)) == ord("O")
+        else:
+            # Built without the pattern trigger, trigger_sel 2 never fires
+            # and its registers read 0.
+            assert glitch == 0
+            assert (yield from bus.read(0xb0)) == 0
+            assert (yield from bus.read(0x00)) == 0
+
+    for pipelined in (False, True):
+        # The pipelined run leaves out the result FIFO, timestamps, pattern
+        # trigger, sequence table and staging. Both keep the sweep, whose
+        # registers the bus tests use.
+        if pipelined:
+            dut = GlitchCoreWb(native_event_counter=True, pipelined=True, sweep=True)
+        else:
+            dut = GlitchCoreWb(native_event_counter=True, pattern_trigger=True, sequence=True, staging=True,
+                sweep=True, timestamps=True, result_fifo=True, result_fifo_depth=4,
+                result_fields=GlitchCoreWb.result_field_names)
+        sim = Simulator(dut)
+        sim.add_clock(1e-6) # 1 MHz
+        def process():
+            yield from bench(dut, WishboneBFM(dut, pipelined))
+        sim.add_sync_process(process)
+        with sim.write_vcd("glitchcore_wb{}.vcd".format("_pipelined" if pipelined else "")):
+            sim.run()
     with open("glitchcore_wb.v", "w") as f:
         top = GlitchCoreWb()
         f.write(verilog.convert(top, name="glitchcore_wb", ports=[
@@ -208,6 +795,7 @@ if __name__ == "__main__":
 
             # Out, to external.
             top.glitch_out,
+            top.fired_out,
 
             # Wishbone I/O
             top.wb_adr_i,
@@ -218,4 +806,7 @@ if __name__ == "__main__":
             top.wb_stb_i,
             top.wb_ack_o,
             top.wb_cyc_i,
+            top.wb_stall_o,
+            top.wb_cti_i,
+            top.wb_bte_i,
         ]))
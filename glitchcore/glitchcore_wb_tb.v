@@ -5,13 +5,15 @@ module glitchcore_wb_tb;
 	reg event_in, rst, clk, wb_we_i, wb_stb_i, wb_cyc_i;
 	wire glitch_out, wb_ack_o;
 	reg [3:0] wb_sel_i;
+	reg [2:0] wb_cti_i;
+	reg [1:0] wb_bte_i;
 	reg [31:0] wb_adr_i;
 	reg [31:0] wb_dat_i;
 	wire [31:0] wb_dat_o;
 
 	localparam period = 20;
 
-	glitchcore_wb DUT (.clk(clk), .rst(rst), .event_in(event_in), .glitch_out(glitch_out), .wb_adr_i(wb_adr_i), .wb_dat_i(wb_dat_i), .wb_dat_o(wb_dat_o), .wb_we_i(wb_we_i), .wb_sel_i(wb_sel_i), .wb_stb_i(wb_stb_i), .wb_ack_o(wb_ack_o), .wb_cyc_i(wb_cyc_i));
+	glitchcore_wb DUT (.clk(clk), .rst(rst), .event_in(event_in), .glitch_out(glitch_out), .wb_adr_i(wb_adr_i), .wb_dat_i(wb_dat_i), .wb_dat_o(wb_dat_o), .wb_we_i(wb_we_i), .wb_sel_i(wb_sel_i), .wb_stb_i(wb_stb_i), .wb_ack_o(wb_ack_o), .wb_cyc_i(wb_cyc_i), .wb_cti_i(wb_cti_i), .wb_bte_i(wb_bte_i));
 
 	always
 	begin
@@ -22,6 +24,35 @@ module glitchcore_wb_tb;
 		#10;
 	end
 
+	integer glitches = 0;
+	always @(posedge glitch_out)
+		glitches = glitches + 1;
+
+	// A classic Wishbone write of a whole word: cyc, stb and every byte
+	// select held until the cycle after ack, when the write takes effect.
+	// Signals change on the falling edge, away from the rising one.
+	task wb_write;
+		input [31:0] adr;
+		input [31:0] dat;
+		begin
+			@(negedge clk);
+			wb_adr_i = adr;
+			wb_dat_i = dat;
+			wb_we_i = 1;
+			wb_sel_i = 4'hf;
+			wb_cyc_i = 1;
+			wb_stb_i = 1;
+			@(negedge clk);
+			while (!wb_ack_o)
+				@(negedge clk);
+			@(negedge clk);
+			wb_we_i = 0;
+			wb_sel_i = 0;
+			wb_cyc_i = 0;
+			wb_stb_i = 0;
+		end
+	endtask
+
 	always @(posedge clk) begin
 		$dumpfile("glitchcore_wb_tb.vcd");
 		$dumpvars();
@@ -29,6 +60,8 @@ module glitchcore_wb_tb;
 		event_in = 0;
 		wb_we_i = 0;
 		wb_sel_i = 0;
+		wb_cti_i = 0;
+		wb_bte_i = 0;
 		wb_stb_i = 0;
 		wb_cyc_i = 0;
 		wb_adr_i = 0;
@@ -39,59 +72,12 @@ module glitchcore_wb_tb;
 		rst = 0;
 		#period;
 
-		wb_adr_i = 32'h14;
-		wb_dat_i = 32'h08;
-		wb_stb_i = 1;
-		wb_we_i = 1;
-		#period;
-		wb_we_i = 0;
-		wb_stb_i = 0;
-		#period;
-
-		wb_adr_i = 32'h24;
-		wb_dat_i = 32'h10;
-		wb_stb_i = 1;
-		wb_we_i = 1;
-		#period;
-		wb_we_i = 0;
-		wb_stb_i = 0;
-		#period;
-
-		wb_adr_i = 32'h34;
-		wb_dat_i = 32'h02;
-		wb_stb_i = 1;
-		wb_we_i = 1;
-		#period;
-		wb_we_i = 0;
-		wb_stb_i = 0;
-		#period;
-
-		wb_adr_i = 32'h30;
-		wb_dat_i = 32'h01;
-		wb_stb_i = 1;
-		wb_we_i = 1;
-		#period;
-		wb_we_i = 0;
-		wb_stb_i = 0;
-		#period;
-
-		wb_adr_i = 32'h20;
-		wb_dat_i = 32'h01;
-		wb_stb_i = 1;
-		wb_we_i = 1;
-		#period;
-		wb_we_i = 0;
-		wb_stb_i = 0;
-		#period;
-
-		wb_adr_i = 32'h10;
-		wb_dat_i = 32'h01;
-		wb_stb_i = 1;
-		wb_we_i = 1;
-		#period;
-		wb_we_i = 0;
-		wb_stb_i = 0;
-		#period;
+		wb_write(32'h14, 32'h08);
+		wb_write(32'h24, 32'h10);
+		wb_write(32'h34, 32'h02);
+		wb_write(32'h30, 32'h01);
+		wb_write(32'h20, 32'h01);
+		wb_write(32'h10, 32'h01);
 
 		#(period * 4);
 
@@ -129,87 +115,15 @@ module glitchcore_wb_tb;
 		#period;
 
 		#(period * 30);
-
-		wb_adr_i = 32'h10;
-		wb_dat_i = 32'h00;
-		wb_stb_i = 1;
-		wb_we_i = 1;
-		#period;
-		wb_we_i = 0;
-		wb_stb_i = 0;
-		#period;
-
-		wb_adr_i = 32'h20;
-		wb_dat_i = 32'h00;
-		wb_stb_i = 1;
-		wb_we_i = 1;
-		#period;
-		wb_we_i = 0;
-		wb_stb_i = 0;
-		#period;
-
-		wb_adr_i = 32'h30;
-		wb_dat_i = 32'h00;
-		wb_stb_i = 1;
-		wb_we_i = 1;
-		#period;
-		wb_we_i = 0;
-		wb_stb_i = 0;
-		#period;
-
-		wb_adr_i = 32'h14;
-		wb_dat_i = 32'h02;
-		wb_stb_i = 1;
-		wb_we_i = 1;
-		#period;
-		wb_we_i = 0;
-		wb_stb_i = 0;
-		#period;
-
-		wb_adr_i = 32'h24;
-		wb_dat_i = 32'h18;
-		wb_stb_i = 1;
-		wb_we_i = 1;
-		#period;
-		wb_we_i = 0;
-		wb_stb_i = 0;
-		#period;
-
-		wb_adr_i = 32'h34;
-		wb_dat_i = 32'h20;
-		wb_stb_i = 1;
-		wb_we_i = 1;
-		#period;
-		wb_we_i = 0;
-		wb_stb_i = 0;
-		#period;
-
-		wb_adr_i = 32'h30;
-		wb_dat_i = 32'h01;
-		wb_stb_i = 1;
-		wb_we_i = 1;
-		#period;
-		wb_we_i = 0;
-		wb_stb_i = 0;
-		#period;
-
-		wb_adr_i = 32'h20;
-		wb_dat_i = 32'h01;
-		wb_stb_i = 1;
-		wb_we_i = 1;
-		#period;
-		wb_we_i = 0;
-		wb_stb_i = 0;
-		#period;
-
-		wb_adr_i = 32'h10;
-		wb_dat_i = 32'h01;
-		wb_stb_i = 1;
-		wb_we_i = 1;
-		#period;
-		wb_we_i = 0;
-		wb_stb_i = 0;
-		#period;
+		wb_write(32'h10, 32'h00);
+		wb_write(32'h20, 32'h00);
+		wb_write(32'h30, 32'h00);
+		wb_write(32'h14, 32'h02);
+		wb_write(32'h24, 32'h18);
+		wb_write(32'h34, 32'h20);
+		wb_write(32'h30, 32'h01);
+		wb_write(32'h20, 32'h01);
+		wb_write(32'h10, 32'h01);
 
 		#(period * 4);
 
@@ -224,6 +138,11 @@ module glitchcore_wb_tb;
 
 		#(period * 100);
 
+		// One glitch for each of the two runs above.
+		if (glitches == 2)
+			$display("PASS: glitch_out fired %0d times", glitches);
+		else
+			$display("FAIL: glitch_out fired %0d times, expected 2", glitches);
 		$finish;
 	end
 endmodule
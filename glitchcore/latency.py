@@ -0,0 +1,92 @@
+import itertools
+
+from amaranth.sim import Simulator, Settle
+
+from glitchcore import GlitchCore
+
+
+def measure(trigger_sel, delay_sel, pulse_sel, zero_delay, delay_threshold=0, timeout=100):
+    '''Return the cycles from event_in rising to glitch_out rising.
+
+    Simulates GlitchCore with the native event counter, an event threshold
+    of 1 and a pulse width of 1. A latency of 0 means glitch_out follows
+    event_in within the same clock cycle, through logic only. Returns None
+    if glitch_out doesn't rise within `timeout` cycles.
+    '''
+    dut = GlitchCore(native_event_counter=True)
+    result = []
+    def bench():
+        yield dut.trigger_sel_in.eq(trigger_sel)
+        yield dut.delay_sel_in.eq(delay_sel)
+        yield dut.pulse_sel_in.eq(pulse_sel)
+        yield dut.zero_delay_in.eq(zero_delay)
+        yield dut.event_counter_threshold_in.eq(1)
+        yield dut.delay_threshold.eq(delay_threshold)
+        yield dut.pulse_threshold.eq(1)
+        yield dut.event_counter_arm_in.eq(1)
+        yield dut.delay_arm.eq(1)
+        yield dut.pulse_arm.eq(1)
+        for _ in range(4):
+            yield
+        yield dut.event_in.eq(1)
+        for cycle in range(timeout):
+            yield Settle()
+            if (yield dut.glitch_out):
+                result.append(cycle)
+                return
+            yield
+
+    sim = Simulator(dut)
+    sim.add_clock(1e-6) # 1 MHz
+    sim.add_sync_process(bench)
+    sim.run()
+    return result[0] if result else None
+
+
+# Which stages sit between event_in and glitch_out for each mux setting.
+def path(trigger_sel, delay_sel, pulse_sel):
+    stages = []
+    if delay_sel == 0:
+        stages.append("counter" if trigger_sel == 0 else "event")
+        stages.append("delay")
+    elif delay_sel == 1:
+        stages.append("counter")
+    else:
+        stages.append("event")
+    if pulse_sel == 0:
+        stages.append("pulse")
+    return " -> ".join(stages)
+
+
+def configurations():
+    # delay_sel 3 behaves like 2.
+    for trigger_sel, delay_sel, pulse_sel, zero_delay in itertools.product((0, 1), (0, 1, 2), (0, 1), (0, 1)):
+        # trigger_sel and zero_delay only matter when the delay is in the path.
+        if delay_sel != 0 and (trigger_sel or zero_delay):
+            continue
+        yield trigger_sel, delay_sel, pulse_sel, zero_delay
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Measure the event_in to glitch_out latency of every mux setting.")
+    parser.add_argument("-d", "--delay", type=int, default=8,
+        help="second delay threshold to measure with (default: %(default)s)")
+    parser.add_argument("--markdown", action="store_true",
+        help="print a Markdown table")
+    args = parser.parse_args()
+
+    header = ("trigger_sel", "delay_sel", "pulse_sel", "zero_delay", "delay 0", "delay {}".format(args.delay), "path")
+    if args.markdown:
+        print("| " + " | ".join(header) + " |")
+        print("|" + "|".join("---" for _ in header) + "|")
+    else:
+        print("{:>11} {:>9} {:>9} {:>10} {:>8} {:>8}  {}".format(*header))
+    for config in configurations():
+        row = config + (measure(*config), measure(*config, delay_threshold=args.delay), path(*config[:3]))
+        if args.markdown:
+            print("| " + " | ".join(str(x) for x in row) + " |")
+        else:
+            print("{:11} {:9} {:9} {:10} {:8} {:8}  {}".format(*row))
@@ -0,0 +1,218 @@
+class GlitchCoreModel:
+    '''Cycle-exact behavioural model of the GlitchCore trigger chain.
+
+    Predicts when `glitch_out` is high for an event trace without ticking
+    every clock: each stage is worked out from the cycles at which the one
+    before it changes, so the cost scales with the number of event edges
+    rather than the length of the trace.
+
+    The model assumes the native event counter and a single attempt: every
+    stage is armed with the given thresholds at cycle 0 and stays armed.
+    Cycle t is the clock period after the t-th clock edge counted from
+    there. `event_in` is low before cycle 0.
+
+    event_polarity, trigger_sel, delay_sel, pulse_sel, zero_delay: The mux
+        and mode bits in reg 0x00.
+    '''
+    def __init__(self, event_threshold, delay_threshold, pulse_threshold,
+            event_polarity=0, trigger_sel=0, delay_sel=0, pulse_sel=0, zero_delay=0, width=32):
+        self.width = width
+        self.event_threshold = event_threshold
+        self.delay_threshold = delay_threshold
+        self.pulse_threshold = pulse_threshold
+        self.event_polarity = event_polarity
+        self.trigger_sel = trigger_sel
+        self.delay_sel = delay_sel
+        self.pulse_sel = pulse_sel
+        self.zero_delay = zero_delay
+
+    @classmethod
+    def from_registers(cls, regs, width=32):
+        '''Build a model from Wishbone register values, as {address: value}.'''
+        reg00 = regs.get(0x00, 0)
+        if (reg00 >> 6) & 1:
+            raise ValueError("The byte pattern trigger (reg 0x00 bit 6) is not modelled")
+        return cls(regs.get(0x14, 0), regs.get(0x24, 0), regs.get(0x34, 0),
+            event_polarity=reg00 & 1,
+            trigger_sel=(reg00 >> 1) & 1,
+            delay_sel=(reg00 >> 2) & 3,
+            pulse_sel=(reg00 >> 4) & 1,
+            zero_delay=(reg00 >> 5) & 1,
+            width=width)
+
+    # Every stage output below is a list of (start, stop) cycle intervals in
+    # which it is high; stop is None while it is still high at the end.
+
+    def _event_internal(self, toggles):
+        '''`event_in` after the polarity mux.'''
+        intervals = []
+        level = self.event_polarity
+        start = 0 if level else None
+        for cycle in toggles:
+            level ^= 1
+            if level:
+                start = cycle
+            elif cycle > start:
+                intervals.append((start, cycle))
+        if level:
+            intervals.append((start, None))
+        return intervals
+
+    def _event_trigger(self, event_internal):
+        '''Trigger of the native event counter, in the sync domain.
+
+        The counter is enabled from cycle 1, when the sync FSM has moved to
+        ARMED, and counts rising edges of the internal event. It triggers on
+        the edge where the count so far reaches threshold - 1 (wrapping like
+        the Verilog counter), and the trigger takes two cycles to cross
+        into the sync domain.
+        '''
+        threshold = (self.event_threshold - 1) % (1 << self.width)
+        count = 0
+        for start, _ in event_internal:
+            if start < 1:
+                continue
+            if count >= threshold:
+                return [(start + 2, None)]
+            count += 1
+        return []
+
+    @staticmethod
+    def _first(intervals):
+        return intervals[0][0] if intervals else None
+
+    def _delayed(self, trigger):
+        '''TriggerDelay: high from `threshold` cycles after its trigger.
+
+        In zero delay mode it is high from the trigger cycle itself.
+        '''
+        start = self._first(trigger)
+        if start is None:
+            return []
+        if self.zero_delay:
+            return [(start, None)]
+        return [(start + max(self.delay_threshold, 1), None)]
+
+    def _pulse(self, trigger):
+        '''TriggerPulse: high for `threshold` cycles from its trigger on.'''
+        start = self._first(trigger)
+        if start is None:
+            return []
+        return [(start, start + max(self.pulse_threshold, 1))]
+
+    def run(self, toggles):
+        '''Return the intervals in which `glitch_out` is high.
+
+        toggles: Strictly increasing cycles at which `event_in` changes
+            level.
+        '''
+        event_internal = self._event_internal(toggles)
+        event_trigger = self._event_trigger(event_internal)
+
+        if self.trigger_sel == 0:
+            delayed = self._delayed(event_trigger)
+        else:
+            delayed = self._delayed(event_internal)
+
+        if self.delay_sel == 0:
+            pulse_trigger = delayed
+        elif self.delay_sel == 1:
+            pulse_trigger = event_trigger
+        else:
+            pulse_trigger = event_internal
+
+        if self.pulse_sel == 0:
+            return self._pulse(pulse_trigger)
+        return pulse_trigger
+
+    def glitch_cycles(self, toggles):
+        '''Return (rise, fall) of the first glitch, or None if none happens.
+
+        fall is None when `glitch_out` stays high.
+        '''
+        intervals = self.run(toggles)
+        return intervals[0] if intervals else None
+
+
+def levels(intervals, cycles):
+    '''Expand intervals into a list of per-cycle levels.'''
+    result = [0] * cycles
+    for start, stop in intervals:
+        for cycle in range(start, min(cycles, cycles if stop is None else stop)):
+            result[cycle] = 1
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+    import random
+
+    from amaranth.sim import Simulator, Settle
+
+    from glitchcore import GlitchCore
+
+    parser = argparse.ArgumentParser(
+        description="Check the model cycle for cycle against the Amaranth simulation.")
+    parser.add_argument("-n", "--traces", type=int, default=200,
+        help="number of random traces (default: %(default)s)")
+    parser.add_argument("-c", "--cycles", type=int, default=200,
+        help="length of each trace in cycles (default: %(default)s)")
+    parser.add_argument("-s", "--seed", type=int,
+        help="random seed (default: random)")
+    args = parser.parse_args()
+
+    seed = args.seed if args.seed is not None else random.randrange(1 << 32)
+    rng = random.Random(seed)
+
+    def simulate(model, toggles, cycles):
+        '''Run the RTL on the same trace, returning glitch_out per cycle.'''
+        dut = GlitchCore(native_event_counter=True)
+        event = levels([(start, stop) for start, stop in zip(toggles[::2], toggles[1::2] + [None])], cycles)
+        glitch = []
+        def bench():
+            yield dut.event_polarity_in.eq(model.event_polarity)
+            yield dut.trigger_sel_in.eq(model.trigger_sel)
+            yield dut.delay_sel_in.eq(model.delay_sel)
+            yield dut.pulse_sel_in.eq(model.pulse_sel)
+            yield dut.zero_delay_in.eq(model.zero_delay)
+            yield dut.event_counter_threshold_in.eq(model.event_threshold)
+            yield dut.delay_threshold.eq(model.delay_threshold)
+            yield dut.pulse_threshold.eq(model.pulse_threshold)
+            for _ in range(4):
+                yield
+            yield dut.event_counter_arm_in.eq(1)
+            yield dut.delay_arm.eq(1)
+            yield dut.pulse_arm.eq(1)
+            for cycle in range(cycles):
+                yield dut.event_in.eq(event[cycle])
+                yield Settle()
+                glitch.append((yield dut.glitch_out))
+                yield
+        sim = Simulator(dut)
+        sim.add_clock(1e-6) # 1 MHz
+        sim.add_sync_process(bench)
+        sim.run()
+        return glitch
+
+    for trace in range(args.traces):
+        model = GlitchCoreModel(
+            event_threshold=rng.randrange(8),
+            delay_threshold=rng.randrange(24),
+            pulse_threshold=rng.randrange(8),
+            event_polarity=rng.randrange(2),
+            trigger_sel=rng.randrange(2),
+            delay_sel=rng.randrange(4),
+            pulse_sel=rng.randrange(2),
+            zero_delay=rng.randrange(2))
+        density = rng.choice([0.02, 0.1, 0.3, 0.7])
+        toggles = [cycle for cycle in range(args.cycles) if rng.random() < density]
+
+        expected = simulate(model, toggles, args.cycles)
+        predicted = levels(model.run(toggles), args.cycles)
+        if predicted != expected:
+            first = next(i for i, (p, e) in enumerate(zip(predicted, expected)) if p != e)
+            raise SystemExit("seed {} trace {}: {} toggles {}: model and RTL differ from cycle {}\n"
+                "  model: {}\n  RTL:   {}".format(seed, trace, vars(model), toggles, first,
+                    "".join(map(str, predicted)), "".join(map(str, expected))))
+
+    print("{} traces of {} cycles match (seed {})".format(args.traces, args.cycles, seed))
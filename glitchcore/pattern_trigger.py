@@ -0,0 +1,162 @@
+from amaranth import *
+
+from uart import UART
+
+
+class PatternTrigger(Elaboratable):
+    '''Trigger on a sequence of bytes received on a UART line.
+
+    The line is received with UART at a divisor set at run time, and the
+    last `depth` bytes are compared against `pattern` under `mask`, newest
+    byte in the lowest 8 bits. Only the bits set in the mask are compared,
+    so a pattern shorter than `depth` leaves the mask of the older bytes at
+    0. Byte positions with any mask bit set also need a byte to have been
+    received there, without a framing error.
+
+    The trigger rises in the cycle the last byte of the pattern is received,
+    which is when its stop bit is sampled: two cycles for the synchronizer
+    after the middle of the stop bit. It stays high until disarmed. Only
+    bytes completed while armed can trigger, but the ones before them still
+    count towards the pattern.
+    '''
+    def __init__(self, depth=8, divisor=104, divisor_bits=16):
+        self.depth = depth
+        self.divisor = divisor
+        self.divisor_bits = divisor_bits
+
+        # In, from external.
+        self.rx_i = Signal(reset=1)
+
+        # In, from host.
+        self.arm = Signal()
+        self.divisor_i = Signal(divisor_bits, reset=divisor)
+        self.pattern = Signal(8 * depth)
+        self.mask = Signal(8 * depth)
+
+        # Out, to host.
+        self.last_byte = Signal(8)
+
+        # Out, to delay.
+        self.trigger = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.submodules.uart = uart = UART(self.divisor, divisor_bits=self.divisor_bits)
+        m.d.comb += [
+            uart.rx_i.eq(self.rx_i),
+            uart.divisor_i.eq(self.divisor_i),
+            # rx_rdy is then high for the one cycle each byte comes in.
+            uart.rx_ack.eq(1),
+        ]
+
+        # Received bytes, newest first, each with a bit telling whether it
+        # was received cleanly.
+        history = Signal(8 * self.depth)
+        valid = Signal(self.depth)
+
+        # The history with the byte coming in this cycle shifted in, so the
+        # match doesn't wait for the shift.
+        window = Signal.like(history)
+        window_valid = Signal.like(valid)
+        m.d.comb += [
+            window.eq(Cat(uart.rx_data, history[:-8])),
+            window_valid.eq(Cat(~uart.rx_err, valid[:-1])),
+        ]
+
+        match = Signal()
+        m.d.comb += match.eq(Cat(
+            (((window[8*i:8*(i+1)] ^ self.pattern[8*i:8*(i+1)]) & self.mask[8*i:8*(i+1)]) == 0) &
+            (window_valid[i] | (self.mask[8*i:8*(i+1)] == 0))
+            for i in range(self.depth)).all())
+
+        with m.If(uart.rx_rdy):
+            m.d.sync += [
+                history.eq(window),
+                valid.eq(window_valid),
+                self.last_byte.eq(uart.rx_data),
+            ]
+
+        triggered = Signal()
+        with m.If(~self.arm):
+            m.d.sync += triggered.eq(0)
+        with m.Elif(uart.rx_rdy & match):
+            m.d.sync += triggered.eq(1)
+        m.d.comb += self.trigger.eq(triggered | (self.arm & uart.rx_rdy & match))
+
+        return m
+
+
+if __name__ == "__main__":
+    from amaranth.sim import Simulator
+
+    divisor = 6
+
+    def frame(byte, stop=1):
+        '''Line levels, one per bit, for a byte.'''
+        return [0] + [(byte >> i) & 1 for i in range(8)] + [stop]
+
+    dut = PatternTrigger(depth=4, divisor=divisor)
+    def bench():
+        def send(bits):
+            for bit in bits:
+                yield dut.rx_i.eq(bit)
+                for _ in range(divisor):
+                    yield
+                    if (yield dut.trigger):
+                        triggered.append(sent[0])
+            sent[0] += 1
+
+        sent = [0]
+        triggered = []
+
+        # Match "AB?" with the middle byte's low nibble ignored: 0x41 0x4? 0x43.
+        yield dut.pattern.eq(0x414243)
+        yield dut.mask.eq(0xfff0ff)
+        yield dut.arm.eq(1)
+        yield
+        for byte in b"xAPC":
+            yield from send(frame(byte))
+        yield from send([1])
+        assert not triggered, triggered
+        for byte in b"AOC":
+            yield from send(frame(byte))
+        yield from send([1])
+        # The last byte is received in the middle of its stop bit, two
+        # cycles late for the synchronizer, so just after the frame ends.
+        assert triggered and triggered[0] == 8, triggered
+        assert (yield dut.last_byte) == ord("C")
+
+        # Disarmed, the trigger drops, and re-armed it waits for the pattern
+        # to be completed again.
+        yield dut.arm.eq(0)
+        yield
+        yield dut.arm.eq(1)
+        yield
+        assert not (yield dut.trigger)
+        triggered.clear()
+
+        # A framing error in the middle breaks the pattern.
+        yield from send(frame(ord("A")))
+        yield from send(frame(ord("B"), stop=0))
+        yield from send([1] * 2)
+        yield from send(frame(ord("C")))
+        yield from send([1])
+        assert not triggered, triggered
+
+        # A four byte pattern that spans the whole history.
+        yield dut.pattern.eq(0xdeadbeef)
+        yield dut.mask.eq(0xffffffff)
+        for byte in (0xde, 0xad, 0xbe):
+            yield from send(frame(byte))
+        yield from send([1])
+        assert not triggered
+        yield from send(frame(0xef))
+        yield from send([1])
+        assert triggered, triggered
+
+    sim = Simulator(dut)
+    sim.add_clock(1e-6) # 1 MHz
+    sim.add_sync_process(bench)
+    with sim.write_vcd("pattern_trigger.vcd"):
+        sim.run()
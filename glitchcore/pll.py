@@ -0,0 +1,84 @@
+from amaranth import *
+from amaranth.lib.cdc import ResetSynchronizer
+
+
+def pll_config(clk_freq, target_freq):
+    '''Find SB_PLL40 dividers giving the frequency closest to `target_freq`.
+
+    Follows the iCE40 PLL limits (as icepll does): the phase detector runs
+    at 10-133 MHz, the VCO at 533-1066 MHz and the output at 16-275 MHz.
+
+    Returns (freq, divr, divf, divq, filter_range).
+    '''
+    best = None
+    for divr in range(16):
+        f_pfd = clk_freq / (divr + 1)
+        if not 10e6 <= f_pfd <= 133e6:
+            continue
+        for divf in range(128):
+            f_vco = f_pfd * (divf + 1)
+            if not 533e6 <= f_vco <= 1066e6:
+                continue
+            for divq in range(1, 7):
+                f_out = f_vco / (1 << divq)
+                if not 16e6 <= f_out <= 275e6:
+                    continue
+                if best is None or abs(f_out - target_freq) < abs(best[0] - target_freq):
+                    best = (f_out, divr, divf, divq)
+    if best is None:
+        raise ValueError("No PLL setting for {} Hz from {} Hz".format(target_freq, clk_freq))
+
+    f_out, divr, divf, divq = best
+    f_pfd = clk_freq / (divr + 1)
+    for filter_range, limit in enumerate((17e6, 26e6, 44e6, 66e6, 101e6), 1):
+        if f_pfd < limit:
+            break
+    else:
+        filter_range = 6
+    return f_out, divr, divf, divq, filter_range
+
+
+class PLL(Elaboratable):
+    '''Clock a domain from the iCE40 PLL, fed by the sync clock.
+
+    The domain is held in reset until the PLL has locked.
+    '''
+    def __init__(self, clk_freq, target_freq, domain="core"):
+        self.domain = domain
+        self.freq, self.divr, self.divf, self.divq, self.filter_range = pll_config(clk_freq, target_freq)
+
+        # Out, to host.
+        self.lock = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.submodules.pll = Instance("SB_PLL40_CORE",
+            p_FEEDBACK_PATH = "SIMPLE",
+            p_DIVR = self.divr,
+            p_DIVF = self.divf,
+            p_DIVQ = self.divq,
+            p_FILTER_RANGE = self.filter_range,
+            i_REFERENCECLK = ClockSignal("sync"),
+            i_RESETB = 1,
+            i_BYPASS = 0,
+            o_PLLOUTCORE = ClockSignal(self.domain),
+            o_LOCK = self.lock,
+        )
+        m.submodules += ResetSynchronizer(~self.lock | ResetSignal("sync"), domain=self.domain)
+
+        return m
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Print the PLL setting for a core clock.")
+    parser.add_argument("frequency", type=float, help="target core clock in MHz")
+    parser.add_argument("-i", "--input", type=float, default=12,
+        help="reference clock in MHz (default: %(default)s)")
+    args = parser.parse_args()
+
+    freq, divr, divf, divq, filter_range = pll_config(args.input * 1e6, args.frequency * 1e6)
+    print("{:.4f} MHz: DIVR={} DIVF={} DIVQ={} FILTER_RANGE={}".format(
+        freq / 1e6, divr, divf, divq, filter_range))
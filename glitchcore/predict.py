@@ -0,0 +1,140 @@
+import numpy as np
+
+
+# Marks a glitch that never starts, or one that never ends.
+NEVER = -1
+
+
+def _first_high(toggles, event_polarity):
+    '''First cycle the internal event is high, or NEVER.'''
+    if event_polarity:
+        # High from before cycle 0 unless event_in rises right at cycle 0.
+        if len(toggles) == 0 or toggles[0] != 0:
+            return 0
+        return toggles[1] if len(toggles) > 1 else NEVER
+    return toggles[0] if len(toggles) else NEVER
+
+
+def _rising_edges(toggles, event_polarity):
+    '''Cycles at which the internal event rises, counting from cycle 1.'''
+    edges = toggles[1::2] if event_polarity else toggles[0::2]
+    return edges[edges >= 1]
+
+
+def _first_interval(toggles, event_polarity):
+    '''(rise, fall) of the first interval in which the internal event is high.'''
+    start = _first_high(toggles, event_polarity)
+    if start == NEVER:
+        return NEVER, NEVER
+    later = toggles[toggles > start]
+    return start, (later[0] if len(later) else NEVER)
+
+
+def predict(toggles, event_thresholds, delays, widths,
+        event_polarity=0, trigger_sel=0, delay_sel=0, pulse_sel=0, zero_delay=0, width=32):
+    '''Predict the first glitch for whole arrays of thresholds at once.
+
+    Vectorized over the parameters, with the same semantics as
+    GlitchCoreModel in model.py: every stage is armed at cycle 0, the event
+    counter triggers on the edge where `count_o >= threshold_i - 1` (with
+    the Verilog wrap-around) and reaches the sync domain two cycles later,
+    and the delay and pulse generators stop at `value >= threshold`
+    (except for the delay in zero delay mode, which passes its trigger on
+    in the same cycle).
+
+    toggles: Strictly increasing cycles at which `event_in` changes level.
+    event_thresholds, delays, widths: Integer arrays, broadcast together.
+
+    Returns (rise, fall) arrays of the broadcast shape with the cycles in
+    which the first glitch starts and stops. rise is NEVER where there is no
+    glitch, and fall is NEVER where glitch_out stays high.
+    '''
+    toggles = np.asarray(toggles, dtype=np.int64)
+    event_thresholds, delays, widths = np.broadcast_arrays(
+        np.asarray(event_thresholds, dtype=np.int64),
+        np.asarray(delays, dtype=np.int64),
+        np.asarray(widths, dtype=np.int64))
+
+    # Event counter: the k-th counted edge (0-based) triggers, with
+    # k = threshold - 1 modulo the counter width.
+    edges = _rising_edges(toggles, event_polarity)
+    k = (event_thresholds - 1) % (1 << width)
+    if len(edges):
+        event_trigger = np.where(k < len(edges), edges[np.minimum(k, len(edges) - 1)] + 2, NEVER)
+    else:
+        event_trigger = np.full(k.shape, NEVER, dtype=np.int64)
+
+    first_high = _first_high(toggles, event_polarity)
+    if trigger_sel == 0:
+        delay_start = event_trigger
+    else:
+        delay_start = np.full(event_thresholds.shape, first_high, dtype=np.int64)
+    if zero_delay:
+        delayed = delay_start
+    else:
+        delayed = np.where(delay_start != NEVER, delay_start + np.maximum(delays, 1), NEVER)
+
+    if delay_sel == 0:
+        pulse_start = delayed
+    elif delay_sel == 1:
+        pulse_start = event_trigger
+    else:
+        pulse_start = np.full(event_thresholds.shape, first_high, dtype=np.int64)
+
+    if pulse_sel == 0:
+        fall = np.where(pulse_start != NEVER, pulse_start + np.maximum(widths, 1), NEVER)
+        return pulse_start, fall
+
+    # Glitch output straight from the pulse trigger: the delay and event
+    # trigger stay high once set, the raw event follows the trace.
+    if delay_sel in (0, 1):
+        return pulse_start, np.full(pulse_start.shape, NEVER, dtype=np.int64)
+    _, first_fall = _first_interval(toggles, event_polarity)
+    fall = np.where(pulse_start != NEVER, first_fall, NEVER)
+    return pulse_start, fall
+
+
+if __name__ == "__main__":
+    import argparse
+    import random
+    import time
+
+    from model import GlitchCoreModel
+
+    parser = argparse.ArgumentParser(
+        description="Check the predictor against model.py and time it on a large batch.")
+    parser.add_argument("-n", "--traces", type=int, default=200,
+        help="number of random traces to check (default: %(default)s)")
+    parser.add_argument("-s", "--seed", type=int,
+        help="random seed (default: random)")
+    args = parser.parse_args()
+
+    seed = args.seed if args.seed is not None else random.randrange(1 << 32)
+    rng = random.Random(seed)
+
+    for trace in range(args.traces):
+        density = rng.choice([0.02, 0.1, 0.3, 0.7])
+        toggles = [cycle for cycle in range(rng.choice([20, 200, 1000])) if rng.random() < density]
+        muxes = dict(
+            event_polarity=rng.randrange(2),
+            trigger_sel=rng.randrange(2),
+            delay_sel=rng.randrange(4),
+            pulse_sel=rng.randrange(2),
+            zero_delay=rng.randrange(2))
+        grid = np.meshgrid(np.arange(12), np.arange(0, 40, 3), np.arange(6), indexing="ij")
+        rise, fall = predict(toggles, *grid, **muxes)
+        for index in np.ndindex(rise.shape):
+            events, delay, pulse = (int(g[index]) for g in grid)
+            expected = GlitchCoreModel(events, delay, pulse, **muxes).glitch_cycles(toggles)
+            got = None if rise[index] == NEVER else (int(rise[index]), None if fall[index] == NEVER else int(fall[index]))
+            if got != expected:
+                raise SystemExit("seed {} trace {}: {} thresholds {} toggles {}: predicted {}, model {}".format(
+                    seed, trace, muxes, (events, delay, pulse), toggles, got, expected))
+
+    toggles = np.cumsum(np.random.default_rng(seed).integers(1, 100, 100000))
+    grid = np.meshgrid(np.arange(1, 1001), np.arange(0, 1000, 10), np.arange(1, 11), indexing="ij")
+    start = time.perf_counter()
+    predict(toggles, *grid)
+    elapsed = time.perf_counter() - start
+    print("{} traces match the model (seed {}); {} combinations over {} toggles in {:.1f} ms".format(
+        args.traces, seed, grid[0].size, len(toggles), elapsed * 1e3))
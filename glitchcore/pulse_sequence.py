@@ -0,0 +1,166 @@
+from amaranth import *
+
+
+class PulseSequence(Elaboratable):
+    '''Play a table of (delay, width) entries after a single trigger.
+
+    With a length of 0 the table is bypassed. Otherwise the first entry
+    sets the delay and pulse width for the trigger as usual, and each time
+    a pulse ends the next entry is loaded and the delay and pulse
+    generators are re-armed and triggered again straight away. The delay of
+    every entry after the first therefore counts from the end of the pulse
+    before it, with two extra cycles in between: one for the pulse
+    generator to finish and one to re-arm.
+
+    The table is held in block RAM and written one entry at a time.
+    '''
+    def __init__(self, width=32, depth=64):
+        self.width = width
+        self.depth = depth
+
+        # In, from host.
+        self.length = Signal(range(depth + 1))
+        self.w_addr = Signal(range(depth))
+        self.w_delay = Signal(width)
+        self.w_pulse = Signal(width)
+        self.w_en = Signal()
+
+        # In, from the arm source (host or sweep).
+        self.arm = Signal()
+
+        # In, from pulse generator.
+        self.pulse = Signal()
+        self.fired = Signal()
+
+        # Out, to delay and pulse generator.
+        self.active = Signal()
+        self.delay_threshold = Signal(width)
+        self.pulse_threshold = Signal(width)
+        # Hold the delay and pulse generator disarmed for a cycle.
+        self.rearm = Signal()
+        # Trigger the delay generator regardless of its trigger input.
+        self.chain = Signal()
+        # The pulse being played is the last one of the sequence.
+        self.last = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        table = Memory(width=2 * self.width, depth=self.depth)
+        m.submodules.rd = rd = table.read_port()
+        m.submodules.wr = wr = table.write_port()
+
+        index = Signal(range(self.depth))
+
+        m.d.comb += [
+            wr.addr.eq(self.w_addr),
+            wr.data.eq(Cat(self.w_delay, self.w_pulse)),
+            wr.en.eq(self.w_en),
+
+            # The entry at `index` shows up one cycle after index changes,
+            # which is while the generators are being re-armed.
+            rd.addr.eq(index),
+            self.delay_threshold.eq(rd.data[:self.width]),
+            self.pulse_threshold.eq(rd.data[self.width:]),
+
+            self.active.eq(self.length != 0),
+            self.last.eq(index + 1 >= self.length),
+        ]
+
+        with m.FSM() as fsm:
+            with m.State("IDLE"):
+                m.d.sync += index.eq(0)
+                with m.If(self.arm & self.active):
+                    m.next = "RUN"
+            with m.State("RUN"):
+                with m.If(self.fired & ~self.pulse & ~self.last):
+                    m.d.sync += index.eq(index + 1)
+                    m.next = "REARM"
+                with m.If(~self.arm):
+                    m.next = "IDLE"
+            with m.State("REARM"):
+                m.d.comb += self.rearm.eq(1)
+                m.next = "CHAIN"
+                with m.If(~self.arm):
+                    m.next = "IDLE"
+            with m.State("CHAIN"):
+                m.d.comb += self.chain.eq(1)
+                m.next = "RUN"
+                with m.If(~self.arm):
+                    m.next = "IDLE"
+
+        return m
+
+
+if __name__ == "__main__":
+    from amaranth.sim import Simulator
+
+    from delay import TriggerDelay
+    from pulse import TriggerPulse
+
+    entries = [(3, 2), (5, 1), (0, 4)]
+
+    class Chain(Elaboratable):
+        def __init__(self):
+            self.trigger_in = Signal()
+            self.arm = Signal()
+            self.out = Signal()
+            self.fired = Signal()
+            self.seq = PulseSequence()
+
+        def elaborate(self, platform):
+            m = Module()
+            m.submodules.seq = seq = self.seq
+            m.submodules.delay = delay = TriggerDelay()
+            m.submodules.pulse = pulse = TriggerPulse()
+            m.d.comb += [
+                seq.arm.eq(self.arm),
+                seq.pulse.eq(pulse.pulse),
+                seq.fired.eq(pulse.fired),
+                delay.arm.eq(self.arm & ~seq.rearm),
+                delay.threshold.eq(seq.delay_threshold),
+                delay.trigger_in.eq(self.trigger_in | seq.chain),
+                pulse.arm.eq(self.arm & ~seq.rearm),
+                pulse.threshold.eq(seq.pulse_threshold),
+                pulse.trigger_in.eq(delay.trigger_delayed),
+                self.out.eq(pulse.pulse),
+                self.fired.eq(pulse.fired & seq.last),
+            ]
+            return m
+
+    dut = Chain()
+    def bench():
+        for i, (delay, width) in enumerate(entries):
+            yield dut.seq.w_addr.eq(i)
+            yield dut.seq.w_delay.eq(delay)
+            yield dut.seq.w_pulse.eq(width)
+            yield dut.seq.w_en.eq(1)
+            yield
+        yield dut.seq.w_en.eq(0)
+        yield dut.seq.length.eq(len(entries))
+        yield dut.arm.eq(1)
+        yield
+        yield
+        yield dut.trigger_in.eq(1)
+
+        levels = []
+        for _ in range(40):
+            yield
+            levels.append((yield dut.out))
+            if (yield dut.fired) and not (yield dut.out):
+                break
+        trace = "".join(map(str, levels)).strip("0")
+        # Entry 0 is 2 wide. Entry 1 follows 5 + 2 cycles later, 1 wide,
+        # and entry 2 after 1 + 2 cycles (a delay of 0 still takes one),
+        # 4 wide.
+        assert trace == "11" + "0" * 7 + "1" + "0" * 3 + "1111", trace
+        for _ in range(10):
+            yield
+            assert (yield dut.fired)
+            assert not (yield dut.out)
+
+    sim = Simulator(dut)
+    sim.add_clock(1e-6) # 1 MHz
+    sim.add_sync_process(bench)
+    with sim.write_vcd("pulse_sequence.vcd"):
+        sim.run()
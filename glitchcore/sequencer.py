@@ -0,0 +1,182 @@
+from amaranth import *
+
+
+class SweepSequencer(Elaboratable):
+    # Cycles arm is held low between attempts. The event counter's trigger
+    # takes two cycles to clear through its synchronizer.
+    rearm_cycles = 4
+
+    def __init__(self, width=32):
+        self.width = width
+
+        # In, from host.
+        self.run = Signal()
+        self.attempts = Signal(width)
+        self.holdoff = Signal(width)
+        self.delay_start = Signal(width)
+        self.delay_stop = Signal(width)
+        self.delay_step = Signal(width)
+        self.pulse_start = Signal(width)
+        self.pulse_stop = Signal(width)
+        self.pulse_step = Signal(width)
+
+        # Out, to host.
+        self.busy = Signal()
+        self.done = Signal(width)
+
+        # In, from pulse generator.
+        self.pulse = Signal()
+        self.fired = Signal()
+
+        # Out, to event counter, delay and pulse generator.
+        self.arm = Signal()
+        self.delay_threshold = Signal(width)
+        self.pulse_threshold = Signal(width)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        holdoff_count = Signal(self.width)
+        rearm_count = Signal(range(self.rearm_cycles))
+
+        # Pulse width steps fastest. Once it would pass its stop value it
+        # wraps back to the start and the delay takes a step, and likewise
+        # for the delay. A step of 0 keeps the value fixed.
+        pulse_next = Signal(self.width + 1)
+        delay_next = Signal(self.width + 1)
+        pulse_wrap = Signal()
+        delay_wrap = Signal()
+        m.d.comb += [
+            pulse_next.eq(self.pulse_threshold + self.pulse_step),
+            delay_next.eq(self.delay_threshold + self.delay_step),
+            pulse_wrap.eq((self.pulse_step == 0) | (pulse_next > self.pulse_stop)),
+            delay_wrap.eq((self.delay_step == 0) | (delay_next > self.delay_stop)),
+        ]
+
+        with m.FSM() as fsm:
+            with m.State("IDLE"):
+                m.d.comb += self.arm.eq(0)
+                with m.If(self.run):
+                    m.d.sync += self.done.eq(0)
+                    m.d.sync += self.delay_threshold.eq(self.delay_start)
+                    m.d.sync += self.pulse_threshold.eq(self.pulse_start)
+                    m.next = "ARMED"
+            with m.State("ARMED"):
+                m.d.comb += self.busy.eq(1)
+                m.d.comb += self.arm.eq(1)
+                with m.If(self.fired & ~self.pulse):
+                    m.d.sync += holdoff_count.eq(0)
+                    m.next = "HOLDOFF"
+                with m.If(~self.run):
+                    m.next = "IDLE"
+            with m.State("HOLDOFF"):
+                # Give the target time to recover before the next attempt,
+                # with the counts of this one still readable.
+                m.d.comb += self.busy.eq(1)
+                m.d.comb += self.arm.eq(1)
+                m.d.sync += holdoff_count.eq(holdoff_count + 1)
+                with m.If(holdoff_count >= self.holdoff):
+                    m.d.sync += self.done.eq(self.done + 1)
+                    with m.If(pulse_wrap):
+                        m.d.sync += self.pulse_threshold.eq(self.pulse_start)
+                        with m.If(delay_wrap):
+                            m.d.sync += self.delay_threshold.eq(self.delay_start)
+                        with m.Else():
+                            m.d.sync += self.delay_threshold.eq(delay_next)
+                    with m.Else():
+                        m.d.sync += self.pulse_threshold.eq(pulse_next)
+                    with m.If((self.attempts != 0) & (self.done + 1 == self.attempts)):
+                        m.next = "FINISHED"
+                    with m.Else():
+                        m.d.sync += rearm_count.eq(0)
+                        m.next = "REARM"
+                with m.If(~self.run):
+                    m.next = "IDLE"
+            with m.State("REARM"):
+                # Arm low for a few cycles resets every stage.
+                m.d.comb += self.busy.eq(1)
+                m.d.comb += self.arm.eq(0)
+                m.d.sync += rearm_count.eq(rearm_count + 1)
+                with m.If(rearm_count == self.rearm_cycles - 1):
+                    m.next = "ARMED"
+                with m.If(~self.run):
+                    m.next = "IDLE"
+            with m.State("FINISHED"):
+                m.d.comb += self.arm.eq(0)
+                with m.If(~self.run):
+                    m.next = "IDLE"
+
+        return m
+
+
+if __name__ == "__main__":
+    from amaranth.sim import Simulator
+
+    dut = SweepSequencer()
+    def bench():
+        yield dut.attempts.eq(5)
+        yield dut.holdoff.eq(3)
+        yield dut.delay_start.eq(10)
+        yield dut.delay_stop.eq(11)
+        yield dut.delay_step.eq(1)
+        yield dut.pulse_start.eq(2)
+        yield dut.pulse_stop.eq(6)
+        yield dut.pulse_step.eq(3)
+        yield
+        assert not (yield dut.busy)
+        assert not (yield dut.arm)
+
+        yield dut.run.eq(1)
+        yield
+        yield
+        seen = []
+        for attempt in range(5):
+            assert (yield dut.busy)
+            assert (yield dut.arm)
+            seen.append(((yield dut.delay_threshold), (yield dut.pulse_threshold)))
+
+            # Stand in for the pulse generator: fire, pulse for a few cycles,
+            # then stay fired until disarmed.
+            for _ in range(4):
+                yield
+            yield dut.fired.eq(1)
+            yield dut.pulse.eq(1)
+            for _ in range(4):
+                yield
+            yield dut.pulse.eq(0)
+            for _ in range(4):
+                yield
+                assert (yield dut.arm)
+            while (yield dut.arm):
+                yield
+            yield dut.fired.eq(0)
+            assert (yield dut.done) == attempt + 1
+            if attempt < 4:
+                low = 0
+                while not (yield dut.arm):
+                    low += 1
+                    yield
+                assert low == dut.rearm_cycles, low
+            else:
+                yield
+
+        assert seen == [(10, 2), (10, 5), (11, 2), (11, 5), (10, 2)], seen
+        for _ in range(30):
+            yield
+            assert not (yield dut.busy)
+            assert not (yield dut.arm)
+
+        yield dut.run.eq(0)
+        yield
+        yield
+        yield dut.run.eq(1)
+        yield
+        yield
+        assert (yield dut.busy)
+        assert (yield dut.done) == 0
+
+    sim = Simulator(dut)
+    sim.add_clock(1e-6) # 1 MHz
+    sim.add_sync_process(bench)
+    with sim.write_vcd("sequencer.vcd"):
+        sim.run()
@@ -22,6 +22,7 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 from amaranth import *
+from amaranth.lib.cdc import FFSynchronizer
 
 
 class UART(Elaboratable):
@@ -31,13 +32,24 @@ class UART(Elaboratable):
     divisor : int
         Set to ``round(clk-rate / baud-rate)``.
         E.g. ``12e6 / 115200`` = ``104``.
+    divisor_bits : int or None
+        If set, the divisor can be changed at run time through ``divisor_i``,
+        a signal of this many bits that resets to ``divisor``. It must not be
+        set below 4, and should only be changed while both directions are
+        idle.
     """
-    def __init__(self, divisor, data_bits=8):
+    def __init__(self, divisor, data_bits=8, divisor_bits=None):
         assert divisor >= 4
 
         self.data_bits = data_bits
         self.divisor   = divisor
 
+        if divisor_bits is not None:
+            assert divisor < 2**divisor_bits
+            self.divisor_i = Signal(divisor_bits, reset=divisor)
+        else:
+            self.divisor_i = None
+
         self.tx_o    = Signal()
         self.rx_i    = Signal()
 
@@ -54,7 +66,14 @@ class UART(Elaboratable):
     def elaborate(self, platform):
         m = Module()
 
-        tx_phase = Signal(range(self.divisor))
+        if self.divisor_i is not None:
+            divisor = self.divisor_i
+            phase_shape = len(self.divisor_i)
+        else:
+            divisor = self.divisor
+            phase_shape = range(self.divisor)
+
+        tx_phase = Signal(phase_shape)
         tx_shreg = Signal(1 + self.data_bits + 1, reset=-1)
         tx_count = Signal(range(len(tx_shreg) + 1))
 
@@ -65,7 +84,7 @@ class UART(Elaboratable):
                 m.d.sync += [
                     tx_shreg.eq(Cat(C(0, 1), self.tx_data, C(1, 1))),
                     tx_count.eq(len(tx_shreg)),
-                    tx_phase.eq(self.divisor - 1),
+                    tx_phase.eq(divisor - 1),
                 ]
         with m.Else():
             with m.If(tx_phase != 0):
@@ -74,23 +93,28 @@ class UART(Elaboratable):
                 m.d.sync += [
                     tx_shreg.eq(Cat(tx_shreg[1:], C(1, 1))),
                     tx_count.eq(tx_count - 1),
-                    tx_phase.eq(self.divisor - 1),
+                    tx_phase.eq(divisor - 1),
                 ]
 
-        rx_phase = Signal(range(self.divisor))
+        # The receive line comes from outside the clock domain, so it is
+        # synchronized before use. Its idle level is high.
+        rx_i = Signal(reset=1)
+        m.submodules += FFSynchronizer(self.rx_i, rx_i, reset=1)
+
+        rx_phase = Signal(phase_shape)
         rx_shreg = Signal(1 + self.data_bits + 1, reset=-1)
         rx_count = Signal(range(len(rx_shreg) + 1))
 
         m.d.comb += self.rx_data.eq(rx_shreg[1:-1])
         with m.If(rx_count == 0):
             m.d.comb += self.rx_err.eq(~(~rx_shreg[0] & rx_shreg[-1]))
-            with m.If(~self.rx_i):
+            with m.If(~rx_i):
                 with m.If(self.rx_ack | ~self.rx_rdy):
                     m.d.sync += [
                         self.rx_rdy.eq(0),
                         self.rx_ovf.eq(0),
                         rx_count.eq(len(rx_shreg)),
-                        rx_phase.eq(self.divisor // 2),
+                        rx_phase.eq(divisor >> 1),
                     ]
                 with m.Else():
                     m.d.sync += self.rx_ovf.eq(1)
@@ -99,11 +123,15 @@ class UART(Elaboratable):
         with m.Else():
             with m.If(rx_phase != 0):
                 m.d.sync += rx_phase.eq(rx_phase - 1)
+            with m.Elif((rx_count == len(rx_shreg)) & rx_i):
+                # The line went back high before the middle of the start bit,
+                # so that was a glitch rather than a start bit.
+                m.d.sync += rx_count.eq(0)
             with m.Else():
                 m.d.sync += [
-                    rx_shreg.eq(Cat(rx_shreg[1:], self.rx_i)),
+                    rx_shreg.eq(Cat(rx_shreg[1:], rx_i)),
                     rx_count.eq(rx_count - 1),
-                    rx_phase.eq(self.divisor - 1),
+                    rx_phase.eq(divisor - 1),
                 ]
                 with m.If(rx_count == 1):
                     m.d.sync += self.rx_rdy.eq(1)
@@ -169,6 +197,67 @@ if __name__ == "__main__":
         with sim.write_vcd("uart.vcd", "uart.gtkw"):
             sim.run()
 
+        # Back-to-back loopback at every divisor down to the minimum, with a
+        # glitch on the line between bytes, both with fixed divisors and with
+        # the divisor set at run time.
+        def loopback_stress(dut, divisor):
+            data = [(i * 37 + divisor) & 0xff for i in range(32)]
+            received = []
+            glitch = Signal()
+
+            sim = Simulator(dut)
+            sim.add_clock(1e-6)
+
+            def loopback_proc():
+                yield Passive()
+                while True:
+                    yield dut.rx_i.eq((yield dut.tx_o) & ~(yield glitch))
+                    yield
+            sim.add_sync_process(loopback_proc)
+
+            def transmit_proc():
+                if dut.divisor_i is not None:
+                    yield dut.divisor_i.eq(divisor)
+                    yield
+                for i, byte in enumerate(data):
+                    while not (yield dut.tx_ack):
+                        yield
+                    if i == len(data) // 2:
+                        # A one-cycle low pulse while the line is idle.
+                        for _ in range(divisor * 2):
+                            yield
+                        yield glitch.eq(1)
+                        yield
+                        yield glitch.eq(0)
+                        for _ in range(divisor * 2):
+                            yield
+                    yield dut.tx_data.eq(byte)
+                    yield dut.tx_rdy.eq(1)
+                    yield
+                    yield dut.tx_rdy.eq(0)
+                    yield
+                for _ in range(divisor * 12):
+                    yield
+                assert received == data, (divisor, received)
+
+            def receive_proc():
+                yield Passive()
+                while True:
+                    if (yield dut.rx_rdy):
+                        assert not (yield dut.rx_err)
+                        received.append((yield dut.rx_data))
+                        yield dut.rx_ack.eq(1)
+                        yield
+                        yield dut.rx_ack.eq(0)
+                    yield
+            sim.add_sync_process(transmit_proc)
+            sim.add_sync_process(receive_proc)
+            sim.run()
+
+        for divisor in (4, 5, 6, 7, 8, 13):
+            loopback_stress(UART(divisor=divisor), divisor)
+            loopback_stress(UART(divisor=104, divisor_bits=16), divisor)
+
     if args.action == "generate":
         from amaranth.back import verilog
 
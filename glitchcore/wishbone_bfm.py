@@ -0,0 +1,105 @@
+class WishboneBFM:
+    '''Run Wishbone transfers on a slave from a simulation process.
+
+    `bus` is anything with GlitchCoreWb's wb_* signals. Classic transfers
+    hold stb until ack; a burst marks every transfer but the last as an
+    incrementing one (CTI 0b010) and the last with CTI 0b111. In pipelined
+    mode a request goes out every cycle stall is low, and the acks are
+    collected as they come back.
+
+    Every method is a generator to `yield from` and returns the words read,
+    one per read, in order. The number of cycles the last call took is left
+    in `cycles`.
+    '''
+    def __init__(self, bus, pipelined=False, timeout=100):
+        self.bus = bus
+        self.pipelined = pipelined
+        self.timeout = timeout
+        self.cycles = 0
+
+    def write(self, addr, data, sel=0xf):
+        yield from self.transfer([(addr, data, sel)])
+
+    def read(self, addr):
+        return (yield from self.transfer([(addr, None, 0xf)]))[0]
+
+    def read_block(self, addr, count, burst=True, bte=0):
+        return (yield from self.transfer([(a, None, 0xf) for a in self.addresses(addr, count, bte)], burst, bte))
+
+    def write_block(self, addr, words, burst=True, bte=0):
+        yield from self.transfer(list(zip(self.addresses(addr, len(words), bte), words, [0xf] * len(words))), burst, bte)
+
+    @staticmethod
+    def addresses(addr, count, bte=0):
+        '''Addresses of an incrementing burst, wrapping after 4, 8 or 16
+        words for BTE 0b01, 0b10 or 0b11.'''
+        if bte == 0:
+            return [addr + 4 * i for i in range(count)]
+        mask = 4 * (2 << bte) - 1
+        return [(addr & ~mask) | ((addr + 4 * i) & mask) for i in range(count)]
+
+    def transfer(self, requests, burst=False, bte=0):
+        '''Run (addr, data, sel) requests, with data None for a read.
+
+        burst: Run them as one classic incrementing burst. The addresses
+            have to follow on from each other. Ignored in pipelined mode,
+            where requests always go out back to back.
+        '''
+        if self.pipelined:
+            results = yield from self._pipelined(requests)
+        else:
+            results = yield from self._classic(requests, burst, bte)
+        yield self.bus.wb_stb_i.eq(0)
+        yield self.bus.wb_cyc_i.eq(0)
+        yield self.bus.wb_we_i.eq(0)
+        yield self.bus.wb_cti_i.eq(0)
+        return results
+
+    def _request(self, addr, data, sel):
+        yield self.bus.wb_adr_i.eq(addr)
+        yield self.bus.wb_we_i.eq(data is not None)
+        yield self.bus.wb_dat_i.eq(data or 0)
+        yield self.bus.wb_sel_i.eq(sel)
+        yield self.bus.wb_stb_i.eq(1)
+        yield self.bus.wb_cyc_i.eq(1)
+
+    def _classic(self, requests, burst, bte):
+        results = []
+        self.cycles = 0
+        yield self.bus.wb_bte_i.eq(bte)
+        for i, (addr, data, sel) in enumerate(requests):
+            if burst:
+                yield self.bus.wb_cti_i.eq(0b111 if i == len(requests) - 1 else 0b010)
+            yield from self._request(addr, data, sel)
+            for _ in range(self.timeout):
+                yield
+                self.cycles += 1
+                if (yield self.bus.wb_ack_o):
+                    break
+            else:
+                raise AssertionError("No ack for 0x{:02x}".format(addr))
+            if data is None:
+                results.append((yield self.bus.wb_dat_o))
+        return results
+
+    def _pipelined(self, requests):
+        results = []
+        self.cycles = 0
+        sent = acked = 0
+        while acked < len(requests):
+            if self.cycles > self.timeout + len(requests):
+                raise AssertionError("{} of {} requests acked".format(acked, len(requests)))
+            stb = sent < len(requests)
+            if stb:
+                yield from self._request(*requests[sent])
+            else:
+                yield self.bus.wb_stb_i.eq(0)
+            yield
+            self.cycles += 1
+            if stb and not (yield self.bus.wb_stall_o):
+                sent += 1
+            if (yield self.bus.wb_ack_o):
+                if requests[acked][1] is None:
+                    results.append((yield self.bus.wb_dat_o))
+                acked += 1
+        return results
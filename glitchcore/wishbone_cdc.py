@@ -0,0 +1,173 @@
+from amaranth import *
+from amaranth.lib.cdc import FFSynchronizer
+
+
+class WishboneCDC(Elaboratable):
+    '''Carry Wishbone transactions from one clock domain to another.
+
+    The bridge is a slave in `i_domain` and a master in `o_domain`. A
+    transaction is latched on the slave side and announced by toggling a
+    request bit, which crosses through a two-stage synchronizer; the master
+    side runs it and toggles an acknowledge bit back the same way. Address,
+    data and read data are held steady while their toggle crosses, so they
+    need no synchronizer of their own.
+
+    One transaction is in flight at a time, so the slave-side master must
+    hold stb until it sees ack, for writes as well as reads.
+    '''
+    def __init__(self, i_domain="sync", o_domain="core"):
+        self.i_domain = i_domain
+        self.o_domain = o_domain
+
+        # In, from master.
+        self.wb_adr_i = Signal(32)
+        self.wb_dat_i = Signal(32)
+        self.wb_we_i = Signal()
+        self.wb_sel_i = Signal(4)
+        self.wb_stb_i = Signal()
+        self.wb_cyc_i = Signal()
+
+        # Out, to master.
+        self.wb_dat_o = Signal(32)
+        self.wb_ack_o = Signal()
+
+        # Out, to slave.
+        self.wbm_adr_o = Signal(32)
+        self.wbm_dat_o = Signal(32)
+        self.wbm_we_o = Signal()
+        self.wbm_sel_o = Signal(4)
+        self.wbm_stb_o = Signal()
+        self.wbm_cyc_o = Signal()
+
+        # In, from slave.
+        self.wbm_dat_i = Signal(32)
+        self.wbm_ack_i = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        i_domain = m.d[self.i_domain]
+        o_domain = m.d[self.o_domain]
+
+        req = Signal()
+        req_sync = Signal()
+        req_seen = Signal()
+        ack = Signal()
+        ack_sync = Signal()
+        ack_seen = Signal()
+        pending = Signal()
+
+        adr = Signal.like(self.wb_adr_i)
+        dat = Signal.like(self.wb_dat_i)
+        we = Signal()
+        sel = Signal.like(self.wb_sel_i)
+        rdata = Signal.like(self.wbm_dat_i)
+
+        m.submodules += [
+            FFSynchronizer(req, req_sync, o_domain=self.o_domain),
+            FFSynchronizer(ack, ack_sync, o_domain=self.i_domain),
+        ]
+
+        # Slave side. The cycle ack is high, stb is still up from the
+        # transaction that just finished, so it doesn't start a new one.
+        i_domain += self.wb_ack_o.eq(0)
+        with m.If(ack_sync != ack_seen):
+            i_domain += [
+                ack_seen.eq(ack_sync),
+                pending.eq(0),
+                self.wb_dat_o.eq(rdata),
+                self.wb_ack_o.eq(1),
+            ]
+        with m.Elif(self.wb_stb_i & self.wb_cyc_i & ~pending & ~self.wb_ack_o):
+            i_domain += [
+                adr.eq(self.wb_adr_i),
+                dat.eq(self.wb_dat_i),
+                we.eq(self.wb_we_i),
+                sel.eq(self.wb_sel_i),
+                pending.eq(1),
+                req.eq(~req),
+            ]
+
+        # Master side.
+        m.d.comb += [
+            self.wbm_adr_o.eq(adr),
+            self.wbm_dat_o.eq(dat),
+            self.wbm_we_o.eq(we),
+            self.wbm_sel_o.eq(sel),
+            self.wbm_cyc_o.eq(self.wbm_stb_o),
+        ]
+        with m.If(~self.wbm_stb_o & (req_sync != req_seen)):
+            o_domain += [
+                req_seen.eq(req_sync),
+                self.wbm_stb_o.eq(1),
+            ]
+        with m.Elif(self.wbm_stb_o & self.wbm_ack_i):
+            o_domain += [
+                rdata.eq(self.wbm_dat_i),
+                self.wbm_stb_o.eq(0),
+                ack.eq(~ack),
+            ]
+
+        return m
+
+
+if __name__ == "__main__":
+    from amaranth.sim import Simulator, Passive
+
+    dut = WishboneCDC()
+    regs = {}
+
+    def slave():
+        # A register file answering one cycle after stb, like GlitchCoreWb.
+        yield Passive()
+        while True:
+            yield
+            if (yield dut.wbm_stb_o) and not (yield dut.wbm_ack_i):
+                addr = yield dut.wbm_adr_o
+                if (yield dut.wbm_we_o):
+                    regs[addr] = yield dut.wbm_dat_o
+                yield dut.wbm_dat_i.eq(regs.get(addr, 0))
+                yield dut.wbm_ack_i.eq(1)
+            else:
+                yield dut.wbm_ack_i.eq(0)
+
+    def transaction(addr, data=None):
+        yield dut.wb_adr_i.eq(addr)
+        yield dut.wb_we_i.eq(data is not None)
+        yield dut.wb_dat_i.eq(data or 0)
+        yield dut.wb_stb_i.eq(1)
+        yield dut.wb_cyc_i.eq(1)
+        yield
+        while not (yield dut.wb_ack_o):
+            yield
+        result = yield dut.wb_dat_o
+        yield dut.wb_stb_i.eq(0)
+        yield dut.wb_cyc_i.eq(0)
+        return result
+
+    def master():
+        for i in range(8):
+            yield from transaction(4 * i, 0x100 + i)
+        for i in reversed(range(8)):
+            assert (yield from transaction(4 * i)) == 0x100 + i
+        # Back to back, without a gap between transactions.
+        yield dut.wb_stb_i.eq(1)
+        yield dut.wb_cyc_i.eq(1)
+        yield dut.wb_we_i.eq(0)
+        seen = []
+        for i in range(8):
+            yield dut.wb_adr_i.eq(4 * i)
+            yield
+            while not (yield dut.wb_ack_o):
+                yield
+            seen.append((yield dut.wb_dat_o))
+        yield dut.wb_stb_i.eq(0)
+        assert seen == [0x100 + i for i in range(8)], seen
+
+    sim = Simulator(dut)
+    sim.add_clock(1/12e6) # 12 MHz
+    sim.add_clock(1/100.5e6, domain="core")
+    sim.add_sync_process(master)
+    sim.add_sync_process(slave, domain="core")
+    with sim.write_vcd("wishbone_cdc.vcd"):
+        sim.run()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+
+import struct
+
+from control import GlitcherInitError, GlitcherProtocol, NotEnoughDataException, UnexpectedDataException
+
+
+class AsyncGlitcher(GlitcherProtocol):
+    '''An asyncio client for the glitcher, with the same commands as Glitcher.
+
+    The glitcher is reached through an asyncio (reader, writer) stream pair,
+    so many glitchers and target consoles can share one event loop. Use
+    `open_serial()` for a local serial port (needs pyserial-asyncio) or
+    `open_connection()` for a serial port exported over TCP.
+
+    Transactions from concurrent tasks are serialized, since the protocol
+    has no way to tell responses apart.
+    '''
+    def __init__(self, reader, writer, baudrate=115200, timeout=0.1, debug=False, verbose=False, cache=True):
+        self.reader = reader
+        self.writer = writer
+        self.debug = debug
+        self.verbose = verbose or debug
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.lock = asyncio.Lock()
+        self.shadow = {} if cache else None
+
+    @classmethod
+    async def open_serial(cls, port, baudrate=115200, **kwargs):
+        '''Open and initialize a glitcher on a local serial port.'''
+        import serial_asyncio
+
+        reader, writer = await serial_asyncio.open_serial_connection(url=port, baudrate=baudrate)
+        glitcher = cls(reader, writer, baudrate=baudrate, **kwargs)
+        await glitcher.init()
+        return glitcher
+
+    @classmethod
+    async def open_connection(cls, host, port, **kwargs):
+        '''Open and initialize a glitcher reachable over TCP.'''
+        reader, writer = await asyncio.open_connection(host, port)
+        glitcher = cls(reader, writer, **kwargs)
+        await glitcher.init()
+        return glitcher
+
+    async def init(self):
+        '''Flush any partial command on the glitcher and check it responds.'''
+        async with self.lock:
+            self._send_bytes(b'\r' * 10)
+            await self.writer.drain()
+            try:
+                while True:
+                    await self._recv_bytes(1)
+            except NotEnoughDataException:
+                pass
+        await self.test()
+        self.rx_fifo = bool(await self.readw(self.framed_reg) & self.rx_fifo_built_in)
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+    def _send_bytes(self, data):
+        data = bytes(data)
+        if self.debug:
+            print("-> {}".format(data.hex()))
+        self.writer.write(data)
+
+    async def _recv_bytes(self, count, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        try:
+            data = await asyncio.wait_for(self.reader.readexactly(count), timeout)
+        except asyncio.IncompleteReadError as e:
+            data = e.partial
+        except asyncio.TimeoutError:
+            data = b''
+        if self.debug:
+            print("<- {}".format(data.hex()))
+        if len(data) != count:
+            raise NotEnoughDataException
+        return bytes(data)
+
+    async def test(self):
+        '''Send the TEST command and check the glitcher's ACK.'''
+        async with self.lock:
+            self._send_bytes([self.commands['TEST']])
+            await self.writer.drain()
+            expected_ack = self.ack
+            try:
+                ack = await self._recv_bytes(len(expected_ack))
+            except NotEnoughDataException:
+                ack = b''
+        if ack != expected_ack:
+            raise GlitcherInitError("Invalid glitcher ACK bytes: {} ({})".format(ack.hex(), repr(ack)))
+
+    async def transact(self, requests):
+        '''Run a list of (command, addr, word) requests, like
+        Glitcher.transact().'''
+        async with self.lock:
+            hw_requests, slots = self._shadow_filter(requests)
+            try:
+                results = await self._transact(hw_requests)
+            except:
+                self.invalidate()
+                raise
+            return self._shadow_merge(hw_requests, slots, results)
+
+    async def _transact(self, requests):
+        responses = []
+        for chunk in self._plan(requests):
+            request = b''.join(c[4] for c in chunk)
+            response_len = sum(c[5] for c in chunk)
+
+            self._send_bytes(request)
+            await self.writer.drain()
+
+            # Allow for the time it takes to shift every byte over the wire.
+            timeout = self.timeout + 10 * (len(request) + response_len) / self.baudrate
+            response = await self._recv_bytes(response_len, timeout=timeout) if response_len else b''
+
+            responses += self._parse(chunk, response)
+        return self._assemble(responses)
+
+    async def readw(self, addr):
+        '''Read a 32-bit word.
+
+        addr: The 32-bit starting address as an int.
+        '''
+        return (await self.transact([('READ', addr, None)]))[0]
+
+    async def read_block(self, addr, count):
+        '''Read consecutive 32-bit words with the block read command.
+
+        addr: The 32-bit starting address as an int.
+        count: The number of words to read.
+        '''
+        return (await self.transact([('BLOCK', addr, count)]))[0]
+
+    async def writew(self, addr, word):
+        '''Write a 32 bit word.
+
+        addr: A 32-bit address as an int.
+        word: The 32-bit word to write.
+        '''
+        await self.transact([('WRITE', addr, int(word))])
+
+    async def wait_for_fire(self, timeout=None):
+        '''Wait until the pulse has fired, like Glitcher.wait_for_fire().
+
+        Other tasks using this glitcher are held off while waiting.
+        '''
+        async with self.lock:
+            self._send_bytes([self.commands['NOTIFY']])
+            await self.writer.drain()
+            cancelled = False
+            try:
+                response = await asyncio.wait_for(self.reader.readexactly(len(self.fire_marker)), timeout)
+            except asyncio.TimeoutError:
+                # Cancel the notification with TEST. The event frame may
+                # still have been sent just before the cancel arrived, in
+                # which case it comes ahead of the ACK. Bytes that arrived
+                # before the timeout are left in the reader.
+                cancelled = True
+                self._send_bytes([self.commands['TEST']])
+                await self.writer.drain()
+                response = await self._recv_bytes(len(self.fire_marker))
+
+            counts = None
+            if response == self.fire_marker:
+                counts = struct.unpack('<III', await self._recv_bytes(12))
+                if cancelled:
+                    response = await self._recv_bytes(len(self.ack))
+            if cancelled and response != self.ack:
+                raise UnexpectedDataException("Invalid glitcher ACK bytes: {} ({})".format(response.hex(), repr(response)))
+            if not cancelled and counts is None:
+                raise UnexpectedDataException("Invalid event frame: {} ({})".format(response.hex(), repr(response)))
+
+        return counts
+
+    async def resync(self):
+        '''Reload the shadow cache from the hardware, like Glitcher.resync().'''
+        self.invalidate()
+        await self.read_block(0x00, 0x68 // 4 + 1)
+
+
+async def dump(port, baudrate):
+    glitcher = await AsyncGlitcher.open_serial(port, baudrate=baudrate)
+    regs = await glitcher.read_block(0x00, 15)
+    for i, word in enumerate(regs):
+        print("0x{:02x}: 0x{:08x}".format(4 * i, word))
+    await glitcher.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('port', type=str, help="The serial port you want to connect to.")
+    parser.add_argument('-b', '--baudrate', type=int, default=115200, help="The baud rate you want to connect at. Default: 115200")
+    args = parser.parse_args()
+
+    asyncio.run(dump(args.port, args.baudrate))
+
+
+if __name__ == "__main__":
+    main()
@@ -7,34 +7,525 @@ import time
 import serial
 
 
+def crc8(data, crc=0, poly=0x07):
+    '''CRC-8 as used by the framed protocol (MSB first, no final XOR).'''
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ (poly if crc & 0x80 else 0)) & 0xff
+    return crc
+
+
 class GlitcherInitError(Exception):
     pass
 
 class NotEnoughDataException(Exception):
     pass
 
-class Glitcher:
+class UnexpectedDataException(Exception):
+    pass
+
+class MissingFeatureError(Exception):
+    pass
+
+class GlitcherBatch:
+    '''A queue of reads and writes that are sent to the glitcher in bulk.
+
+    Use it as a context manager; the queued commands are run on exit and the
+    words returned by the reads are left in `results`, in the order the reads
+    were queued.
+    '''
+    def __init__(self, glitcher):
+        self.glitcher = glitcher
+        self.requests = []
+        self.results = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.run()
+
+    def readw(self, addr):
+        '''Queue a read of a 32-bit word.
+
+        addr: The 32-bit starting address as an int.
+        '''
+        self.requests.append(('READ', addr, None))
+
+    def writew(self, addr, word):
+        '''Queue a write of a 32-bit word.
+
+        addr: A 32-bit address as an int.
+        word: The 32-bit word to write.
+        '''
+        self.requests.append(('WRITE', addr, int(word)))
+
+    def read_block(self, addr, count):
+        '''Queue a read of `count` consecutive 32-bit words.
+
+        The words are returned as a single list in `results`.
+
+        addr: The 32-bit starting address as an int.
+        count: The number of words to read.
+        '''
+        self.requests.append(('BLOCK', addr, count))
+
+    def drain(self, count):
+        '''Queue a drain of `count` entries from the result FIFO.
+
+        The entries are returned as a single list of words in `results`,
+        five per entry.
+        '''
+        self.requests.append(('DRAIN', 0x80, count))
+
+    def run(self):
+        '''Send all queued commands and return the list of words read.'''
+        self.results = self.glitcher.transact(self.requests)
+        self.requests = []
+        return self.results
+
+class GlitcherProtocol:
+    '''Encoding and decoding of the glitcher's UART command protocol.
+
+    This holds everything about the byte protocol that does not depend on how
+    the bytes are moved, so it is shared by the blocking and asyncio clients.
+    '''
     commands = {
         'TEST': ord(b'\r'),
         'READ': ord(b'R'),
         'WRITE': ord(b'W'),
+        'BLOCK': ord(b'B'),
+        'NOTIFY': ord(b'N'),
+        'DRAIN': ord(b'D'),
+    }
+
+    ack = b'OK\r\n'
+
+    # Start of the event frame sent after a NOTIFY command once the pulse has
+    # fired. It is followed by the event, delay and pulse counts.
+    fire_marker = b'FIRE'
+
+    # The block read command takes an 8-bit word count.
+    max_block_words = 255
+
+    # The drain command takes a 16-bit entry count. In framed mode the
+    # response has to fit in 255 words.
+    max_drain_entries = 0xffff
+    max_framed_drain_entries = 255 // 5
+
+    # Result FIFO: level, control, and the five-word window onto the oldest
+    # entry (attempt index, delay, pulse width, event count, timestamp).
+    result_level_reg = 0x70
+    result_ctrl_reg = 0x74
+    result_words = 5
+
+    # Pulse sequence table: its length, then a data port onto its entries.
+    # 0x9c selects an entry and 0xa0 holds its delay; writing the width to
+    # 0xa4 stores the entry and selects the next one.
+    sequence_length_reg = 0x98
+    sequence_index_reg = 0x9c
+    sequence_delay_reg = 0xa0
+    sequence_width_reg = 0xa4
+    sequence_depth = 64
+
+    # Byte pattern trigger, selected with 0x00 bit 6: the divisor of the
+    # UART it receives event_in with, the last byte received, then the
+    # pattern and its mask, newest byte first, two words each.
+    pattern_sel_bit = 1 << 6
+    pattern_divisor_reg = 0xa8
+    pattern_last_byte_reg = 0xac
+    pattern_reg = 0xb0
+    pattern_mask_reg = 0xb8
+    pattern_depth = 8
+
+    # 64-bit timestamps from 0xc0 on, low word first: the live cycle counter,
+    # then the cycle at which each pipeline edge was first seen since the
+    # pulse was last armed, except event_in, which is the last event edge
+    # before the trigger. Only built with `generate --timestamps`.
+    timestamp_reg = 0xc0
+    timestamp_names = ('now', 'event_in', 'event_trigger', 'delay_trigger', 'glitch_rise', 'glitch_fall')
+
+    # Size of the receive FIFO in GlitchCoreUart. Batches are split so that
+    # no more than this many command bytes are ever waiting in it.
+    max_batch_bytes = 512
+    # Whether the gateware has that FIFO, read from bit 3 of framed_reg once
+    # connected. Without it, bytes that arrive while a response is being
+    # sent are lost, so each response is waited for before sending more.
+    rx_fifo = False
+
+    # Registers, and bits of registers, that only change when the host writes
+    # them. Their last known value is kept in a shadow cache so that writes
+    # of an unchanged value can be skipped.
+    shadow_masks = {
+        0x00: 0x0000007f,
+        0x08: 0x00000001,
+        0x10: 0x00000001,
+        0x14: 0xffffffff,
+        0x20: 0x00000001,
+        0x24: 0xffffffff,
+        0x30: 0x00000001,
+        0x34: 0xffffffff,
+        0x40: 0x00000001,
+        0x44: 0xffffffff,
+        0x4c: 0xffffffff,
+        0x50: 0xffffffff,
+        0x54: 0xffffffff,
+        0x58: 0xffffffff,
+        0x60: 0xffffffff,
+        0x64: 0xffffffff,
+        0x68: 0xffffffff,
+        0x98: 0x0000007f,
+        0xa0: 0xffffffff,
+        0xa8: 0x0000ffff,
+        0xb0: 0xffffffff,
+        0xb4: 0xffffffff,
+        0xb8: 0xffffffff,
+        0xbc: 0xffffffff,
     }
 
-    def __init__(self, port, baudrate=115200, timeout=0.1, write_timeout=1, debug=False, verbose=False):
+    # Shadowed registers without any status bits. Reads of these are served
+    # from the cache as well; everything else always goes to the hardware.
+    config_regs = (0x00, 0x08, 0x14, 0x24, 0x34, 0x44, 0x4c, 0x50, 0x54, 0x58, 0x60, 0x64, 0x68, 0x98, 0xa0, 0xa8, 0xb0, 0xb4, 0xb8, 0xbc)
+
+    # Frequency in Hz of the clock GlitchCore counts delays, pulse widths
+    # and timestamps in. Bitstreams from before this register read 0 here
+    # and run the core on the 12 MHz board clock.
+    core_clk_freq_reg = 0x04
+    default_core_clk_freq = 12000000
+
+    # Optional parts of the gateware, one bit each of 0x78 in this order.
+    # Bitstreams from before this register read 0 and have none of them.
+    features_reg = 0x78
+    feature_names = ('pattern_trigger', 'timestamps', 'sequence', 'staging', 'sweep', 'result_fifo')
+
+    # With staging on, writes to the mux selects (0x00), the arm bits, the
+    # thresholds and the pattern trigger's registers only take effect when
+    # the commit register is written, all on the same cycle. Committing 1
+    # also re-arms every stage. Gateware built without staging ignores the
+    # staging register, but still re-arms on a commit.
+    staging_reg = 0x08
+    commit_reg = 0x0c
+    staged_regs = (0x00, 0x10, 0x14, 0x20, 0x24, 0x30, 0x34, 0xa8, 0xb0, 0xb4, 0xb8, 0xbc)
+
+    # Accesses that do more than store or return a value: writing the
+    # commit, clearing the result FIFO, storing a sequence entry (which
+    # moves on to the next one) and reading the last word of the result
+    # window (which pops it). Running one of these twice is not the same as
+    # running it once, so framed mode never resends them on its own.
+    side_effect_writes = (0x0c, 0x74, 0xa4)
+    side_effect_reads = (0x90,)
+
+    # GlitchCoreUart's own registers: the UART baud rate divisor and the
+    # clock frequency it divides. The divisor can only be changed if bit 2
+    # of 0xf8 reads 1.
+    divisor_reg = 0xf0
+    clk_freq_reg = 0xf4
+
+    # A new baud rate has to be confirmed with TEST within this many seconds,
+    # otherwise the glitcher goes back to the previous one.
+    baudrate_switch_timeout = 0.25
+
+    # Framed mode wraps every request as SOF, seq, len, payload, CRC-8 and
+    # every response as SOF, seq, command, word count, data, CRC-8. Responses
+    # are matched to requests by sequence number, and a request whose
+    # response is lost, corrupted or refused (NAK) is sent again. Bit 1 of
+    # the register reads 1 if the gateware was built with framed mode.
+    framed_reg = 0xf8
+    framing_built_in = 1 << 1
+    baud_switching_built_in = 1 << 2
+    rx_fifo_built_in = 1 << 3
+    frame_sof = 0x7e
+    frame_nak = 0x15
+    frame_retries = 3
+
+    verbose = False
+    shadow = None
+    framed = False
+    seq = 0
+
+    def invalidate(self, addr=None):
+        '''Forget the cached value of one register, or of all of them.'''
+        if self.shadow is None:
+            return
+        if addr is None:
+            self.shadow.clear()
+        else:
+            self.shadow.pop(addr, None)
+
+    def _shadow_update(self, addr, word):
+        if addr in self.shadow_masks:
+            self.shadow[addr] = word & self.shadow_masks[addr]
+
+    def _shadow_filter(self, requests):
+        '''Drop the requests the shadow cache can answer.
+
+        Returns the requests that still have to go to the hardware and a list
+        with one entry per read: the cached word, or None if it is read from
+        the hardware.
+        '''
+        if self.shadow is None:
+            return requests, None
+
+        hw_requests = []
+        slots = []
+        self._shadow_written = set()
+        for command, addr, word in requests:
+            if command == 'WRITE' and addr in self.shadow_masks:
+                if self.shadow.get(addr) == word & self.shadow_masks[addr]:
+                    if self.verbose:
+                        print("0x{:08x} <= 0x{:08x} (cached)".format(addr, word))
+                    continue
+                self._shadow_update(addr, word)
+                self._shadow_written.add(addr)
+            elif command == 'READ' and addr in self.config_regs and addr in self.shadow:
+                if self.verbose:
+                    print("0x{:08x} => 0x{:08x} (cached)".format(addr, self.shadow[addr]))
+                slots.append(self.shadow[addr])
+                continue
+            if command != 'WRITE':
+                slots.append(None)
+            hw_requests.append((command, addr, word))
+        return hw_requests, slots
+
+    def _shadow_merge(self, hw_requests, slots, hw_results):
+        '''Combine hardware results with cached words and refresh the cache
+        from what the hardware returned.'''
+        if slots is None:
+            return hw_results
+
+        # Registers written in this batch already hold their newest value in
+        # the cache; a read queued before the write would only undo that.
+        hw_reads = [r for r in hw_requests if r[0] != 'WRITE']
+        for (command, addr, _), result in zip(hw_reads, hw_results):
+            if command not in ('READ', 'BLOCK'):
+                continue
+            words = [result] if command == 'READ' else result
+            for i, word in enumerate(words):
+                if addr + 4 * i not in self._shadow_written:
+                    self._shadow_update(addr + 4 * i, word)
+
+        hw_results = iter(hw_results)
+        return [next(hw_results) if slot is None else slot for slot in slots]
+
+    @classmethod
+    def _encode(cls, command, addr, word=None):
+        '''Return the request bytes for a command and its response length.'''
+        if command == 'READ':
+            return bytes([cls.commands['READ'], addr & 0xff]), 4
+        if command == 'WRITE':
+            return bytes([cls.commands['WRITE'], addr & 0xff]) + struct.pack('<I', word), 0
+        if command == 'BLOCK':
+            return bytes([cls.commands['BLOCK'], addr & 0xff, word]), 4 * word
+        if command == 'DRAIN':
+            return bytes([cls.commands['DRAIN']]) + struct.pack('<H', word), 4 * cls.result_words * word
+        if command == 'TEST':
+            return bytes([cls.commands['TEST']]), len(cls.ack)
+        raise ValueError("Unknown command: {}".format(command))
+
+    def _plan(self, requests):
+        '''Split a list of (command, addr, word) requests into chunks that
+        can each be sent with one write.'''
+        # Long block reads and drains are split into several commands and
+        # joined again once the responses are in.
+        split = []
+        for command, addr, word in requests:
+            if command == 'BLOCK':
+                for offset in range(0, max(word, 1), self.max_block_words):
+                    count = min(word - offset, self.max_block_words)
+                    split.append((command, addr + 4 * offset, count, offset == 0))
+            elif command == 'DRAIN':
+                limit = self.max_framed_drain_entries if self.framed else self.max_drain_entries
+                for offset in range(0, max(word, 1), limit):
+                    split.append((command, addr, min(word - offset, limit), offset == 0))
+            else:
+                split.append((command, addr, word, None))
+
+        chunks = []
+        chunk = []
+        chunk_len = 0
+        for command, addr, word, first in split:
+            request, response_len = self._encode(command, addr, word)
+            request_len = len(request) + (4 if self.framed else 0)
+            if chunk and chunk_len + request_len > self.max_batch_bytes:
+                chunks.append(chunk)
+                chunk = []
+                chunk_len = 0
+            chunk.append((command, addr, word, first, request, response_len))
+            chunk_len += request_len
+            if not self.rx_fifo and (response_len or self.framed):
+                chunks.append(chunk)
+                chunk = []
+                chunk_len = 0
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def _parse(self, chunk, response):
+        '''Split the response to a chunk into the words read by each of its
+        commands.'''
+        responses = []
+        offset = 0
+        for command, addr, word, first, _, length in chunk:
+            if command == 'WRITE':
+                if self.verbose:
+                    print("0x{:08x} <= 0x{:08x}".format(addr, word))
+                continue
+            words = struct.unpack_from('<{}I'.format(length // 4), response, offset)
+            offset += length
+            if self.verbose:
+                for i, word in enumerate(words):
+                    print("0x{:08x} => 0x{:08x}".format(addr + 4 * i, word))
+            responses.append((command, first, words))
+        return responses
+
+    def _next_seq(self):
+        seq = self.seq
+        self.seq = (seq + 1) & 0xff
+        return seq
+
+    def _frame(self, seq, request):
+        '''Wrap the request bytes of one command in a request frame.'''
+        frame = bytes([self.frame_sof, seq, len(request)]) + request
+        return frame + bytes([crc8(frame)])
+
+    def _unframe(self, frame):
+        '''Check a whole response frame.
+
+        Returns (seq, command, data), or None if the CRC doesn't match.
+        '''
+        if crc8(frame[:-1]) != frame[-1]:
+            return None
+        return frame[1], frame[2], frame[4:-1]
+
+    @staticmethod
+    def _assemble(responses):
+        '''Join parsed responses back into one result per request.'''
+        results = []
+        for command, first, words in responses:
+            if command == 'READ':
+                results.append(words[0])
+            elif first:
+                results.append(list(words))
+            else:
+                results[-1] += words
+        return results
+
+class Glitcher(GlitcherProtocol):
+    def __init__(self, port, baudrate=115200, timeout=0.1, write_timeout=1, debug=False, verbose=False, cache=True, framed=False):
         self.debug = debug
         self.verbose = verbose or debug
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.shadow = {} if cache else None
+        self._core_clk_freq = None
+        self._features = None
         self.ser = serial.Serial(port, baudrate, timeout=timeout, write_timeout=write_timeout)
+        # Leave framed mode in case the last session didn't. Unframed, this
+        # is just a write of 0 to the same register, and whatever command
+        # the CRC byte happens to start is finished off by the TEST flush.
+        self._send_bytes(self._frame(0, self._encode('WRITE', self.framed_reg, 0)[0]))
         self._send_bytes(b'\r' * 10)
         try:
             self._recv_bytes(1000)
         except:
             pass
-        self._send_bytes([self.commands['TEST']])
-        expected_ack = b'OK\r\n'
-        ack = self._recv_bytes(len(expected_ack))
+        self.test()
+        self.rx_fifo = bool(self.readw(self.framed_reg) & self.rx_fifo_built_in)
+        if framed:
+            self.set_framed(True)
+
+    def test(self):
+        '''Send the TEST command and check the glitcher's ACK.'''
+        expected_ack = self.ack
+        if self.framed:
+            request, response_len = self._encode('TEST', 0)
+            try:
+                ack = self._transact_framed([('TEST', 0, None, None, request, response_len)])[0]
+            except (NotEnoughDataException, UnexpectedDataException):
+                ack = b''
+        else:
+            self._send_bytes([self.commands['TEST']])
+            ack = self._read(len(expected_ack), self.timeout)
         if ack != expected_ack:
             raise GlitcherInitError("Invalid glitcher ACK bytes: {} ({})".format(ack.hex(), repr(ack)))
 
+    def core_clock(self):
+        '''Return the frequency GlitchCore's counters run at, in Hz.'''
+        if self._core_clk_freq is None:
+            self._core_clk_freq = self.readw(self.core_clk_freq_reg) or self.default_core_clk_freq
+        return self._core_clk_freq
+
+    def features(self):
+        '''Return the names in `feature_names` the gateware was built with.'''
+        if self._features is None:
+            word = self.readw(self.features_reg)
+            self._features = {name for i, name in enumerate(self.feature_names) if word >> i & 1}
+        return self._features
+
+    def require(self, feature):
+        '''Raise MissingFeatureError unless the gateware has `feature`.'''
+        if feature not in self.features():
+            raise MissingFeatureError("The glitcher was built without {} (generate --{})".format(
+                    feature, feature.replace('_', '-')))
+
+    def ticks(self, seconds):
+        '''Convert a time in seconds to a whole number of core clock ticks.'''
+        return round(seconds * self.core_clock())
+
+    def set_baudrate(self, baudrate):
+        '''Switch the glitcher and this connection to another baud rate.
+
+        The rate is rounded to the nearest one the glitcher's clock can be
+        divided down to. If the glitcher can't be reached at the new rate it
+        goes back to the old one by itself, and so does this Glitcher before
+        raising GlitcherInitError. Raises MissingFeatureError if the
+        gateware was built without baud switching.
+
+        Returns the actual baud rate.
+        '''
+        if not self.readw(self.framed_reg) & self.baud_switching_built_in:
+            raise MissingFeatureError("The glitcher was built without baud switching (generate --baud-switching)")
+        clk_freq = self.readw(self.clk_freq_reg)
+        divisor = round(clk_freq / baudrate)
+        if divisor < 4:
+            raise ValueError("Baud rate {} is too high for a {} Hz clock".format(baudrate, clk_freq))
+        actual = clk_freq / divisor
+
+        old_baudrate = self.baudrate
+        self.writew(self.divisor_reg, divisor)
+        self.ser.flush()
+        # Let the last byte leave the host's UART before changing its rate.
+        time.sleep(20 / old_baudrate)
+        # The host's UART is set to the requested rate; the glitcher's is
+        # within half a divisor step of it.
+        self.ser.baudrate = self.baudrate = round(baudrate)
+        self.ser.reset_input_buffer()
+        try:
+            self.test()
+        except GlitcherInitError:
+            time.sleep(self.baudrate_switch_timeout)
+            self.ser.baudrate = self.baudrate = old_baudrate
+            self.ser.reset_input_buffer()
+            self.test()
+            raise GlitcherInitError("Glitcher not reachable at {:.0f} baud".format(actual))
+        return actual
+
+    def set_framed(self, enable=True):
+        '''Switch framed mode on or off on both ends.
+
+        Returns whether framed mode is on. Gateware built without it stays
+        in plain mode, and so does this Glitcher.
+        '''
+        if enable and not self.framed and not self.readw(self.framed_reg) & self.framing_built_in:
+            if self.verbose:
+                print("Framed mode is not built in, staying in plain mode")
+            return False
+        self.writew(self.framed_reg, int(enable))
+        self.framed = enable
+        return enable
+
     def close(self):
         self.ser.close()
 
@@ -44,13 +535,23 @@ class Glitcher:
             print("-> {}".format(data.hex()))
         self.ser.write(data)
 
-    def _recv_bytes(self, count):
-        data = self.ser.read(count)
+    def _read(self, count, timeout):
+        '''Read up to `count` bytes, waiting at most `timeout` seconds (or
+        forever if it is None).'''
+        self.ser.timeout = timeout
+        try:
+            data = self.ser.read(count)
+        finally:
+            self.ser.timeout = self.timeout
         if self.debug:
             print("<- {}".format(data.hex()))
+        return bytes(data)
+
+    def _recv_bytes(self, count, timeout=None):
+        data = self._read(count, self.timeout if timeout is None else timeout)
         if len(data) != count:
             raise NotEnoughDataException
-        return bytes(data)
+        return data
 
     def get_dword(self):
         '''Read a little-endian 32-bit integer from the serial port.'''
@@ -60,21 +561,171 @@ class Glitcher:
         '''Write a little-endian 32-bit integer to the serial port.'''
         self._send_bytes(struct.pack('<I', dword))
 
+    def batch(self):
+        '''Return a new, empty GlitcherBatch for this glitcher.'''
+        return GlitcherBatch(self)
+
+    def transact(self, requests):
+        '''Run a list of (command, addr, word) requests with as few serial
+        round trips as possible.
+
+        Requests are sent back to back and all the responses are collected
+        with one read, so the cost of a batch is dominated by the byte count
+        instead of the per-transfer latency of the serial port. Returns the
+        words read, in request order.
+
+        With the shadow cache enabled, writes that would not change a
+        host-owned register are skipped and reads of configuration registers
+        are answered from the cache.
+        '''
+        hw_requests, slots = self._shadow_filter(requests)
+        try:
+            results = self._transact(hw_requests)
+        except:
+            self.invalidate()
+            raise
+        return self._shadow_merge(hw_requests, slots, results)
+
+    def _transact(self, requests):
+        responses = []
+        for chunk in self._plan(requests):
+            if self.framed:
+                response = b''.join(self._transact_framed(chunk))
+                responses += self._parse(chunk, response)
+                continue
+
+            request = b''.join(c[4] for c in chunk)
+            response_len = sum(c[5] for c in chunk)
+
+            self._send_bytes(request)
+
+            # Allow for the time it takes to shift every byte over the wire.
+            timeout = self.timeout + 10 * (len(request) + response_len) / self.baudrate
+            response = self._recv_bytes(response_len, timeout=timeout) if response_len else b''
+
+            responses += self._parse(chunk, response)
+        return self._assemble(responses)
+
+    def _recv_frame(self, deadline):
+        '''Read the next response frame, skipping anything before its SOF.
+
+        deadline: time.monotonic() value to give up at, or None to wait
+            forever.
+
+        Returns (seq, command, data), False for a frame that failed its CRC,
+        or None if no whole frame arrived in time.
+        '''
+        def remaining():
+            return None if deadline is None else max(deadline - time.monotonic(), 0)
+
+        while True:
+            sof = self._read(1, remaining())
+            if not sof:
+                return None
+            if sof[0] == self.frame_sof:
+                break
+        header = self._read(3, remaining())
+        if len(header) != 3:
+            return None
+        body = self._read(4 * header[2] + 1, remaining())
+        if len(body) != 4 * header[2] + 1:
+            return None
+        return self._unframe(sof + header + body) or False
+
+    def _side_effects(self, entry):
+        '''Whether running a planned command twice differs from running it
+        once.'''
+        command, addr, word = entry[:3]
+        if command == 'DRAIN':
+            return True
+        if command == 'WRITE':
+            return addr in self.side_effect_writes
+        if command == 'READ':
+            return addr in self.side_effect_reads
+        if command == 'BLOCK':
+            return any(addr <= a < addr + 4 * word for a in self.side_effect_reads)
+        return False
+
+    def _transact_framed(self, chunk):
+        '''Send each request in a chunk as a frame and return the response
+        data of each, in order.
+
+        All frames are sent back to back. If a response goes missing, fails
+        its CRC or is a NAK, that request and all the ones after it are sent
+        again with new sequence numbers, so writes still reach the glitcher
+        in order. Responses left over from an earlier try are ignored.
+
+        Only a NAK says for sure that a frame wasn't run. Frames that may
+        have run already are only resent if running them again is harmless;
+        otherwise UnexpectedDataException is raised instead.
+        '''
+        responses = []
+        retries = 0
+        while len(responses) < len(chunk):
+            pending = chunk[len(responses):]
+            seqs = [self._next_seq() for _ in pending]
+            request = b''.join(self._frame(seq, c[4]) for seq, c in zip(seqs, pending))
+            response_len = sum(5 + c[5] for c in pending)
+            self._send_bytes(request)
+
+            timeout = self.timeout + 10 * (len(request) + response_len) / self.baudrate
+            deadline = time.monotonic() + timeout
+            done = 0
+            failed = False
+            refused = set()
+            while True:
+                frame = self._recv_frame(deadline)
+                if frame is None:
+                    break
+                if frame is False:
+                    failed = True
+                    continue
+                seq, command, data = frame
+                if seq not in seqs:
+                    continue
+                i = seqs.index(seq)
+                if not failed and i == done and command == pending[i][4][0] and len(data) == pending[i][5]:
+                    responses.append(data)
+                    done += 1
+                else:
+                    failed = True
+                    if command == self.frame_nak:
+                        refused.add(i)
+                # Once the last frame is answered the glitcher has nothing
+                # left queued, so it's safe to send the retries.
+                if i == len(pending) - 1:
+                    break
+
+            if done == len(pending):
+                break
+            unsafe = [i for i in range(done, len(pending))
+                if i not in refused and self._side_effects(pending[i])]
+            if unsafe:
+                raise UnexpectedDataException("Frame {} may have run already and is not safe to resend ({} 0x{:02x})".format(
+                    seqs[unsafe[0]], pending[unsafe[0]][0], pending[unsafe[0]][1]))
+            retries = 0 if done else retries + 1
+            if retries > self.frame_retries:
+                raise UnexpectedDataException("No valid response to frame {} after {} tries".format(seqs[done], retries))
+            if self.verbose:
+                print("Resending {} of {} frames".format(len(pending) - done, len(chunk)))
+        return responses
+
     def readw(self, addr):
         '''Read a 32-bit word.
 
         addr: The 32-bit starting address as an int.
         '''
-        self._send_bytes([self.commands['READ']])
-        #self.put_dword(addr)
-        self._send_bytes([addr & 0xff])
+        return self.transact([('READ', addr, None)])[0]
 
-        word = self.get_dword()
+    def read_block(self, addr, count):
+        '''Read consecutive 32-bit words with the block read command.
 
-        if self.verbose:
-            print("0x{:08x} => 0x{:08x}".format(addr, word))
+        Returns a list of `count` words.
 
-        return word
+        addr: The 32-bit starting address as an int.
+        count: The number of words to read.
+        '''
+        return self.transact([('BLOCK', addr, count)])[0]
 
     def writew(self, addr, word):
         '''Write a 32 bit word.
@@ -82,64 +733,309 @@ class Glitcher:
         addr: A 32-bit address as an int.
         word: The 32-bit word to write.
         '''
-        if self.verbose:
-            print("0x{:08x} <= 0x{:08x}".format(addr, word))
+        self.transact([('WRITE', addr, int(word))])
+
+    def wait_for_fire(self, timeout=None):
+        '''Wait until the pulse has fired.
+
+        The glitcher pushes an event frame as soon as the pulse fires, so this
+        returns within a few byte times of the fire instead of at the next
+        poll. If the pulse has already fired it returns right away.
+
+        timeout: Seconds to wait, or None to wait forever.
+
+        Returns the (event_count, delay_count, pulse_count) sent with the
+        event frame, or None on timeout.
+        '''
+        if self.framed:
+            counts = self._wait_for_fire_framed(timeout)
+            if self.verbose and counts is not None:
+                print("fired: event_count: 0x{:08x}, delay_count: 0x{:08x}, pulse_count: 0x{:08x}".format(*counts))
+            return counts
+
+        self._send_bytes([self.commands['NOTIFY']])
+        response = self._read(len(self.fire_marker), timeout)
+        cancelled = len(response) < len(self.fire_marker)
+        if cancelled:
+            # Cancel the notification with TEST. The event frame may still
+            # have been sent just before the cancel arrived, in which case it
+            # comes ahead of the ACK.
+            self._send_bytes([self.commands['TEST']])
+            response += self._recv_bytes(len(self.fire_marker) - len(response))
+
+        counts = None
+        if response == self.fire_marker:
+            counts = struct.unpack('<III', self._recv_bytes(12))
+            if cancelled:
+                response = self._recv_bytes(len(self.ack))
+        if cancelled and response != self.ack:
+            raise UnexpectedDataException("Invalid glitcher ACK bytes: {} ({})".format(response.hex(), repr(response)))
+        if not cancelled and counts is None:
+            raise UnexpectedDataException("Invalid event frame: {} ({})".format(response.hex(), repr(response)))
+
+        if self.verbose and counts is not None:
+            print("fired: event_count: 0x{:08x}, delay_count: 0x{:08x}, pulse_count: 0x{:08x}".format(*counts))
+
+        return counts
+
+    def _wait_for_fire_framed(self, timeout):
+        notify = bytes([self.commands['NOTIFY']])
+        seq = self._next_seq()
+        self._send_bytes(self._frame(seq, notify))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            frame = self._recv_frame(deadline)
+            if frame is None:
+                break
+            if frame and frame[0] == seq:
+                if frame[1] == self.frame_nak:
+                    seq = self._next_seq()
+                    self._send_bytes(self._frame(seq, notify))
+                elif frame[2][:len(self.fire_marker)] == self.fire_marker:
+                    return struct.unpack('<III', frame[2][len(self.fire_marker):])
+
+        # Cancel the notification with TEST. The event frame may still have
+        # been sent just before the cancel arrived, in which case it comes
+        # ahead of the TEST response.
+        counts = None
+        test = bytes([self.commands['TEST']])
+        for _ in range(self.frame_retries + 1):
+            test_seq = self._next_seq()
+            self._send_bytes(self._frame(test_seq, test))
+            deadline = time.monotonic() + self.timeout + 10 * 32 / self.baudrate
+            while True:
+                frame = self._recv_frame(deadline)
+                if frame is None:
+                    break
+                if not frame:
+                    continue
+                if frame[0] == seq and frame[2][:len(self.fire_marker)] == self.fire_marker:
+                    counts = struct.unpack('<III', frame[2][len(self.fire_marker):])
+                elif frame[0] == test_seq and frame[2] == self.ack:
+                    return counts
+        raise UnexpectedDataException("No response to TEST after {} tries".format(self.frame_retries + 1))
+
+    def drain_results(self, count=None):
+        '''Read entries from the result FIFO, oldest first.
+
+        count: The number of entries to read, or None for all of them.
+
+        Returns a list of (attempt, delay, width, event_count, timestamp)
+        tuples. Gaps in the attempt numbers are fires that were dropped
+        because the FIFO was full. Words the bitstream was built without
+        (see GlitchCoreWb's result_fields) are 0. Raises MissingFeatureError
+        if the gateware was built without the result FIFO.
+        '''
+        self.require('result_fifo')
+        if count is None:
+            count = self.readw(self.result_level_reg)
+        if not count:
+            return []
+        words = self.transact([('DRAIN', 0x80, count)])[0]
+        n = self.result_words
+        return [tuple(words[i:i + n]) for i in range(0, len(words), n)]
+
+    def clear_results(self):
+        '''Empty the result FIFO and restart the attempt numbering.'''
+        self.require('result_fifo')
+        self.writew(self.result_ctrl_reg, 1)
+
+    def read_timestamps(self):
+        '''Read the cycle counter and the pipeline edge timestamps.
+
+        Returns a dict keyed by the names in `timestamp_names`. A latch that
+        hasn't seen its edge since the pulse was armed still holds its value
+        from an earlier attempt. Gateware built without timestamps reads 0
+        for the counter and every latch.
+        '''
+        words = self.read_block(self.timestamp_reg, 2 * len(self.timestamp_names))
+        return {name: words[2 * i] | words[2 * i + 1] << 32 for i, name in enumerate(self.timestamp_names)}
+
+    def start_sweep(self, events, delays, widths, attempts=0, holdoff=0):
+        '''Start a sweep that runs on the glitcher without the host.
+
+        After each attempt the glitcher waits `holdoff` ticks, re-arms every
+        stage and steps the pulse width, wrapping it and stepping the delay
+        once it runs past the end of `widths`, and so on.
+
+        delays, widths: A range, or an int for a fixed value.
+        attempts: The number of attempts, or 0 to run until stop_sweep().
+
+        Raises MissingFeatureError if the gateware was built without the
+        sweep sequencer.
+        '''
+        self.require('sweep')
+        def bounds(values):
+            if isinstance(values, int):
+                return (values, values, 0)
+            return (values[0], values[-1], values.step)
+
+        with self.batch() as batch:
+            batch.writew(0x40, 0)
+            batch.writew(0x10, 0)
+            batch.writew(0x20, 0)
+            batch.writew(0x30, 0)
+            batch.writew(0x14, events)
+            # Apply the disarm and threshold above even with staging on.
+            batch.writew(self.commit_reg, 0)
+            batch.writew(0x44, attempts)
+            batch.writew(0x4c, holdoff)
+            for addr, word in zip((0x50, 0x54, 0x58), bounds(delays)):
+                batch.writew(addr, word)
+            for addr, word in zip((0x60, 0x64, 0x68), bounds(widths)):
+                batch.writew(addr, word)
+            batch.writew(0x40, 1)
+
+    def configure(self, writes, rearm=True):
+        '''Apply register writes to the glitcher all at once.
+
+        writes: (addr, word) pairs for the registers in `staged_regs`.
+        rearm: Also disarm every stage for one cycle, so that the new
+            settings start a fresh attempt.
+
+        The writes are staged and committed in one batch, so the glitcher
+        never runs with only some of them applied. Writes of an unchanged
+        value are left out as usual, so repeating an attempt with the same
+        settings costs a single commit. On gateware built without staging
+        the writes apply one by one as they arrive; the batch still keeps
+        the gap between them short.
+        '''
+        with self.batch() as batch:
+            batch.writew(self.staging_reg, 1)
+            for addr, word in writes:
+                if addr not in self.staged_regs:
+                    raise ValueError("Register 0x{:02x} is not staged".format(addr))
+                batch.writew(addr, word)
+            batch.writew(self.commit_reg, 1 if rearm else 0)
+
+    def load_sequence(self, entries):
+        '''Load pulses to fire one after another from a single trigger.
+
+        entries: Up to `sequence_depth` (delay, width) pairs. The first pulse
+        follows the trigger after its delay as usual; each later one follows
+        the end of the pulse before it after its delay plus two ticks. An
+        empty list goes back to firing a single pulse.
+
+        The table is sent as one batch. While it loads the sequence is
+        turned off, so a trigger never plays half of it. Raises
+        MissingFeatureError for a non-empty table if the gateware was built
+        without one.
+        '''
+        if entries:
+            self.require('sequence')
+        if len(entries) > self.sequence_depth:
+            raise ValueError("At most {} sequence entries, got {}".format(self.sequence_depth, len(entries)))
+        with self.batch() as batch:
+            batch.writew(self.sequence_length_reg, 0)
+            if entries:
+                batch.writew(self.sequence_index_reg, 0)
+            for delay, width in entries:
+                batch.writew(self.sequence_delay_reg, delay)
+                batch.writew(self.sequence_width_reg, width)
+            batch.writew(self.sequence_length_reg, len(entries))
+
+    def set_pattern(self, pattern, mask=None, baudrate=115200):
+        '''Set the bytes the pattern trigger fires on.
+
+        pattern: Up to `pattern_depth` bytes, in the order they are sent.
+        mask: The bits of each byte to compare, as bytes of the same length.
+            By default every bit is compared.
+        baudrate: The baud rate of the line on event_in.
+
+        The trigger still has to be selected with `pattern_sel_bit` in
+        0x00. Set the baud rate while the line is idle. The new pattern is
+        committed all at once, along with anything else staged, without
+        re-arming. Raises MissingFeatureError if the gateware was built
+        without the pattern trigger.
+        '''
+        self.require('pattern_trigger')
+        if len(pattern) > self.pattern_depth:
+            raise ValueError("At most {} pattern bytes, got {}".format(self.pattern_depth, len(pattern)))
+        if mask is None:
+            mask = bytes([0xff] * len(pattern))
+        if len(mask) != len(pattern):
+            raise ValueError("The mask has {} bytes, the pattern {}".format(len(mask), len(pattern)))
+        divisor = round(self.core_clock() / baudrate)
+        if not 4 <= divisor <= 0xffff:
+            raise ValueError("{} baud is out of range for a {} Hz core clock".format(baudrate, self.core_clock()))
+        pattern = int.from_bytes(bytes(reversed(pattern)), 'little')
+        mask = int.from_bytes(bytes(reversed(mask)), 'little')
+        self.configure((
+            (self.pattern_divisor_reg, divisor),
+            (self.pattern_reg, pattern & 0xffffffff),
+            (self.pattern_reg + 4, pattern >> 32),
+            (self.pattern_mask_reg, mask & 0xffffffff),
+            (self.pattern_mask_reg + 4, mask >> 32),
+        ), rearm=False)
+
+    def stop_sweep(self):
+        '''Stop a running sweep.'''
+        self.writew(0x40, 0)
+
+    def sweep_status(self):
+        '''Return (busy, attempts done) for the current sweep.'''
+        reg40, _, done = self.read_block(0x40, 3)
+        return ((reg40 >> 1) & 1, done)
 
-        self._send_bytes([self.commands['WRITE']])
-        #self.put_dword(addr)
-        self._send_bytes([addr & 0xff])
-        self.put_dword(word)
+    def resync(self):
+        '''Reload the shadow cache from the hardware.
+
+        Use this after anything other than this Glitcher may have changed the
+        registers, e.g. a reset of the FPGA.
+        '''
+        self.invalidate()
+        self.read_block(0x00, 0x68 // 4 + 1)
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('port', type=str, help="The serial port you want to connect to.")
     parser.add_argument('-b', '--baudrate', type=int, default=115200, help="The baud rate you want to connect at. Default: 115200")
+    parser.add_argument('-s', '--switch-baudrate', type=int, help="Switch to this baud rate after connecting.")
+    parser.add_argument('-f', '--framed', action='store_true', help="Use the framed protocol.")
     args = parser.parse_args()
 
-    glitcher = Glitcher(args.port, baudrate=args.baudrate)
+    glitcher = Glitcher(args.port, baudrate=args.baudrate, framed=args.framed)
+    if args.switch_baudrate:
+        print("Switched to {:.0f} baud".format(glitcher.set_baudrate(args.switch_baudrate)))
     glitcher.verbose=True
 
     events = 16
     delay_seconds = 5
     duration_seconds = 3
 
-    delay_ticks = 12e6 * delay_seconds
-    duration_ticks = 12e6 * duration_seconds
+    delay_ticks = glitcher.ticks(delay_seconds)
+    duration_ticks = glitcher.ticks(duration_seconds)
 
-    config = (
-        (0x10, 0),
-        (0x20, 0),
-        (0x30, 0),
+    glitcher.configure((
         (0x00, (0 << 4) | (0 << 2) | (0 << 1) | 0),
         (0x14, events),
         (0x24, delay_ticks),
         (0x34, duration_ticks),
-        (0x30, 1),
-        (0x20, 1),
         (0x10, 1),
-    )
-
-    for addr, data in config:
-        glitcher.readw(addr)
-        glitcher.writew(addr, int(data))
-        glitcher.readw(addr)
+        (0x20, 1),
+        (0x30, 1),
+    ))
 
     glitcher.verbose=False
     while True:
-        event_trigger = (glitcher.readw(0x10) >> 1) & 1
-        delay_trigger_delayed = (glitcher.readw(0x20) >> 1) & 1
-        pulse = (glitcher.readw(0x30) >> 1) & 1
-        fired = (glitcher.readw(0x30) >> 2) & 1
+        regs = glitcher.read_block(0x10, 11)
+        reg10, event_count = regs[0x0 // 4], regs[0x8 // 4]
+        reg20, delay_count = regs[0x10 // 4], regs[0x18 // 4]
+        reg30, pulse_count = regs[0x20 // 4], regs[0x28 // 4]
+        event_trigger = (reg10 >> 1) & 1
+        delay_trigger_delayed = (reg20 >> 1) & 1
+        pulse = (reg30 >> 1) & 1
+        fired = (reg30 >> 2) & 1
         print("event_trigger: {}, delay_trigger_delayed: {}, pulse: {}, fired: {}".format(event_trigger, delay_trigger_delayed, pulse, fired))
-        event_count = glitcher.readw(0x18)
-        delay_count = glitcher.readw(0x28)
-        pulse_count = glitcher.readw(0x38)
         print("event_count: 0x{:08x}, delay_count: 0x{:08x}, pulse_count: 0x{:08x}".format(
                 event_count, delay_count, pulse_count))
         if fired and not pulse:
             break
-        time.sleep(1)
+        if fired:
+            time.sleep(1)
+        else:
+            glitcher.wait_for_fire(timeout=1)
 
 
 if __name__ == "__main__":
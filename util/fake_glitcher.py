@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import collections
+import os
+import random
+import struct
+import threading
+import time
+import tty
+
+from control import crc8
+
+
+class FakeGlitcher:
+    '''A software stand-in for the glitcher's UART command interface.
+
+    Bytes from the host are fed to `process()`, which returns the bytes the
+    device would send back. The register file follows GlitchCoreWb, but the
+    glitch chain is reduced to "fires as soon as all three stages are armed",
+    and a sweep with a fixed number of attempts finishes as soon as it starts.
+    Every fire is recorded in the result FIFO.
+
+    noise: Probability of flipping one bit of each byte received and sent,
+        to exercise the host's error handling.
+    '''
+
+    # Address: mask of the bits the host can write.
+    writable = {
+        0x00: 0x0000007f,
+        0x08: 0x00000001,
+        0x10: 0x00000001,
+        0x14: 0xffffffff,
+        0x20: 0x00000001,
+        0x24: 0xffffffff,
+        0x30: 0x00000001,
+        0x34: 0xffffffff,
+        0x40: 0x00000001,
+        0x44: 0xffffffff,
+        0x4c: 0xffffffff,
+        0x50: 0xffffffff,
+        0x54: 0xffffffff,
+        0x58: 0xffffffff,
+        0x60: 0xffffffff,
+        0x64: 0xffffffff,
+        0x68: 0xffffffff,
+        0x98: 0x0000007f,
+        0x9c: 0x0000003f,
+        0xa0: 0xffffffff,
+        0xa8: 0x0000ffff,
+        0xb0: 0xffffffff,
+        0xb4: 0xffffffff,
+        0xb8: 0xffffffff,
+        0xbc: 0xffffffff,
+        0xf0: 0x0000ffff,
+        0xf8: 0x00000001,
+    }
+
+    clk_freq = 12000000
+    result_fifo_depth = 256
+    # Built with every optional part, as bits of 0x78 (see
+    # Glitcher.feature_names).
+    features = 0b111111
+    framing = True
+    baud_switching = True
+    rx_fifo = True
+    sequence_depth = 64
+
+    # Registers that only take effect on a commit while staging is on.
+    staged_regs = (0x00, 0x10, 0x14, 0x20, 0x24, 0x30, 0x34, 0xa8, 0xb0, 0xb4, 0xb8, 0xbc)
+
+    # Request payload length of each command in framed mode.
+    frame_lengths = {ord(b'\r'): 1, ord(b'N'): 1, ord(b'R'): 2, ord(b'W'): 6, ord(b'B'): 3, ord(b'D'): 3}
+
+    def __init__(self, noise=0, seed=None):
+        self.regs = {addr: 0 for addr in self.writable}
+        self.regs[0xf0] = round(self.clk_freq / 115200)
+        self.regs[0xa8] = round(self.clk_freq / 115200)
+        self.status = {}
+        self.notify = False
+        self.notify_seq = 0
+        self.buf = bytearray()
+        self.noise = noise
+        self.rng = random.Random(seed)
+        self.fired = False
+        self.results = collections.deque()
+        self.attempt = 0
+        self.result_overflow = False
+        self.timestamps = [0] * 5
+        self.sequence = [(0, 0)] * self.sequence_depth
+        self.staged = {}
+
+    def _record(self, delay, width, events):
+        if len(self.results) < self.result_fifo_depth:
+            timestamp = int(time.monotonic() * self.clk_freq) & 0xffffffff
+            self.results.append((self.attempt, delay, width, events, timestamp))
+        else:
+            self.result_overflow = True
+        self.attempt = (self.attempt + 1) & 0xffffffff
+
+    def _stamp(self):
+        '''Make up pipeline edge timestamps for a fire happening now, with a
+        cycle of jitter where the event counter output is synchronized.'''
+        now = int(time.monotonic() * self.clk_freq)
+        trigger = now + 2 + self.rng.randrange(2)
+        delayed = trigger + self.regs[0x24]
+        self.timestamps = [now, trigger, delayed, delayed, delayed + self.regs[0x34]]
+
+    def _sweep(self):
+        '''Record the results of a whole sweep, as if it ran instantly.'''
+        delay, width = self.regs[0x50], self.regs[0x60]
+        for _ in range(self.regs[0x44]):
+            self._record(delay, width, self.regs[0x14])
+            if self.regs[0x68] and width + self.regs[0x68] <= self.regs[0x64]:
+                width += self.regs[0x68]
+                continue
+            width = self.regs[0x60]
+            if self.regs[0x58] and delay + self.regs[0x58] <= self.regs[0x54]:
+                delay += self.regs[0x58]
+            else:
+                delay = self.regs[0x50]
+
+    def _update(self):
+        event_arm = self.regs[0x10] & 1
+        delay_arm = self.regs[0x20] & 1
+        pulse_arm = self.regs[0x30] & 1
+
+        self.status = {}
+        if self.regs[0x40] & 1:
+            if self.regs[0x44]:
+                self.status[0x48] = self.regs[0x44]
+            else:
+                self.status[0x40] = 1 << 1
+        fired = bool(event_arm and delay_arm and pulse_arm)
+        if fired and not self.fired:
+            # A sequence reports the thresholds of its last pulse.
+            if self.regs[0x98]:
+                self._record(*self.sequence[self.regs[0x98] - 1], self.regs[0x14])
+            else:
+                self._record(self.regs[0x24], self.regs[0x34], self.regs[0x14])
+            self._stamp()
+        self.fired = fired
+        if fired:
+            self.status[0x10] = 1 << 1
+            self.status[0x18] = self.regs[0x14]
+            self.status[0x20] = 1 << 1
+            self.status[0x28] = self.regs[0x24]
+            self.status[0x30] = 1 << 2
+            self.status[0x38] = self.regs[0x34]
+
+    def read(self, addr):
+        if addr == 0x78:
+            return self.features
+        if addr == 0xf8:
+            return self.regs[0xf8] | self.framing << 1 | self.baud_switching << 2 | self.rx_fifo << 3
+        if addr in (0x04, 0xf4):
+            return self.clk_freq
+        if addr == 0x70:
+            return len(self.results)
+        if addr == 0x74:
+            return self.result_overflow << 1
+        if addr in (0xc0, 0xc4) and self.features & 1 << 1:
+            return int(time.monotonic() * self.clk_freq) >> (32 if addr & 4 else 0) & 0xffffffff
+        if 0xc8 <= addr < 0xf0:
+            return self.timestamps[(addr - 0xc8) // 8] >> (32 if addr & 4 else 0) & 0xffffffff
+        if 0x80 <= addr <= 0x90 and addr % 4 == 0:
+            if not self.results:
+                return 0
+            word = self.results[0][(addr - 0x80) // 4]
+            if addr == 0x90:
+                self.results.popleft()
+            return word
+        return self.staged.get(addr, self.regs.get(addr, 0)) | self.status.get(addr, 0)
+
+    def write(self, addr, word):
+        if addr == 0xf0 and (word < 4 or not self.baud_switching):
+            return
+        if addr == 0xf8 and not self.framing:
+            return
+        if addr == 0x74:
+            if word & 1:
+                self.results.clear()
+                self.attempt = 0
+                self.result_overflow = False
+            return
+        if addr == 0x08 and not self.features & 1 << 3:
+            return
+        if addr == 0x0c:
+            self.regs.update(self.staged)
+            self.staged = {}
+            if word & 1:
+                arms = {arm: self.regs[arm] for arm in (0x10, 0x20, 0x30)}
+                self.regs.update(dict.fromkeys(arms, 0))
+                self._update()
+                self.regs.update(arms)
+            self._update()
+            return
+        if addr == 0xa8:
+            word = max(word & 0xffff, 4)
+        if addr in self.staged_regs and self.regs[0x08] & 1:
+            self.staged[addr] = word & self.writable[addr]
+            return
+        if addr == 0x98:
+            word = min(word, self.sequence_depth)
+        if addr == 0xa4:
+            index = self.regs[0x9c]
+            self.sequence[index] = (self.regs[0xa0], word)
+            self.regs[0x9c] = (index + 1) % self.sequence_depth
+            return
+        if 0x40 <= addr <= 0x68 and not self.features & 1 << 4:
+            return
+        if addr == 0x40 and word & 1 and not self.regs[0x40] & 1:
+            self.regs[0x40] = 1
+            self._sweep()
+        if addr in self.writable:
+            self.regs[addr] = word & self.writable[addr]
+            self._update()
+
+    def _corrupt(self, data):
+        data = bytearray(data)
+        for i in range(len(data)):
+            if self.rng.random() < self.noise:
+                data[i] ^= 1 << self.rng.randrange(8)
+        return data
+
+    def _command(self, buf):
+        '''Run the command at the start of `buf`.
+
+        Returns the number of bytes it took, or 0 if it isn't complete yet,
+        and the response bytes.
+        '''
+        command = buf[0]
+        if command == ord(b'\r'):
+            self.notify = False
+            return 1, b'OK\r\n'
+        if command == ord(b'N'):
+            self.notify = True
+            return 1, b''
+        if command == ord(b'R'):
+            if len(buf) < 2:
+                return 0, b''
+            return 2, struct.pack('<I', self.read(buf[1]))
+        if command == ord(b'W'):
+            if len(buf) < 6:
+                return 0, b''
+            self.write(buf[1], struct.unpack('<I', buf[2:6])[0])
+            return 6, b''
+        if command == ord(b'B'):
+            if len(buf) < 3:
+                return 0, b''
+            return 3, b''.join(struct.pack('<I', self.read((buf[1] + 4 * i) & 0xff)) for i in range(buf[2]))
+        if command == ord(b'D'):
+            if len(buf) < 3:
+                return 0, b''
+            count = struct.unpack('<H', buf[1:3])[0]
+            return 3, b''.join(struct.pack('<I', self.read(addr)) for _ in range(count) for addr in range(0x80, 0x94, 4))
+        return 1, b''
+
+    @staticmethod
+    def _frame(seq, command, data):
+        frame = bytes([0x7e, seq, command, len(data) // 4]) + data
+        return frame + bytes([crc8(frame)])
+
+    def _frame_command(self, buf):
+        '''Like _command(), for a request frame at the start of `buf`.'''
+        if buf[0] != 0x7e:
+            return 1, b''
+        if len(buf) < 3:
+            return 0, b''
+        length = buf[2]
+        if length == 0 or length > 8:
+            return 3, b''
+        if len(buf) < 4 + length:
+            return 0, b''
+        seq = buf[1]
+        payload = bytes(buf[3:3 + length])
+        if (crc8(buf[:3 + length]) != buf[3 + length] or self.frame_lengths.get(payload[0]) != length
+                or payload[0] == ord(b'D') and struct.unpack('<H', payload[1:3])[0] > 255 // 5):
+            return 4 + length, self._frame(seq, 0x15, b'')
+        _, response = self._command(payload)
+        if payload[0] == ord(b'N'):
+            self.notify_seq = seq
+            return 4 + length, b''
+        return 4 + length, self._frame(seq, payload[0], response)
+
+    def process(self, data):
+        '''Consume bytes from the host and return the response bytes.'''
+        self.buf += self._corrupt(data)
+        out = bytearray()
+        while self.buf:
+            framed = self.regs[0xf8] & 1
+            if framed:
+                used, response = self._frame_command(self.buf)
+            else:
+                used, response = self._command(self.buf)
+            if not used:
+                break
+            del self.buf[:used]
+            out += response
+            if response and not self.rx_fifo:
+                # Whatever arrived while the response went out is lost,
+                # bar the one byte the UART holds.
+                del self.buf[1:]
+            if self.notify and self.read(0x30) & (1 << 2):
+                self.notify = False
+                fire = b'FIRE' + struct.pack('<III', self.read(0x18), self.read(0x28), self.read(0x38))
+                out += self._frame(self.notify_seq, ord(b'N'), fire) if framed else fire
+        return bytes(self._corrupt(out))
+
+
+def serve_pty(device, latency=0):
+    '''Expose `device` on a new pseudo-terminal.
+
+    Returns the path of the pty's slave side, which can be opened with
+    pyserial like a real serial port. The device is served from a daemon
+    thread; `latency` adds a delay (in seconds) before every response.
+    '''
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    path = os.ttyname(slave)
+
+    def serve():
+        while True:
+            try:
+                data = os.read(master, 4096)
+            except OSError:
+                return
+            response = device.process(data)
+            if response:
+                if latency:
+                    time.sleep(latency)
+                os.write(master, response)
+
+    threading.Thread(target=serve, daemon=True).start()
+    return path
+
+
+async def start_server(device, host='127.0.0.1', port=0, latency=0):
+    '''Expose `device` on a TCP socket in the running event loop.
+
+    Returns the asyncio server; the port it listens on can be read from
+    `server.sockets[0].getsockname()`.
+    '''
+    async def serve(reader, writer):
+        while True:
+            data = await reader.read(4096)
+            if not data:
+                break
+            response = device.process(data)
+            if response:
+                if latency:
+                    await asyncio.sleep(latency)
+                writer.write(response)
+                await writer.drain()
+        writer.close()
+
+    return await asyncio.start_server(serve, host, port)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-l', '--latency', type=float, default=0, help="Delay in seconds before each response. Default: 0")
+    parser.add_argument('-t', '--tcp', type=int, help="Listen on this TCP port instead of a pty.")
+    parser.add_argument('-n', '--noise', type=float, default=0, help="Probability of a bit error in each byte. Default: 0")
+    args = parser.parse_args()
+
+    if args.tcp is not None:
+        async def run():
+            server = await start_server(FakeGlitcher(noise=args.noise), port=args.tcp, latency=args.latency)
+            print(server.sockets[0].getsockname(), flush=True)
+            await server.serve_forever()
+        try:
+            asyncio.run(run())
+        except KeyboardInterrupt:
+            pass
+        return
+
+    path = serve_pty(FakeGlitcher(noise=args.noise), latency=args.latency)
+    print(path, flush=True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
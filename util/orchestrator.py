@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+import argparse
+import itertools
+import multiprocessing
+import queue
+import time
+
+from control import Glitcher, UnexpectedDataException
+
+
+def glitch_attempt(glitcher, events, delay, width, timeout=1.0):
+    '''Run one glitch attempt with the given thresholds.
+
+    Returns (fired, event_count, delay_count, pulse_count) as read back once
+    the pulse has finished or `timeout` seconds have passed.
+    '''
+    # Framed mode won't resend the commit by itself if its response is lost,
+    # as it may have re-armed already. Nothing has been read back from the
+    # attempt yet, so here re-arming once more is fine.
+    for retry in range(glitcher.frame_retries + 1):
+        try:
+            glitcher.configure((
+                (0x14, events),
+                (0x24, delay),
+                (0x34, width),
+                (0x10, 1),
+                (0x20, 1),
+                (0x30, 1),
+            ))
+            break
+        except UnexpectedDataException:
+            if retry == glitcher.frame_retries:
+                raise
+
+    deadline = time.monotonic() + timeout
+    glitcher.wait_for_fire(timeout)
+    while True:
+        regs = glitcher.read_block(0x10, 11)
+        reg30 = regs[0x20 // 4]
+        fired = (reg30 >> 2) & 1
+        pulse = (reg30 >> 1) & 1
+        if (fired and not pulse) or time.monotonic() >= deadline:
+            break
+        time.sleep(0.001)
+
+    return (fired, regs[0x08 // 4], regs[0x18 // 4], regs[0x28 // 4])
+
+
+def _worker(worker_id, port, baudrate, attempt, events, tasks, results):
+    '''Worker process: owns one glitcher and runs the chunks it is handed.'''
+    try:
+        glitcher = Glitcher(port, baudrate=baudrate)
+    except Exception as e:
+        results.put((worker_id, None, repr(e)))
+        return
+
+    while True:
+        chunk = tasks.get()
+        if chunk is None:
+            break
+        chunk_id, items = chunk
+        try:
+            chunk_results = [(index, attempt(glitcher, events, delay, width)) for index, delay, width in items]
+        except Exception as e:
+            results.put((worker_id, chunk_id, repr(e)))
+            break
+        results.put((worker_id, chunk_id, chunk_results))
+
+    glitcher.close()
+
+
+class Orchestrator:
+    '''Shard a delay x width sweep over several glitchers.
+
+    Each port is driven by its own worker process. The parameter space is cut
+    into small chunks that are handed out one at a time to whichever worker
+    is idle, so faster boards naturally take more of the work. A chunk that
+    fails or takes longer than `chunk_timeout` is put back in the queue and
+    its board is dropped from the campaign.
+
+    attempt: A picklable callable taking (glitcher, events, delay, width)
+        and returning the result to store for that point.
+    '''
+    def __init__(self, ports, baudrate=115200, attempt=glitch_attempt, chunk_size=16, chunk_timeout=60, verbose=False):
+        self.ports = list(ports)
+        self.baudrate = baudrate
+        self.attempt = attempt
+        self.chunk_size = chunk_size
+        self.chunk_timeout = chunk_timeout
+        self.verbose = verbose
+
+    def run(self, events, delays, widths):
+        '''Run every (delay, width) combination once.
+
+        Returns a list of results in the order of
+        `itertools.product(delays, widths)`.
+        '''
+        points = list(itertools.product(delays, widths))
+        items = [(index, delay, width) for index, (delay, width) in enumerate(points)]
+        pending = [(chunk_id, items[i:i + self.chunk_size])
+                for chunk_id, i in enumerate(range(0, len(items), self.chunk_size))]
+        pending.reverse()
+
+        results = [None] * len(points)
+        remaining = len(pending)
+
+        ctx = multiprocessing.get_context()
+        result_queue = ctx.Queue()
+        workers = {}
+        for worker_id, port in enumerate(self.ports):
+            tasks = ctx.Queue()
+            proc = ctx.Process(target=_worker,
+                    args=(worker_id, port, self.baudrate, self.attempt, events, tasks, result_queue),
+                    daemon=True)
+            proc.start()
+            workers[worker_id] = {'port': port, 'proc': proc, 'tasks': tasks, 'chunk': None, 'started': None, 'done': 0}
+
+        def drop(worker_id, reason):
+            worker = workers.pop(worker_id)
+            if worker['chunk'] is not None:
+                pending.append(worker['chunk'])
+            worker['proc'].terminate()
+            if self.verbose:
+                print("Dropped {}: {}".format(worker['port'], reason))
+
+        try:
+            while remaining:
+                for worker_id, worker in workers.items():
+                    if worker['chunk'] is None and pending:
+                        worker['chunk'] = pending.pop()
+                        worker['started'] = time.monotonic()
+                        worker['tasks'].put(worker['chunk'])
+
+                if not workers:
+                    raise RuntimeError("All glitchers dropped out with {} chunks left".format(remaining))
+
+                try:
+                    worker_id, chunk_id, payload = result_queue.get(timeout=0.1)
+                except queue.Empty:
+                    now = time.monotonic()
+                    for worker_id, worker in list(workers.items()):
+                        if not worker['proc'].is_alive():
+                            drop(worker_id, "worker exited")
+                        elif worker['chunk'] is not None and now - worker['started'] > self.chunk_timeout:
+                            drop(worker_id, "chunk timed out")
+                    continue
+
+                if worker_id not in workers:
+                    continue
+                worker = workers[worker_id]
+                if not isinstance(payload, list):
+                    drop(worker_id, payload)
+                    continue
+
+                for index, result in payload:
+                    results[index] = result
+                worker['chunk'] = None
+                worker['done'] += 1
+                remaining -= 1
+        finally:
+            for worker in workers.values():
+                worker['tasks'].put(None)
+            for worker in workers.values():
+                worker['proc'].join(1)
+                if worker['proc'].is_alive():
+                    worker['proc'].terminate()
+
+        if self.verbose:
+            for worker in workers.values():
+                print("{}: {} chunks".format(worker['port'], worker['done']))
+
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('ports', type=str, nargs='*', help="The serial ports of the glitchers to use.")
+    parser.add_argument('-b', '--baudrate', type=int, default=115200, help="The baud rate you want to connect at. Default: 115200")
+    parser.add_argument('-e', '--events', type=int, default=16, help="Event count threshold. Default: 16")
+    parser.add_argument('-d', '--delays', type=int, nargs=3, metavar=('START', 'STOP', 'STEP'), default=(0, 64, 1), help="Delay tick range. Default: 0 64 1")
+    parser.add_argument('-w', '--widths', type=int, nargs=3, metavar=('START', 'STOP', 'STEP'), default=(1, 9, 1), help="Pulse width tick range. Default: 1 9 1")
+    parser.add_argument('-o', '--output', type=str, help="Write the results to this CSV file.")
+    parser.add_argument('--fake', type=int, default=0, help="Add this many simulated glitchers.")
+    parser.add_argument('--fake-latency', type=float, default=0.005, help="Response latency of the simulated glitchers, in seconds. Default: 0.005")
+    args = parser.parse_args()
+
+    ports = list(args.ports)
+    if args.fake:
+        from fake_glitcher import FakeGlitcher, serve_pty
+        ports += [serve_pty(FakeGlitcher(), latency=args.fake_latency) for _ in range(args.fake)]
+    if not ports:
+        parser.error("no glitchers given")
+
+    delays = range(*args.delays)
+    widths = range(*args.widths)
+
+    start = time.monotonic()
+    results = Orchestrator(ports, baudrate=args.baudrate, verbose=True).run(args.events, delays, widths)
+    elapsed = time.monotonic() - start
+    print("{} attempts on {} glitchers in {:.2f} s ({:.1f} attempts/s)".format(
+            len(results), len(ports), elapsed, len(results) / elapsed))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write("delay,width,fired,event_count,delay_count,pulse_count\n")
+            for (delay, width), result in zip(itertools.product(delays, widths), results):
+                f.write("{},{},{}\n".format(delay, width, ",".join(str(x) for x in result)))
+
+
+if __name__ == "__main__":
+    main()
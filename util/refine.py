@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+import argparse
+import collections
+import importlib
+import random
+
+from orchestrator import glitch_attempt
+
+
+class RefinementSearch:
+    '''Search a delay x width grid by refining around outcome boundaries.
+
+    The grid is first cut into cells `stride` points on a side and only the
+    cell corners are tried. A cell whose corners all give the same outcome is
+    assumed to be uniform and left alone; any other cell is split in four and
+    its new corners are tried, down to single-point cells. Attempts therefore
+    concentrate where the outcome changes (e.g. from "no effect" to "fault",
+    or "fault" to "crash") instead of being spread evenly over regions that
+    never do anything.
+
+    Features smaller than the initial stride that fall entirely inside a
+    cell can be missed, so pick a stride below the narrowest expected fault
+    window.
+
+    measure: A callable taking (delay, width) and returning an outcome,
+        which can be any hashable value.
+    '''
+    def __init__(self, delays, widths, measure, stride=8):
+        self.delays = delays
+        self.widths = widths
+        self.measure = measure
+        self.stride = stride
+        self.results = {}
+        self.uniform = []
+
+    def _outcome(self, i, j):
+        if (i, j) not in self.results:
+            self.results[(i, j)] = self.measure(self.delays[i], self.widths[j])
+        return self.results[(i, j)]
+
+    @staticmethod
+    def _bounds(n, stride):
+        bounds = list(range(0, n, stride))
+        if bounds[-1] != n - 1:
+            bounds.append(n - 1)
+        return bounds
+
+    def run(self, stop_at=None, max_attempts=None):
+        '''Refine until every cell is uniform or a single point.
+
+        stop_at: Stop as soon as this outcome is seen.
+        max_attempts: Stop once this many points have been tried.
+
+        Returns the (delay, width) of the first point with outcome
+        `stop_at`, or None.
+        '''
+        di = self._bounds(len(self.delays), self.stride)
+        wi = self._bounds(len(self.widths), self.stride)
+        cells = collections.deque((i0, i1, j0, j1)
+                for i0, i1 in zip(di, di[1:] or di)
+                for j0, j1 in zip(wi, wi[1:] or wi))
+
+        while cells:
+            i0, i1, j0, j1 = cells.popleft()
+            outcomes = set()
+            for i, j in ((i0, j0), (i0, j1), (i1, j0), (i1, j1)):
+                outcome = self._outcome(i, j)
+                outcomes.add(outcome)
+                if stop_at is not None and outcome == stop_at:
+                    return (self.delays[i], self.widths[j])
+                if max_attempts is not None and len(self.results) >= max_attempts:
+                    return None
+
+            if len(outcomes) == 1:
+                self.uniform.append((i0, i1, j0, j1))
+                continue
+            if i1 - i0 <= 1 and j1 - j0 <= 1:
+                continue
+
+            im = (i0 + i1) // 2
+            jm = (j0 + j1) // 2
+            for a0, a1 in ((i0, im), (im, i1)) if i1 - i0 > 1 else ((i0, i1),):
+                for b0, b1 in ((j0, jm), (jm, j1)) if j1 - j0 > 1 else ((j0, j1),):
+                    cells.append((a0, a1, b0, b1))
+
+        return None
+
+    def outcome_map(self):
+        '''Return the full grid of outcomes, indexed [delay][width].
+
+        Points that were never tried take the outcome of the uniform cell
+        they lie in, or None if they are not in one.
+        '''
+        grid = [[None] * len(self.widths) for _ in self.delays]
+        for i0, i1, j0, j1 in self.uniform:
+            outcome = self.results[(i0, j0)]
+            for i in range(i0, i1 + 1):
+                for j in range(j0, j1 + 1):
+                    grid[i][j] = outcome
+        for (i, j), outcome in self.results.items():
+            grid[i][j] = outcome
+        return grid
+
+
+def glitcher_measure(glitcher, events, classify):
+    '''Build a RefinementSearch measure function that drives a Glitcher.
+
+    classify: A callable taking the glitch_attempt() result and returning
+        the outcome, typically by checking how the target responded (no
+        effect, fault, crash). The glitcher alone can't tell: once the event
+        threshold is reached the pulse fires at every point.
+    '''
+    def measure(delay, width):
+        return classify(glitch_attempt(glitcher, events, delay, width))
+    return measure
+
+
+def load_classifier(spec):
+    '''Import the classify callable named by "module:function".'''
+    module, _, name = spec.partition(':')
+    if not module or not name:
+        raise ValueError("Expected module:function, got {!r}".format(spec))
+    return getattr(importlib.import_module(module), name)
+
+
+def synthetic_map(delays, widths, rng):
+    '''Return a measure function for a made-up target.
+
+    Pulses that are too wide crash the target (outcome 2); a small, randomly
+    placed window of delays and widths faults it (outcome 1); everything
+    else has no effect (outcome 0).
+    '''
+    crash_width = rng.randrange(len(widths) // 2, len(widths))
+    fault_delay = rng.randrange(len(delays))
+    fault_delay_span = rng.randrange(2, max(3, len(delays) // 16))
+    fault_width = rng.randrange(crash_width // 2, crash_width)
+    fault_width_span = rng.randrange(2, max(3, len(widths) // 8))
+
+    def measure(delay, width):
+        i = delays.index(delay)
+        j = widths.index(width)
+        if j >= crash_width:
+            return 2
+        if fault_delay <= i < fault_delay + fault_delay_span and fault_width <= j < fault_width + fault_width_span:
+            return 1
+        return 0
+    return measure
+
+
+def benchmark(delays, widths, stride, trials, seed):
+    rng = random.Random(seed)
+    points = len(delays) * len(widths)
+    total_attempts = 0
+    total_first = 0
+    total_brute_first = 0
+    total_wrong = 0
+    found = 0
+    for _ in range(trials):
+        measure = synthetic_map(delays, widths, rng)
+        truth = [[measure(d, w) for w in widths] for d in delays]
+
+        search = RefinementSearch(delays, widths, measure, stride=stride)
+        search.run()
+        guess = search.outcome_map()
+        total_attempts += len(search.results)
+        total_wrong += sum(g != t for gr, tr in zip(guess, truth) for g, t in zip(gr, tr))
+
+        search = RefinementSearch(delays, widths, measure, stride=stride)
+        if search.run(stop_at=1) is not None:
+            found += 1
+            total_first += len(search.results)
+            brute = [t for row in truth for t in row]
+            total_brute_first += brute.index(1) + 1
+
+    print("Grid: {} delays x {} widths = {} points, stride {}".format(len(delays), len(widths), points, stride))
+    print("Full map: {:.0f} attempts on average ({:.1%} of brute force), {:.2%} of points misclassified".format(
+            total_attempts / trials, total_attempts / trials / points, total_wrong / trials / points))
+    if found:
+        print("First fault: {:.0f} attempts on average, brute force {:.0f} ({} of {} maps)".format(
+                total_first / found, total_brute_first / found, found, trials))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('port', type=str, nargs='?', help="The serial port you want to connect to.")
+    parser.add_argument('-b', '--baudrate', type=int, default=115200, help="The baud rate you want to connect at. Default: 115200")
+    parser.add_argument('-e', '--events', type=int, default=16, help="Event count threshold. Default: 16")
+    parser.add_argument('-d', '--delays', type=int, nargs=3, metavar=('START', 'STOP', 'STEP'), default=(0, 256, 1), help="Delay tick range. Default: 0 256 1")
+    parser.add_argument('-w', '--widths', type=int, nargs=3, metavar=('START', 'STOP', 'STEP'), default=(1, 65, 1), help="Pulse width tick range. Default: 1 65 1")
+    parser.add_argument('-s', '--stride', type=int, default=8, help="Initial cell size. Default: 8")
+    parser.add_argument('--benchmark', type=int, metavar='TRIALS', help="Run against this many synthetic outcome maps instead of hardware.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the synthetic outcome maps. Default: 0")
+    parser.add_argument('-c', '--classify', type=str, metavar='MODULE:FUNC', help="Target classifier, called with each glitch_attempt() result to return its outcome. Required with hardware.")
+    args = parser.parse_args()
+
+    delays = range(*args.delays)
+    widths = range(*args.widths)
+
+    if args.benchmark:
+        benchmark(delays, widths, args.stride, args.benchmark, args.seed)
+        return
+
+    if args.port is None:
+        parser.error("no port given")
+    if args.classify is None:
+        parser.error("--classify is required with hardware; the glitcher can only tell whether the pulse fired")
+    classify = load_classifier(args.classify)
+
+    from control import Glitcher
+    glitcher = Glitcher(args.port, baudrate=args.baudrate)
+    search = RefinementSearch(delays, widths, glitcher_measure(glitcher, args.events, classify), stride=args.stride)
+    search.run()
+    glitcher.close()
+
+    print("{} attempts".format(len(search.results)))
+    for (i, j), outcome in sorted(search.results.items()):
+        print("{},{},{}".format(delays[i], widths[j], outcome))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+import argparse
+import array
+import os
+import struct
+import time
+
+from control import Glitcher
+from orchestrator import glitch_attempt
+
+
+class SweepGrid:
+    '''The event count x delay x pulse width grid of a sweep.
+
+    Points are numbered with the pulse width varying fastest. The grid is
+    never materialized; a point is computed from its index on demand.
+    '''
+    def __init__(self, events, delays, widths):
+        self.events = range(*events) if isinstance(events, tuple) else events
+        self.delays = range(*delays) if isinstance(delays, tuple) else delays
+        self.widths = range(*widths) if isinstance(widths, tuple) else widths
+
+    def __len__(self):
+        return len(self.events) * len(self.delays) * len(self.widths)
+
+    def __getitem__(self, index):
+        '''Return the (events, delay, width) point with the given index.'''
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        index, w = divmod(index, len(self.widths))
+        e, d = divmod(index, len(self.delays))
+        return (self.events[e], self.delays[d], self.widths[w])
+
+    def ranges(self):
+        '''Return the grid as nine (start, stop, step) integers.'''
+        return tuple(x for r in (self.events, self.delays, self.widths) for x in (r.start, r.stop, r.step))
+
+
+class SweepStoreError(Exception):
+    pass
+
+class SweepStore:
+    '''An append-only file of fixed-size sweep records.
+
+    The file starts with a header describing the grid, followed by one
+    record per attempt in grid order: the outcome code and the event, delay
+    and pulse counters read back after the attempt (registers 0x18, 0x28 and
+    0x38). Because every record has the same size, the number of completed
+    attempts, and so the point to resume from, follows from the file size.
+
+    Records are buffered in memory and written out every `checkpoint`
+    attempts. Anything not yet written when the sweep is interrupted is
+    simply run again.
+    '''
+    magic = b'GCSWEEP2'
+    # The ranges as signed 64-bit integers, so that counter values up to
+    # 2**32 - 1 and negative steps (and the stops that go with them) fit.
+    header = struct.Struct('<8s9q')
+    record = struct.Struct('<BIII')
+
+    def __init__(self, path, grid, checkpoint=256):
+        self.path = path
+        self.grid = grid
+        self.checkpoint = checkpoint
+        self.buf = bytearray()
+
+        if os.path.exists(path) and os.path.getsize(path) >= self.header.size:
+            with open(path, 'rb') as f:
+                magic, *ranges = self.header.unpack(f.read(self.header.size))
+            if magic != self.magic:
+                raise SweepStoreError("{} is not a sweep store".format(path))
+            if tuple(ranges) != grid.ranges():
+                raise SweepStoreError("{} was recorded with a different grid: {}".format(path, ranges))
+            size = os.path.getsize(path) - self.header.size
+            self.written = size // self.record.size
+            # Drop a record that was only partially written.
+            if size % self.record.size:
+                os.truncate(path, self.header.size + self.written * self.record.size)
+            self.f = open(path, 'ab')
+        else:
+            self.written = 0
+            self.f = open(path, 'wb')
+            self.f.write(self.header.pack(self.magic, *grid.ranges()))
+            self.sync()
+
+    def __len__(self):
+        '''The number of attempts recorded, including unsynced ones.'''
+        return self.written + len(self.buf) // self.record.size
+
+    def append(self, outcome, event_count, delay_count, pulse_count):
+        self.buf += self.record.pack(outcome, event_count, delay_count, pulse_count)
+        if len(self.buf) >= self.checkpoint * self.record.size:
+            self.sync()
+
+    def sync(self):
+        '''Write buffered records out and make sure they reach the disk.'''
+        self.f.write(self.buf)
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.written += len(self.buf) // self.record.size
+        self.buf = bytearray()
+
+    def close(self):
+        self.sync()
+        self.f.close()
+
+    def columns(self):
+        '''Load every synced record into four compact arrays.
+
+        Returns (outcomes, event_counts, delay_counts, pulse_counts) where
+        index i of each array belongs to grid point i.
+        '''
+        outcomes = array.array('B')
+        counts = [array.array('I') for _ in range(3)]
+        with open(self.path, 'rb') as f:
+            f.seek(self.header.size)
+            data = f.read(self.written * self.record.size)
+        for outcome, *values in self.record.iter_unpack(data):
+            outcomes.append(outcome)
+            for column, value in zip(counts, values):
+                column.append(value)
+        return (outcomes, *counts)
+
+
+class SweepEngine:
+    '''Run every point of a SweepGrid once, recording into a SweepStore.
+
+    attempt: A callable taking (glitcher, events, delay, width) and returning
+        (outcome, event_count, delay_count, pulse_count). The outcome is a
+        small integer whose meaning is up to the caller, e.g. 0 for no
+        effect, 1 for a fault and 2 for a crash.
+    '''
+    def __init__(self, glitcher, grid, store, attempt=glitch_attempt):
+        self.glitcher = glitcher
+        self.grid = grid
+        self.store = store
+        self.attempt = attempt
+
+    def run(self, progress=None):
+        '''Run the sweep from the first unrecorded point to the end.'''
+        for index in range(len(self.store), len(self.grid)):
+            events, delay, width = self.grid[index]
+            self.store.append(*self.attempt(self.glitcher, events, delay, width))
+            if progress and (index + 1) % progress == 0:
+                print("{}/{}".format(index + 1, len(self.grid)), flush=True)
+        self.store.sync()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('port', type=str, nargs='?', help="The serial port you want to connect to.")
+    parser.add_argument('store', type=str, help="The file to record results in. An existing sweep is resumed.")
+    parser.add_argument('-b', '--baudrate', type=int, default=115200, help="The baud rate you want to connect at. Default: 115200")
+    parser.add_argument('-e', '--events', type=int, nargs=3, metavar=('START', 'STOP', 'STEP'), default=(16, 17, 1), help="Event count threshold range. Default: 16 17 1")
+    parser.add_argument('-d', '--delays', type=int, nargs=3, metavar=('START', 'STOP', 'STEP'), default=(0, 64, 1), help="Delay tick range. Default: 0 64 1")
+    parser.add_argument('-w', '--widths', type=int, nargs=3, metavar=('START', 'STOP', 'STEP'), default=(1, 9, 1), help="Pulse width tick range. Default: 1 9 1")
+    parser.add_argument('-c', '--checkpoint', type=int, default=256, help="Attempts between checkpoints. Default: 256")
+    parser.add_argument('--fake', action='store_true', help="Use a simulated glitcher instead of a serial port.")
+    args = parser.parse_args()
+
+    port = args.port
+    if args.fake:
+        from fake_glitcher import FakeGlitcher, serve_pty
+        port = serve_pty(FakeGlitcher())
+    if port is None:
+        parser.error("no port given")
+
+    grid = SweepGrid(tuple(args.events), tuple(args.delays), tuple(args.widths))
+    store = SweepStore(args.store, grid, checkpoint=args.checkpoint)
+    print("Resuming at attempt {} of {}".format(len(store), len(grid)))
+
+    glitcher = Glitcher(port, baudrate=args.baudrate)
+    start = time.monotonic()
+    done = len(store)
+    try:
+        SweepEngine(glitcher, grid, store).run(progress=args.checkpoint)
+    finally:
+        store.close()
+        glitcher.close()
+    elapsed = time.monotonic() - start
+    print("{} attempts in {:.2f} s".format(len(store) - done, elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+import argparse
+import math
+
+from control import Glitcher
+from orchestrator import glitch_attempt
+
+
+# Each stage of the pipeline, as the pair of timestamps it lies between.
+stages = (
+    ('event_to_trigger', 'event_in', 'event_trigger'),
+    ('trigger_to_delayed', 'event_trigger', 'delay_trigger'),
+    ('delayed_to_glitch', 'delay_trigger', 'glitch_rise'),
+    ('glitch_width', 'glitch_rise', 'glitch_fall'),
+    ('event_to_glitch', 'event_in', 'glitch_rise'),
+)
+
+
+def latencies(timestamps):
+    '''Turn one attempt's timestamps into per-stage latencies in cycles.
+
+    A stage whose end comes before its start is left out: one of its latches
+    didn't see an edge in this attempt and still holds an older value.
+    '''
+    result = {}
+    for name, start, end in stages:
+        delta = timestamps[end] - timestamps[start]
+        if delta >= 0:
+            result[name] = delta
+    return result
+
+
+class LatencyStats:
+    '''Collect per-attempt stage latencies and summarize them.'''
+    def __init__(self):
+        self.samples = {name: [] for name, _, _ in stages}
+
+    def add(self, attempt_latencies):
+        for name, value in attempt_latencies.items():
+            self.samples[name].append(value)
+
+    def summary(self):
+        '''Return {stage: (count, mean, stdev, min, max)} in cycles.
+
+        Stages without any samples are left out. The spread between min and
+        max is the peak-to-peak jitter.
+        '''
+        result = {}
+        for name, values in self.samples.items():
+            if not values:
+                continue
+            mean = sum(values) / len(values)
+            stdev = math.sqrt(sum((v - mean) ** 2 for v in values) / len(values))
+            result[name] = (len(values), mean, stdev, min(values), max(values))
+        return result
+
+
+def measure(glitcher, attempts, events, delay, width, attempt=glitch_attempt):
+    '''Run `attempts` glitch attempts and return their LatencyStats.'''
+    stats = LatencyStats()
+    for _ in range(attempts):
+        attempt(glitcher, events, delay, width)
+        timestamps = glitcher.read_timestamps()
+        # Every attempt fires, so at least the pulse latches are set unless
+        # the gateware leaves them out.
+        if not any(timestamps[name] for name in glitcher.timestamp_names[1:]):
+            raise RuntimeError("No edge timestamps; the gateware was built without them (generate --timestamps)")
+        stats.add(latencies(timestamps))
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('port', type=str, nargs='?', help="The serial port you want to connect to.")
+    parser.add_argument('-b', '--baudrate', type=int, default=115200, help="The baud rate you want to connect at. Default: 115200")
+    parser.add_argument('-n', '--attempts', type=int, default=100, help="Number of attempts. Default: 100")
+    parser.add_argument('-e', '--events', type=int, default=16, help="Event count threshold. Default: 16")
+    parser.add_argument('-d', '--delay', type=int, default=100, help="Delay ticks. Default: 100")
+    parser.add_argument('-w', '--width', type=int, default=10, help="Pulse width ticks. Default: 10")
+    parser.add_argument('--fake', action='store_true', help="Use a simulated glitcher instead of a serial port.")
+    args = parser.parse_args()
+
+    port = args.port
+    if args.fake:
+        from fake_glitcher import FakeGlitcher, serve_pty
+        port = serve_pty(FakeGlitcher())
+    if port is None:
+        parser.error("no port given")
+
+    glitcher = Glitcher(port, baudrate=args.baudrate)
+    clk_freq = glitcher.core_clock()
+    stats = measure(glitcher, args.attempts, args.events, args.delay, args.width)
+    glitcher.close()
+
+    ns = 1e9 / clk_freq
+    print("{:20} {:>6} {:>12} {:>10} {:>10} {:>10} {:>12}".format(
+            "stage", "n", "mean", "stdev", "min", "max", "jitter (ns)"))
+    for name, (count, mean, stdev, low, high) in stats.summary().items():
+        print("{:20} {:6} {:12.2f} {:10.2f} {:10} {:10} {:12.1f}".format(
+                name, count, mean, stdev, low, high, (high - low) * ns))
+
+
+if __name__ == "__main__":
+    main()